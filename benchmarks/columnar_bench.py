@@ -0,0 +1,114 @@
+"""
+Benchmark for the columnar message store. Compares a deque of ChatMessage objects with a ColumnarMessageStore
+holding the same history: resident bytes per message (tracemalloc), a filtered newest-first page, a full
+filtered scan, and counting a sender's messages in a time range
+
+Run with:
+    python -m benchmarks.columnar_bench
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import gc
+import time
+import tracemalloc
+from collections import deque
+from bin.constants import *
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+from src.message_store import ColumnarMessageStore
+
+ROOM_NAME = "columnar_bench"
+ALIASES = [f"bench_user_{alias_num}" for alias_num in range(50)]
+BLOCKED = frozenset(ALIASES[:5])
+START_TIME = 1_650_000_000.0
+
+
+def build_messages(num_messages: int):
+    for sequence_num in range(num_messages):
+        mess_props = MessageProperties(MESSAGE_RECEIVED, ROOM_NAME, ALIASES[(sequence_num * 7) % 50],
+                                       ALIASES[sequence_num % 50], sequence_num, START_TIME + sequence_num,
+                                       START_TIME + sequence_num + 1)
+        yield ChatMessage(f"benchmark message number {sequence_num}", mess_props)
+
+
+def build_deque(num_messages: int) -> deque:
+    room = deque()
+    for message in build_messages(num_messages):
+        room.appendleft(message)
+    return room
+
+
+def build_store(num_messages: int) -> ColumnarMessageStore:
+    store = ColumnarMessageStore(ROOM_NAME)
+    store.extend(build_messages(num_messages))
+    return store
+
+
+def traced_bytes(builder, num_messages: int):
+    """Build a container and return it with the bytes it still holds"""
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    container = builder(num_messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return container, current - baseline
+
+
+def time_call(function, repeat: int) -> float:
+    """Return the best time of repeat calls in milliseconds"""
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed_time = time.perf_counter() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+    return best_time * 1000
+
+
+def deque_page(room: deque, limit: int) -> list:
+    page = list()
+    for message in room:
+        if message.mess_props.from_user not in BLOCKED:
+            page.append(message)
+            if len(page) >= limit:
+                break
+    return page
+
+
+def deque_count(room: deque, from_user: str, start_time: float, end_time: float) -> int:
+    return sum(1 for message in room if message.mess_props.from_user == from_user
+               and start_time <= message.mess_props.sent_timestamp < end_time)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-messages", type=int, default=200_000, help="Messages in the room history")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions, best is reported")
+    args = parser.parse_args()
+
+    room, deque_bytes = traced_bytes(build_deque, args.num_messages)
+    store, store_bytes = traced_bytes(build_store, args.num_messages)
+    print(f"{'bytes per message':<34} {'deque':>12} {'columnar':>12}")
+    print(f"{'':<34} {deque_bytes / args.num_messages:>12.1f} {store_bytes / args.num_messages:>12.1f}")
+
+    end_time = START_TIME + args.num_messages
+    middle = START_TIME + args.num_messages / 2
+    cases = [
+        ("newest 100, 5 senders blocked", lambda: deque_page(room, 100),
+         lambda: store.select(limit=100, exclude_senders=BLOCKED)),
+        ("full scan, 5 senders blocked", lambda: deque_page(room, args.num_messages),
+         lambda: store.select(exclude_senders=BLOCKED)),
+        ("count sender in half the range", lambda: deque_count(room, ALIASES[1], middle, end_time),
+         lambda: store.count(from_user=ALIASES[1], start_time=middle, end_time=end_time)),
+    ]
+    print(f"{'operation (ms)':<34} {'deque':>12} {'columnar':>12}")
+    for label, deque_call, store_call in cases:
+        print(f"{label:<34} {time_call(deque_call, args.repeat):>12.3f} {time_call(store_call, args.repeat):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
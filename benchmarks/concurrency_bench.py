@@ -0,0 +1,84 @@
+"""
+Concurrency benchmark for the API. Drives the FastAPI app in process against the latency injected MongoDB
+stand-in and reports throughput as the number of in-flight requests grows. Compares running the blocking
+MongoDB work inline on the event loop (how the endpoints used to behave) with the KeyedExecutor
+
+Run with:
+    python -m benchmarks.concurrency_bench [--latency-ms 20]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import asyncio
+import functools
+import time
+import httpx
+import room_chat_api
+from bin import db
+from bin.executor import KeyedExecutor
+from benchmarks.stand_in import LatencyClient
+
+CONCURRENCY_LEVELS = [1, 4, 16, 32, 64, 128]
+NUM_ROOMS = 32
+
+
+class InlineExecutor:
+    """Runs the blocking call directly on the event loop, the way the endpoints called pymongo before"""
+
+    async def run(self, key, function, *args, **kwargs):
+        return functools.partial(function, *args, **kwargs)()
+
+    def shutdown(self) -> None:
+        pass
+
+
+async def run_requests(num_requests: int, concurrency: int) -> float:
+    """Send num_requests requests with at most concurrency in flight and return the requests per second"""
+    transport = httpx.ASGITransport(app=room_chat_api.app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_request(client: httpx.AsyncClient, request_num: int) -> None:
+        room_name = f"concurrency_bench_{request_num % NUM_ROOMS}"
+        async with semaphore:
+            if request_num % 2 == 0:
+                response = await client.post("/message/", params={
+                    'room_name': room_name, 'message': f"message {request_num}",
+                    'from_alias': "bench_from", 'to_alias': "bench_to"})
+            else:
+                response = await client.get("/messages/", params={
+                    'alias': "bench_to", 'room_name': room_name, 'messages_to_get': 20})
+            response.raise_for_status()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start_time = time.perf_counter()
+        await asyncio.gather(*(one_request(client, request_num) for request_num in range(num_requests)))
+        elapsed_time = time.perf_counter() - start_time
+    return num_requests / elapsed_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Injected MongoDB round trip latency")
+    parser.add_argument("--requests", type=int, default=256, help="Requests per measurement")
+    args = parser.parse_args()
+
+    db.set_client(LatencyClient(latency_ms=args.latency_ms))
+    #   Warm the rooms so both modes measure steady state requests rather than room restores
+    room_chat_api.executor = KeyedExecutor()
+    asyncio.run(run_requests(NUM_ROOMS * 2, NUM_ROOMS))
+
+    print(f"executor workers: {KeyedExecutor().max_workers}")
+    print(f"{'in flight':>10} {'inline req/s':>14} {'executor req/s':>16} {'speed up':>10}")
+    for concurrency in CONCURRENCY_LEVELS:
+        room_chat_api.executor = InlineExecutor()
+        inline_rate = asyncio.run(run_requests(args.requests, concurrency))
+        room_chat_api.executor = KeyedExecutor()
+        executor_rate = asyncio.run(run_requests(args.requests, concurrency))
+        room_chat_api.executor.shutdown()
+        print(f"{concurrency:>10} {inline_rate:>14.1f} {executor_rate:>16.1f} {executor_rate / inline_rate:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
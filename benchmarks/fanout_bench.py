@@ -0,0 +1,99 @@
+"""
+Fan-out benchmark. Holds a large number of idle subscribers, each with a writer task parked on its send
+queue the way a WebSocket connection is, and reports the memory held per subscription and the time for
+one message to reach every subscriber. Compares encoding the message once per room with encoding it
+once per subscriber
+
+Run with:
+    python -m benchmarks.fanout_bench [--subscribers 10000]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import asyncio
+import time
+import tracemalloc
+from bin.constants import *
+from bin.fanout import RoomFanOut, Subscriber, encode_message_frame
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+ROOM_NAME = "fanout_bench"
+NUM_MESSAGES = 20
+
+
+class PerSubscriberFanOut(RoomFanOut):
+    """Encodes the message separately for every subscriber, the cost the shared frame avoids"""
+
+    def __init__(self, subscribers: list) -> None:
+        super().__init__()
+        self.__subscribers = subscribers
+
+    def publish(self, room_name: str, messages) -> int:
+        batch = [(subscriber, encode_message_frame(room_name, message))
+                 for message in messages for subscriber in self.__subscribers]
+        self.__subscribers[0].loop.call_soon_threadsafe(self.__deliver, batch)
+        return len(batch)
+
+    @staticmethod
+    def __deliver(batch: list) -> None:
+        for subscriber, frame in batch:
+            subscriber.offer(frame)
+
+
+async def measure(num_subscribers: int) -> None:
+    received = 0
+    all_received = asyncio.Event()
+
+    async def idle_writer(subscriber: Subscriber) -> None:
+        nonlocal received
+        while await subscriber.next_frame() is not None:
+            received += 1
+            if received == target:
+                all_received.set()
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    fanout = RoomFanOut()
+    subscribers = [Subscriber(f"bench_{counter}") for counter in range(num_subscribers)]
+    writers = [asyncio.create_task(idle_writer(subscriber)) for subscriber in subscribers]
+    for subscriber in subscribers:
+        fanout.subscribe(subscriber, ROOM_NAME)
+    await asyncio.sleep(0)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{num_subscribers} idle subscriptions hold {(held - baseline) / 1024 / 1024:.1f} MiB "
+          f"({(held - baseline) / num_subscribers:.0f} bytes each)")
+
+    messages = [ChatMessage(f"fan-out message {counter} " + "x" * 200,
+                            MessageProperties(MESSAGE_SENT, ROOM_NAME, "bench_to", "bench_from", counter))
+                for counter in range(NUM_MESSAGES)]
+    print(f"{'mode':>16} {'publish ms':>12} {'delivered ms':>14}")
+    for name, publisher in (("per subscriber", PerSubscriberFanOut(subscribers)), ("encode once", fanout)):
+        received = 0
+        target = num_subscribers * NUM_MESSAGES
+        all_received.clear()
+        start_time = time.perf_counter()
+        #   Publish from a pool thread, the way ChatRoom does on the executor
+        await asyncio.to_thread(publisher.publish, ROOM_NAME, messages)
+        publish_time = time.perf_counter() - start_time
+        await all_received.wait()
+        delivered_time = time.perf_counter() - start_time
+        print(f"{name:>16} {publish_time * 1000:>12.1f} {delivered_time * 1000:>14.1f}")
+
+    for subscriber in subscribers:
+        subscriber.close()
+    await asyncio.gather(*writers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--subscribers", type=int, default=10000, help="Idle subscriptions to hold")
+    args = parser.parse_args()
+    asyncio.run(measure(args.subscribers))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Logger overhead benchmark. Measures the time a request thread spends per log call with the level at INFO,
+comparing the synchronous file and stream handlers the Logger used to attach with the queued Logger, and
+debug messages that format an object dump eagerly with ones that are gated on the level
+
+Run with:
+    python -m benchmarks.logger_bench [--calls 20000]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+#   Keep the listener off the terminal; it has to be set before the Logger reads its constants
+os.environ.setdefault("LOG_TO_STDERR", "false")
+os.environ.setdefault("LOG_DIR", os.path.join(tempfile.gettempdir(), "logger_bench"))
+
+from bin.logger import Logger, log_stats
+
+DUMP = {'room_name': "logger_bench", 'member_list': [{'alias': f"user_{counter}", 'blocked_users': []} for counter in range(50)]}
+
+
+def synchronous_logger(log_dir: str) -> logging.Logger:
+    """A logger set up the way Logger used to be: DEBUG level, a FileHandler and a StreamHandler"""
+    sync_log = logging.getLogger("logger_bench_sync")
+    sync_log.propagate = False
+    sync_log.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("[%(levelname)s]\t[%(asctime)s] %(message)s")
+    file_handler = logging.FileHandler(os.path.join(log_dir, "logger_bench_sync.log"), mode='w')
+    file_handler.setFormatter(formatter)
+    sync_log.addHandler(file_handler)
+    sync_log.addHandler(logging.StreamHandler(open(os.devnull, 'w')))
+    return sync_log
+
+
+def time_calls(name: str, num_calls: int, call) -> None:
+    start_time = time.perf_counter()
+    for counter in range(num_calls):
+        call(counter)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"{name:>38} {elapsed_time / num_calls * 1e6:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=20000, help="Log calls per case")
+    args = parser.parse_args()
+
+    log_dir = os.environ["LOG_DIR"]
+    os.makedirs(log_dir, exist_ok=True)
+    sync_log = synchronous_logger(log_dir)
+    queued_log = Logger("logger_bench")
+    queued_log.log_obj.propagate = False
+    queued_log.log_obj.setLevel(logging.INFO)
+
+    print(f"{'case':>38} {'us / call':>10}")
+    time_calls("sync info", args.calls, lambda counter: sync_log.info(f"[+] Sent message {counter}"))
+    time_calls("sync debug with object dump", args.calls, lambda counter: sync_log.debug(f"[*] Restored {DUMP}"))
+    time_calls("queued info", args.calls, lambda counter: queued_log(f"[+] Sent message {counter}"))
+    time_calls("queued info, lazy args", args.calls, lambda counter: queued_log("[+] Sent message %s", 'i', counter))
+    time_calls("suppressed debug, eager object dump", args.calls, lambda counter: queued_log(f"[*] Restored {DUMP}", 'd'))
+    time_calls("suppressed debug, gated object dump", args.calls,
+               lambda counter: queued_log.enabled('d') and queued_log(f"[*] Restored {DUMP}", 'd'))
+
+    start_time = time.perf_counter()
+    while log_stats()['queued'] > 0:
+        time.sleep(0.001)
+    print(f"listener drained its backlog {(time.perf_counter() - start_time) * 1000:.1f} ms after the last call, "
+          f"{log_stats()['dropped']} records dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Memory benchmark for resident messages. Measures the bytes held per ChatMessage with tracemalloc, comparing
+the previous dict-backed classes that stored datetime objects and fresh alias strings with the slotted
+classes that store epoch floats and interned aliases
+
+Run with:
+    python -m benchmarks.memory_bench
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime
+from bin.constants import *
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+ROOM_NAME = "memory_bench"
+ALIASES = [f"bench_user_{alias_num}" for alias_num in range(20)]
+
+
+class LegacyMessageProperties:
+    """MessageProperties as it was before __slots__: an instance __dict__ and datetime times"""
+
+    def __init__(self, mess_type, room_name, to_user, from_user, sequence_num=-1, sent_time=None, rec_time=None):
+        self.__mess_type = mess_type
+        self.__room_name = room_name
+        self.__from_user = from_user
+        self.__to_user = to_user
+        self.__sequence_num = sequence_num
+        self.__sent_time = sent_time
+        self.__rec_time = rec_time
+
+
+class LegacyChatMessage:
+    """ChatMessage as it was before __slots__"""
+
+    def __init__(self, message, mess_props):
+        self.__message = message
+        self.__mess_props = mess_props
+        self.__dirty = True
+
+
+def copy_str(value: str) -> str:
+    """Build an equal string in a new object, the way strings decoded from a request or a document arrive"""
+    return "".join(list(value))
+
+
+def build_legacy(num_messages: int) -> list:
+    messages = list()
+    for sequence_num in range(num_messages):
+        mess_props = LegacyMessageProperties(MESSAGE_RECEIVED, copy_str(ROOM_NAME), copy_str(ALIASES[sequence_num % 20]),
+                                             copy_str(ALIASES[(sequence_num + 1) % 20]), sequence_num,
+                                             datetime.now(), datetime.now())
+        messages.append(LegacyChatMessage(f"benchmark message {sequence_num}", mess_props))
+    return messages
+
+
+def build_slotted(num_messages: int) -> list:
+    messages = list()
+    for sequence_num in range(num_messages):
+        mess_props = MessageProperties(MESSAGE_RECEIVED, copy_str(ROOM_NAME), copy_str(ALIASES[sequence_num % 20]),
+                                       copy_str(ALIASES[(sequence_num + 1) % 20]), sequence_num,
+                                       datetime.now(), datetime.now())
+        messages.append(ChatMessage(f"benchmark message {sequence_num}", mess_props))
+    return messages
+
+
+def bytes_per_message(builder, num_messages: int) -> float:
+    """Return the traced bytes still allocated per message once builder has returned"""
+    gc.collect()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    messages = builder(num_messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return (current - baseline) / num_messages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-messages", type=int, default=100_000, help="Messages held resident per run")
+    args = parser.parse_args()
+
+    legacy_bytes = bytes_per_message(build_legacy, args.num_messages)
+    slotted_bytes = bytes_per_message(build_slotted, args.num_messages)
+    print(f"{'messages':>10} {'legacy B/msg':>14} {'slotted B/msg':>14} {'saved':>8}")
+    print(f"{args.num_messages:>10} {legacy_bytes:>14.1f} {slotted_bytes:>14.1f} "
+          f"{1 - slotted_bytes / legacy_bytes:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark for ChatRoom.put. Grows a room with already persisted history and times a fixed number of
+puts at each size, showing that the cost of a put stays constant as the room grows
+
+Run with:
+    python -m benchmarks.persist_bench [--in-memory]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import time
+from bin import db
+from bin.constants import *
+from src.chat_room import ChatRoom
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+ROOM_SIZES = [10, 1_000, 10_000, 100_000]
+PUTS_PER_SIZE = 200
+
+
+def make_message(room_name: str, sequence_num: int) -> ChatMessage:
+    """Build a message for the benchmark room"""
+    mess_props = MessageProperties(
+        mess_type=MESSAGE_SENT,
+        room_name=room_name,
+        to_user="bench_to",
+        from_user="bench_from",
+        sequence_num=sequence_num)
+    return ChatMessage(message=f"benchmark message {sequence_num}", mess_props=mess_props)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--in-memory", action="store_true", help="Run against mongomock instead of MongoDB")
+    parser.add_argument("--puts", type=int, default=PUTS_PER_SIZE, help="Timed puts at each room size")
+    args = parser.parse_args()
+
+    if args.in_memory:
+        import mongomock
+        db.set_client(mongomock.MongoClient())
+
+    room_name = f"persist_bench_{int(time.time())}"
+    room = ChatRoom(room_name=room_name)
+    sequence_num = 0
+    print(f"{'room size':>12} {'us/put':>12}")
+    for room_size in ROOM_SIZES:
+        #   Fill the room with history that is already saved, so only the timed puts are dirty
+        while len(room) < room_size:
+            message = make_message(room_name, sequence_num)
+            message.dirty = False
+            room.appendleft(message)
+            sequence_num += 1
+
+        start_time = time.perf_counter()
+        for _ in range(args.puts):
+            room.put(make_message(room_name, sequence_num))
+            sequence_num += 1
+        elapsed_time = time.perf_counter() - start_time
+        print(f"{room_size:>12} {elapsed_time / args.puts * 1e6:>12.1f}")
+
+    db.close_client()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Publisher throughput benchmark. Publishes messages through a RoomPublisher to the in-process broker with a
+simulated confirm round trip, and reports messages per second as the confirm batch (the number of
+unconfirmed publishes a channel may have in flight) grows. A batch of 1 is a publish that waits for its
+own confirm
+
+Run with:
+    python -m benchmarks.publish_bench [--latency-ms 1] [--messages 20000]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import time
+from tests.local_broker import LocalBroker
+from bin.publisher import RoomPublisher
+
+CONFIRM_BATCHES = [1, 10, 100, 1000]
+NUM_ROOMS = 16
+MESSAGE_BODY = b'{"message": "' + b'x' * 200 + b'"}'
+
+
+def measure(confirm_batch: int, num_channels: int, num_messages: int, latency_ms: float) -> tuple:
+    """Publish num_messages and wait for every confirm. Returns messages per second and acks received"""
+    broker = LocalBroker(confirm_latency_ms=latency_ms)
+    publisher = RoomPublisher(broker.connect, num_channels=num_channels, confirm_batch=confirm_batch)
+    start_time = time.perf_counter()
+    for counter in range(num_messages):
+        publisher.publish(f"publish_bench_{counter % NUM_ROOMS}", MESSAGE_BODY)
+    publisher.flush(timeout=600)
+    elapsed_time = time.perf_counter() - start_time
+    publisher.close()
+    return num_messages / elapsed_time, broker.stats()['acks']
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Simulated confirm round trip")
+    parser.add_argument("--messages", type=int, default=20000, help="Messages per measurement")
+    parser.add_argument("--channels", type=int, default=4, help="Channels in the publisher pool")
+    args = parser.parse_args()
+
+    print(f"{'confirm batch':>14} {'msg/s':>12} {'acks':>8}")
+    for confirm_batch in CONFIRM_BATCHES:
+        rate, acks = measure(confirm_batch, args.channels, args.messages, args.latency_ms)
+        print(f"{confirm_batch:>14} {rate:>12.0f} {acks:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for ChatRoom.get_messages. Compares the previous read path, which copied the whole deque
+once for every message returned, with the islice / generator based read path on rooms of 10, 1k and 100k
+messages
+
+Run with:
+    python -m benchmarks.read_bench
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import time
+import mongomock
+from bin import db
+from bin.constants import *
+from src.chat_room import ChatRoom
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+ROOM_SIZES = [10, 1_000, 100_000]
+READER_ALIAS = "bench_reader"
+
+
+def legacy_get_messages(room: ChatRoom, num_messages: int) -> list:
+    """The read path before the generator rewrite: index into a fresh copy of the deque per message"""
+    blocked_users = list()
+    message_container = list()
+    if num_messages == GET_ALL_MESSAGES or num_messages > room.length:
+        for message in list(room):
+            if message.mess_props.from_user not in blocked_users:
+                if message.mess_props.rec_time == None:
+                    message.mess_props.rec_time = time.time()
+                message_container.append(message.message)
+    else:
+        for message_iterator in range(0, num_messages):
+            message = list(room)[message_iterator]
+            if message.mess_props.from_user not in blocked_users:
+                if message.mess_props.rec_time == None:
+                    message.mess_props.rec_time = time.time()
+                message_container.append(message.message)
+    return message_container
+
+
+def build_room(room_size: int) -> ChatRoom:
+    """Build a room holding room_size messages that are already persisted and received"""
+    room = ChatRoom(room_name=f"read_bench_{room_size}")
+    for sequence_num in range(room_size):
+        mess_props = MessageProperties(MESSAGE_RECEIVED, room.room_name, READER_ALIAS, "bench_from", sequence_num)
+        mess_props.rec_time = mess_props.sent_time
+        message = ChatMessage(f"benchmark message {sequence_num}", mess_props)
+        message.dirty = False
+        room.appendleft(message)
+    return room
+
+
+def time_call(function, repeat: int) -> float:
+    """Return the best time of repeat calls in milliseconds"""
+    best_time = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        elapsed_time = time.perf_counter() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+    return best_time * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-messages", type=int, default=100, help="Messages requested per read")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed repetitions, best is reported")
+    args = parser.parse_args()
+
+    db.set_client(mongomock.MongoClient())
+    print(f"{'room size':>10} {'read':>10} {'legacy ms':>12} {'islice ms':>12} {'speed up':>10}")
+    for room_size in ROOM_SIZES:
+        room = build_room(room_size)
+        for label, num_messages in [(f"last {args.num_messages}", args.num_messages), ("all", GET_ALL_MESSAGES)]:
+            legacy_ms = time_call(lambda: legacy_get_messages(room, num_messages), args.repeat)
+            new_ms = time_call(lambda: room.get_messages(READER_ALIAS, num_messages=num_messages), args.repeat)
+            print(f"{room_size:>10} {label:>10} {legacy_ms:>12.3f} {new_ms:>12.3f} {legacy_ms / new_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Contention benchmark for sequence number allocation. Many rooms allocate sequence numbers concurrently
+against a latency injected MongoDB stand-in, comparing the legacy single shared counter document with
+the per room hi/lo SequenceAllocator
+
+Run with:
+    python -m benchmarks.sequence_bench [--rooms 50] [--per-room 200] [--latency-ms 1]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument
+from bin.constants import *
+from bin.sequence import SequenceAllocator
+from benchmarks.stand_in import LatencyClient
+
+
+def legacy_allocate(collection, room_name: str) -> int:
+    """Allocation as done before the hi/lo allocator: one $inc on a document shared by every room"""
+    counter = collection.find_one_and_update(
+        {'_id': SEQUENCE_LEGACY_ID},
+        {'$inc': {room_name: 1}},
+        projection={room_name: True, '_id': False},
+        upsert=True,
+        return_document=ReturnDocument.AFTER)
+    return counter[room_name]
+
+
+def run(name: str, allocate, rooms: int, per_room: int, client: LatencyClient) -> None:
+    """Allocate per_room numbers in each room, one worker thread per room, and report throughput"""
+    def fill_room(room_index: int) -> list:
+        room_name = f"room{room_index}"
+        return [allocate(room_name) for _ in range(per_room)]
+
+    start_round_trips = client.round_trips
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=rooms) as executor:
+        results = list(executor.map(fill_room, range(rooms)))
+    elapsed_time = time.perf_counter() - start_time
+
+    for sequence_nums in results:
+        assert sequence_nums == sorted(sequence_nums) and len(set(sequence_nums)) == per_room
+    total = rooms * per_room
+    round_trips = client.round_trips - start_round_trips
+    print(f"{name:>10} {total:>10} {elapsed_time:>10.3f} {total / elapsed_time:>14.0f} {round_trips:>12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, default=50, help="Rooms allocating concurrently")
+    parser.add_argument("--per-room", type=int, default=200, help="Sequence numbers allocated per room")
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Injected round trip latency")
+    parser.add_argument("--block-size", type=int, default=SEQUENCE_BLOCK_SIZE, help="Hi/lo block size")
+    args = parser.parse_args()
+
+    client = LatencyClient(latency_ms=args.latency_ms)
+    collection = client[DB_NAME][DB_SEQUENCE_COLLECTION]
+    allocator = SequenceAllocator(collection, block_size=args.block_size)
+
+    print(f"{'allocator':>10} {'numbers':>10} {'seconds':>10} {'numbers/sec':>14} {'round trips':>12}")
+    run("legacy", lambda room_name: legacy_allocate(collection, room_name), args.rooms, args.per_room, client)
+    run("hi/lo", allocator.allocate, args.rooms, args.per_room, client)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Latency injected stand-in for MongoDB used by the benchmarks. Wraps an in-memory mongomock client so
+that every collection call costs a configurable round trip, and writes to the same document are
+serialised the way MongoDB serialises writes to one document
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+import time
+
+WRITE_METHODS = {'find_one_and_update', 'update_one', 'replace_one', 'delete_one'}
+
+
+class LatencyCollection:
+    """Collection proxy that sleeps for one round trip per call and counts calls"""
+
+    def __init__(self, collection, latency_ms: float, stats: dict) -> None:
+        self.__collection = collection
+        self.__latency = latency_ms / 1000
+        self.__stats = stats
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.__collection, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        def call(*args, **kwargs):
+            with self.__stats['lock']:
+                self.__stats['round_trips'] += 1
+            if name in WRITE_METHODS and args and isinstance(args[0], dict) and '_id' in args[0]:
+                #   Writes to one document queue behind each other
+                with self.__document_lock(args[0]['_id']):
+                    time.sleep(self.__latency)
+                    return attribute(*args, **kwargs)
+            time.sleep(self.__latency)
+            return attribute(*args, **kwargs)
+        return call
+
+    def __eq__(self, other) -> bool:
+        return self is other
+
+    def __hash__(self) -> int:
+        return id(self)
+
+    def __document_lock(self, document_id) -> threading.Lock:
+        with self.__stats['lock']:
+            key = (self.__collection.full_name, document_id)
+            return self.__stats['document_locks'].setdefault(key, threading.Lock())
+
+
+class LatencyDatabase:
+    """Database proxy that hands out LatencyCollection objects"""
+
+    def __init__(self, database, latency_ms: float, stats: dict, client) -> None:
+        self.__database = database
+        self.__latency_ms = latency_ms
+        self.__stats = stats
+        self.client = client
+
+    def get_collection(self, name: str) -> LatencyCollection:
+        return LatencyCollection(self.__database.get_collection(name), self.__latency_ms, self.__stats)
+
+    def __getitem__(self, name: str) -> LatencyCollection:
+        return self.get_collection(name)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get_collection(name)
+
+
+class LatencyClient:
+    """MongoClient stand-in backed by mongomock, with an injected round trip latency"""
+
+    def __init__(self, latency_ms: float = 1.0) -> None:
+        import mongomock
+        self.__client = mongomock.MongoClient()
+        self.__latency_ms = latency_ms
+        self.stats = {'round_trips': 0, 'lock': threading.Lock(), 'document_locks': dict()}
+
+    @property
+    def round_trips(self) -> int:
+        return self.stats['round_trips']
+
+    def get_database(self, name: str) -> LatencyDatabase:
+        return LatencyDatabase(self.__client.get_database(name), self.__latency_ms, self.stats, self)
+
+    def __getitem__(self, name: str) -> LatencyDatabase:
+        return self.get_database(name)
+
+    def close(self) -> None:
+        self.__client.close()
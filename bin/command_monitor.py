@@ -0,0 +1,157 @@
+"""
+MongoDB command monitoring. A pymongo CommandListener attributes every command to the request that caused it
+through a context variable, so each request knows how many round trips it made, to which collections, and
+how long it waited on them
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+from contextvars import ContextVar
+from pymongo import monitoring
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("commandMonitor")
+
+
+class RequestCommandStats:
+    """MongoDB commands made on behalf of one request. Commands of a request may run on several executor
+    threads at once, so updates are locked"""
+
+    __slots__ = ('commands', 'failures', 'duration_ms', 'documents', 'by_command', '_lock')
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.failures = 0
+        self.duration_ms = 0.0
+        self.documents = 0
+        self.by_command = dict()
+        self._lock = threading.Lock()
+
+    def record(self, command_name: str, collection: str, duration_ms: float, documents: int, failed: bool = False) -> None:
+        key = (command_name, collection)
+        with self._lock:
+            self.commands += 1
+            self.failures += failed
+            self.duration_ms += duration_ms
+            self.documents += documents
+            self.by_command[key] = self.by_command.get(key, 0) + 1
+
+    def over_budget(self, max_commands: int = DB_BUDGET_MAX_COMMANDS, max_ms: float = DB_BUDGET_MAX_MS) -> bool:
+        """Check if the request exceeded the command budget. A limit of 0 is not checked
+
+        Args:
+            max_commands (int, optional): Most commands per request. Defaults to DB_BUDGET_MAX_COMMANDS
+            max_ms (float, optional): Most milliseconds spent in commands. Defaults to DB_BUDGET_MAX_MS
+        Returns:
+            bool: True if either limit was exceeded
+        """
+        return (0 < max_commands < self.commands) or (0 < max_ms < self.duration_ms)
+
+    def summary(self) -> str:
+        """Return the commands made per (command, collection), most frequent first"""
+        with self._lock:
+            counts = sorted(self.by_command.items(), key=lambda item: -item[1])
+        return ", ".join(f"{command_name} {collection}: {count}" for (command_name, collection), count in counts)
+
+
+_request_stats: ContextVar[RequestCommandStats | None] = ContextVar("request_command_stats", default=None)
+
+
+def begin_request():
+    """Start attributing commands made in the current context to a new RequestCommandStats. Blocking calls
+    must run in a copy of the context (KeyedExecutor does this) for their commands to be attributed
+
+    Returns:
+        Token: Pass to end_request
+    """
+    return _request_stats.set(RequestCommandStats())
+
+
+def current_request_stats() -> RequestCommandStats | None:
+    """Return the stats of the request being served in the current context, or None outside a request"""
+    return _request_stats.get()
+
+
+def end_request(token) -> RequestCommandStats | None:
+    """Stop attributing commands to the request started with token
+
+    Args:
+        token (Token): Returned by begin_request
+    Returns:
+        RequestCommandStats | None: Commands made by the request
+    """
+    stats = _request_stats.get()
+    _request_stats.reset(token)
+    return stats
+
+
+def count_documents_returned(command_name: str, reply: dict) -> int:
+    """Count the documents a command reply carries: the batch of a find, aggregate or getMore, the n of
+    a write or count, 1 for findAndModify, 0 otherwise"""
+    cursor = reply.get('cursor')
+    if cursor is not None:
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', ())))
+    if command_name == 'findAndModify':
+        return 1 if reply.get('value') is not None else 0
+    return int(reply.get('n', 0))
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Attributes pymongo commands to the request in the current context, and keeps process wide totals.
+    pymongo calls started and succeeded on the thread that sent the command, so the context variable of the
+    caller is visible. Commands made outside a request, e.g. write-behind flushes, only count in the totals"""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__pending = dict()
+        self.__commands = 0
+        self.__failures = 0
+        self.__duration_ms = 0.0
+
+    def started(self, event) -> None:
+        if _request_stats.get() is None:
+            return
+        collection = event.command.get(event.command_name)
+        with self.__lock:
+            self.__pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event) -> None:
+        self.__finish(event, count_documents_returned(event.command_name, event.reply), failed=False)
+
+    def failed(self, event) -> None:
+        self.__finish(event, 0, failed=True)
+
+    def __finish(self, event, documents: int, failed: bool) -> None:
+        duration_ms = event.duration_micros / 1000
+        with self.__lock:
+            self.__commands += 1
+            self.__failures += failed
+            self.__duration_ms += duration_ms
+            collection = self.__pending.pop((event.connection_id, event.request_id), None)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.record(event.command_name, collection or "", duration_ms, documents, failed)
+
+    def stats(self) -> dict:
+        """Return the process wide command counters
+
+        Returns:
+            dict: Commands, failed commands and milliseconds spent in commands
+        """
+        with self.__lock:
+            return {'commands': self.__commands, 'failures': self.__failures, 'duration_ms': self.__duration_ms}
+
+
+_monitor = CommandMonitor()
+
+
+def get_command_monitor() -> CommandMonitor:
+    """Return the process wide CommandMonitor, registered on the shared MongoClient
+
+    Returns:
+        CommandMonitor: Shared listener
+    """
+    return _monitor
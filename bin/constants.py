@@ -7,6 +7,14 @@ load_dotenv(find_dotenv())
 __author__ = "Zac Foteff"
 __version__ = "1.0.0."
 
+#   Logging Constants
+LOG_DIR = os.environ.get("LOG_DIR") or os.path.join(os.getcwd(), "logs")
+LOG_LEVEL = (os.environ.get("LOG_LEVEL") or "INFO").upper()
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES") or 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT") or 5)
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE") or 100000)
+LOG_TO_STDERR = (os.environ.get("LOG_TO_STDERR") or "true").lower() == "true"
+
 #   MongoDB Constants
 TEST_DB_USERNAME = os.environ.get("DB_USERNAME")
 TEST_DB_PASSWORD = os.environ.get("DB_PASSWORD")
@@ -21,6 +29,63 @@ DB_ROOM_LIST_COLLECTION = 'rooms'
 DB_USER_LIST_COLLECTION = 'users'
 DB_DEFAULT_ROOM_LIST = 'main'
 DB_DEFAULT_USER_LIST = 'global'
+DB_CHAT_ROOM_COLLECTION = 'rooms'
+DB_SEQUENCE_COLLECTION = 'sequence'
+DB_RECEIPT_COLLECTION = 'receipts'
+DB_NAME = os.environ.get("DB_NAME") or "cpsc313"
+
+#   MongoDB connection pool Constants
+DB_MAX_POOL_SIZE = int(os.environ.get("DB_MAX_POOL_SIZE") or 50)
+DB_MIN_POOL_SIZE = int(os.environ.get("DB_MIN_POOL_SIZE") or 0)
+DB_MAX_IDLE_TIME_MS = int(os.environ.get("DB_MAX_IDLE_TIME_MS") or 60000)
+DB_CONNECT_TIMEOUT_MS = int(os.environ.get("DB_CONNECT_TIMEOUT_MS") or 5000)
+DB_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("DB_SERVER_SELECTION_TIMEOUT_MS") or 5000)
+DB_SOCKET_TIMEOUT_MS = int(os.environ.get("DB_SOCKET_TIMEOUT_MS") or 10000)
+DB_READ_PREFERENCE = os.environ.get("DB_READ_PREFERENCE") or "primary"
+
+#   MongoDB command monitoring Constants
+DB_COMMAND_MONITORING_ENABLED = (os.environ.get("DB_COMMAND_MONITORING_ENABLED") or "true").lower() == "true"
+DB_METRICS_HEADER_ENABLED = (os.environ.get("DB_METRICS_HEADER_ENABLED") or "true").lower() == "true"
+DB_BUDGET_MAX_COMMANDS = int(os.environ.get("DB_BUDGET_MAX_COMMANDS") or 0)
+DB_BUDGET_MAX_MS = float(os.environ.get("DB_BUDGET_MAX_MS") or 0)
+DB_COMMAND_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+#   Sequence number Constants
+SEQUENCE_BLOCK_SIZE = int(os.environ.get("SEQUENCE_BLOCK_SIZE") or 100)
+SEQUENCE_LEGACY_ID = 'userid'
+SEQUENCE_OWNER_LEASE_SECONDS = float(os.environ.get("SEQUENCE_OWNER_LEASE_SECONDS") or 30)
+
+#   Write-behind Constants
+WRITE_BEHIND_ENABLED = (os.environ.get("WRITE_BEHIND_ENABLED") or "false").lower() == "true"
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get("WRITE_BEHIND_MAX_BATCH") or 500)
+WRITE_BEHIND_MAX_LATENCY_MS = int(os.environ.get("WRITE_BEHIND_MAX_LATENCY_MS") or 20)
+
+#   Read receipt Constants
+RECEIPT_WRITE_BEHIND_ENABLED = (os.environ.get("RECEIPT_WRITE_BEHIND_ENABLED") or "true").lower() == "true"
+RECEIPT_FLUSH_INTERVAL_MS = int(os.environ.get("RECEIPT_FLUSH_INTERVAL_MS") or 1000)
+
+#   API Constants
+#   Each blocking call holds at most one pooled MongoDB connection, so workers past DB_MAX_POOL_SIZE would
+#   only wait on a connection checkout
+API_MAX_WORKERS = min(int(os.environ.get("API_MAX_WORKERS") or 32), DB_MAX_POOL_SIZE)
+BATCH_MAX_MESSAGES = int(os.environ.get("BATCH_MAX_MESSAGES") or 1000)
+LONG_POLL_MAX_SECONDS = float(os.environ.get("LONG_POLL_MAX_SECONDS") or 30)
+SSE_KEEPALIVE_SECONDS = float(os.environ.get("SSE_KEEPALIVE_SECONDS") or 15)
+
+#   WebSocket Constants
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE") or 256)
+WS_MAX_ROOMS_PER_CONNECTION = int(os.environ.get("WS_MAX_ROOMS_PER_CONNECTION") or 100)
+WS_SLOW_CONSUMER_DROP = "drop"
+WS_SLOW_CONSUMER_DISCONNECT = "disconnect"
+WS_SLOW_CONSUMER_POLICY = (os.environ.get("WS_SLOW_CONSUMER_POLICY") or WS_SLOW_CONSUMER_DROP).lower()
+WS_CLOSE_SLOW_CONSUMER = 1013
+WS_MAX_PENDING_REPLIES = int(os.environ.get("WS_MAX_PENDING_REPLIES") or 64)
+WS_CLOSE_POLICY_VIOLATION = 1008
+
+#   Request metrics Constants
+METRICS_LATENCY_BUCKETS = tuple(float(bound) for bound in (
+    os.environ.get("METRICS_LATENCY_BUCKETS") or "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+METRICS_ROUTE_CACHE_SIZE = int(os.environ.get("METRICS_ROUTE_CACHE_SIZE") or 10000)
 
 #   RMQ Constants
 RMQ_DEV_HOST = "localhost"
@@ -32,6 +97,21 @@ RMQ_PASS = "CPSC313"
 RMQ_DEFAULT_PUBLIC_QUEUE = "general"
 RMQ_DEFAULT_PUBLIC_EXCHANGE = ""
 RMQ_PRIVATE_QUEUE = "foteff"
+RMQ_HOST = os.environ.get("RMQ_HOST") or RMQ_DEV_HOST
+RMQ_ROOM_EXCHANGE_PREFIX = "room."
+RMQ_PUBLISH_ENABLED = (os.environ.get("RMQ_PUBLISH_ENABLED") or "false").lower() == "true"
+RMQ_PUBLISH_CHANNELS = int(os.environ.get("RMQ_PUBLISH_CHANNELS") or 4)
+RMQ_CONFIRM_BATCH = int(os.environ.get("RMQ_CONFIRM_BATCH") or 100)
+RMQ_PUBLISH_MAX_PENDING = int(os.environ.get("RMQ_PUBLISH_MAX_PENDING") or 100000)
+RMQ_PUBLISH_MAX_NACKS = int(os.environ.get("RMQ_PUBLISH_MAX_NACKS") or 5)
+RMQ_DECLARED_EXCHANGES_MAX = int(os.environ.get("RMQ_DECLARED_EXCHANGES_MAX") or 1024)
+RMQ_CONFIRM_TIMEOUT_SECONDS = float(os.environ.get("RMQ_CONFIRM_TIMEOUT_SECONDS") or 5)
+RMQ_RECONNECT_MIN_SECONDS = float(os.environ.get("RMQ_RECONNECT_MIN_SECONDS") or 0.5)
+RMQ_RECONNECT_MAX_SECONDS = float(os.environ.get("RMQ_RECONNECT_MAX_SECONDS") or 30)
+RMQ_CONSUMER_PREFETCH = int(os.environ.get("RMQ_CONSUMER_PREFETCH") or 500)
+RMQ_CONSUMER_BATCH = int(os.environ.get("RMQ_CONSUMER_BATCH") or 200)
+RMQ_CONSUMER_MAX_WAIT_MS = int(os.environ.get("RMQ_CONSUMER_MAX_WAIT_MS") or 50)
+RMQ_DEAD_LETTER_SUFFIX = os.environ.get("RMQ_DEAD_LETTER_SUFFIX") or ".rejected"
 GET_ALL_MESSAGES = -1
 MESSAGE_RECEIVED = 1
 MESSAGE_SENT = 0
@@ -39,6 +119,25 @@ MESSAGE_SENT = 0
 #   ChatRoom Constants
 CHAT_ROOM_TYPE_PUBLIC = 100
 CHAT_ROOM_TYPE_PRIVATE = 200
+CHAT_ROOM_RESTORE_LIMIT = int(os.environ.get("CHAT_ROOM_RESTORE_LIMIT") or 200)
+CHAT_ROOM_COLUMNAR_HISTORY = (os.environ.get("CHAT_ROOM_COLUMNAR_HISTORY") or "false").lower() == "true"
+CHAT_ROOM_OVERHEAD_BYTES = 4096
+CHAT_MESSAGE_OVERHEAD_BYTES = 240
+STREAM_CHUNK_SIZE = 256
+
+#   Search Constants
+SEARCH_RESULT_LIMIT = int(os.environ.get("SEARCH_RESULT_LIMIT") or 50)
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT") or 500)
+SEARCH_MAX_TERMS = 8
+SEARCH_MAX_PREFIX_EXPANSION = 256
+SEARCH_INDEX_TOKEN_OVERHEAD_BYTES = 200
+SEARCH_INDEX_IDLE_SECONDS = float(os.environ.get("SEARCH_INDEX_IDLE_SECONDS") or 600)
+
+#   RoomRegistry Constants
+ROOM_REGISTRY_MAX_ROOMS = int(os.environ.get("ROOM_REGISTRY_MAX_ROOMS") or 1000)
+ROOM_REGISTRY_MAX_BYTES = int(os.environ.get("ROOM_REGISTRY_MAX_BYTES") or 256 * 1024 * 1024)
+ROOM_REGISTRY_TTL_SECONDS = float(os.environ.get("ROOM_REGISTRY_TTL_SECONDS") or 0)
+ROOM_REGISTRY_REFRESH_SECONDS = float(os.environ.get("ROOM_REGISTRY_REFRESH_SECONDS") or 1.0)
 
 #   RoomList Constants
 DEFAULT_ROOM_LIST_ID = "roomlist_foteff"
@@ -0,0 +1,187 @@
+"""
+Shared MongoDB connection manager. Hands out a single, lazily created MongoClient so every
+ChatRoom, UserList and RoomList in the process reuses the same connection pool
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+from pymongo import MongoClient, ASCENDING, DeleteOne, InsertOne
+from pymongo.database import Database
+from bin.constants import *
+from bin.logger import Logger
+from bin.command_monitor import get_command_monitor
+
+log = Logger("db")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """Return the process wide MongoClient, creating it on first use. The pool size, timeouts and read
+    preference are read from the DB_* constants so they can be tuned through the environment. With
+    DB_COMMAND_MONITORING_ENABLED the shared CommandMonitor is registered to attribute commands to requests
+
+    Returns:
+        MongoClient: Shared client instance
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # PROD ONLY: _client = MongoClient(PROD_DB_HOST, PROD_DB_PORT, ...)
+                _client = MongoClient(
+                    TEST_DB_HOST,
+                    maxPoolSize=DB_MAX_POOL_SIZE,
+                    minPoolSize=DB_MIN_POOL_SIZE,
+                    maxIdleTimeMS=DB_MAX_IDLE_TIME_MS,
+                    connectTimeoutMS=DB_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=DB_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=DB_SOCKET_TIMEOUT_MS,
+                    readPreference=DB_READ_PREFERENCE,
+                    event_listeners=[get_command_monitor()] if DB_COMMAND_MONITORING_ENABLED else [])
+                log(f"[+] Created shared MongoClient (max pool size: {DB_MAX_POOL_SIZE})")
+    return _client
+
+
+def get_database(db_name: str = DB_NAME) -> Database:
+    """Return a database handle from the shared client
+
+    Args:
+        db_name (str, optional): Name of the database. Defaults to DB_NAME
+    Returns:
+        Database: Database handle backed by the shared connection pool
+    """
+    return get_client()[db_name]
+
+
+#   Message documents share the room collection with the room metadata documents
+MESSAGE_DOCUMENT_FILTER = {'message': {'$exists': True}}
+
+#   Documents written before sequence numbers were allocated per room carry a sequence_num of -1 or a
+#   {room_name: n} dict instead of a positive integer
+LEGACY_MESSAGE_FILTER = {**MESSAGE_DOCUMENT_FILTER, 'mess_props.sequence_num': {'$not': {'$gt': 0}}}
+
+
+def legacy_sequence_num(mess_props: dict) -> int | None:
+    """Return the number a legacy message document was given by the shared sequence document, or None if
+    it has none (a sequence_num of -1)"""
+    sequence_num = mess_props.get('sequence_num')
+    if isinstance(sequence_num, dict):
+        sequence_num = sequence_num.get(mess_props.get('room_name'))
+    return sequence_num if isinstance(sequence_num, int) and sequence_num > 0 else None
+
+
+def migrate_legacy_messages() -> int:
+    """Rewrite legacy message documents to an integer sequence_num and an _id of "<room_name>:<sequence_num>",
+    the form every read and index expects. A legacy document keeps the number its {room_name: n} dict gave
+    it unless that number is already taken in the room; the others (-1 and collisions) get numbers above
+    everything the room has used, oldest sent first. Each room's counter is then raised to its highest
+    number so the sequence allocator never hands them out again. Runs from ensure_indexes, and finds
+    nothing to do once the collection has been migrated
+
+    Returns:
+        int: Number of documents migrated
+    """
+    database = get_database()
+    room_collection = database[DB_CHAT_ROOM_COLLECTION]
+    sequence_collection = database[DB_SEQUENCE_COLLECTION]
+    legacy_by_room = dict()
+    for mess_data in room_collection.find(LEGACY_MESSAGE_FILTER):
+        room_name = mess_data.get('mess_props', {}).get('room_name')
+        if room_name is None:
+            log(f"[-] Legacy message document {mess_data['_id']} has no room name, left in place", 'w')
+            continue
+        legacy_by_room.setdefault(room_name, list()).append(mess_data)
+
+    migrated = 0
+    for room_name, legacy_documents in legacy_by_room.items():
+        taken = set(room_collection.distinct('mess_props.sequence_num', {
+            **MESSAGE_DOCUMENT_FILTER, 'mess_props.room_name': room_name, 'mess_props.sequence_num': {'$gt': 0}}))
+        counter = sequence_collection.find_one({'_id': room_name}) or {}
+        legacy_counter = sequence_collection.find_one({'_id': SEQUENCE_LEGACY_ID}, projection={room_name: True}) or {}
+        assigned = list()
+        unnumbered = list()
+        for mess_data in sorted(legacy_documents, key=lambda document: str(document['mess_props'].get('sent_time'))):
+            sequence_num = legacy_sequence_num(mess_data['mess_props'])
+            if sequence_num is None or sequence_num in taken:
+                unnumbered.append(mess_data)
+            else:
+                taken.add(sequence_num)
+                assigned.append((sequence_num, mess_data))
+        legacy_next = legacy_counter.get(room_name)
+        next_num = max(counter.get('next', 0), legacy_next if isinstance(legacy_next, int) else 0, *taken)
+        for mess_data in unnumbered:
+            next_num += 1
+            assigned.append((next_num, mess_data))
+
+        requests = list()
+        for sequence_num, mess_data in assigned:
+            mess_props = {**mess_data['mess_props'], 'sequence_num': sequence_num}
+            requests.append(InsertOne({**mess_data, '_id': f"{room_name}:{sequence_num}", 'mess_props': mess_props}))
+            requests.append(DeleteOne({'_id': mess_data['_id']}))
+        #   Ordered, so a document is only deleted once its rewritten copy has been inserted
+        room_collection.bulk_write(requests, ordered=True)
+        sequence_collection.update_one(
+            {'_id': room_name}, {'$max': {'next': max(sequence_num for sequence_num, _ in assigned)}}, upsert=True)
+        migrated += len(assigned)
+        log(f"[+] Migrated {len(assigned)} legacy message documents in room {room_name}")
+    return migrated
+
+
+def ensure_indexes() -> None:
+    """Create the indexes the chat application relies on. Index creation is idempotent, so this is
+    called on every startup. Legacy message documents are migrated first (see migrate_legacy_messages),
+    so they can not break the unique (room_name, sequence_num) index. Message documents also get a
+    (room_name, to_user) index for inbox lookups; room metadata documents are indexed by room name, and
+    read receipts by (room_name, alias)
+    """
+    migrate_legacy_messages()
+    room_collection = get_database()[DB_CHAT_ROOM_COLLECTION]
+    room_collection.create_index(
+        [('mess_props.room_name', ASCENDING), ('mess_props.sequence_num', ASCENDING)],
+        name='room_sequence_num', unique=True, partialFilterExpression=MESSAGE_DOCUMENT_FILTER)
+    room_collection.create_index(
+        [('mess_props.room_name', ASCENDING), ('mess_props.to_user', ASCENDING), ('mess_props.sequence_num', ASCENDING)],
+        name='room_to_user_sequence_num', partialFilterExpression=MESSAGE_DOCUMENT_FILTER)
+    room_collection.create_index(
+        [('room_name', ASCENDING)],
+        name='room_metadata', partialFilterExpression={'room_name': {'$exists': True}})
+    log(f"[+] Ensured indexes on {DB_CHAT_ROOM_COLLECTION} collection")
+    get_database()[DB_RECEIPT_COLLECTION].create_index(
+        [('room_name', ASCENDING), ('alias', ASCENDING)], name='room_alias', unique=True)
+    log(f"[+] Ensured indexes on {DB_RECEIPT_COLLECTION} collection")
+
+
+def set_client(client, close_previous: bool = True):
+    """Replace the shared client. Intended for tests that want to inject an in-memory stand-in
+    (e.g. mongomock.MongoClient) before any model objects are created. The previously created
+    client is closed first unless close_previous is False, so that it can be put back afterwards
+
+    Args:
+        client: Object exposing the MongoClient interface, or None to reset to lazy creation
+        close_previous (bool, optional): Close the client being replaced. Defaults to True
+    Returns:
+        The client that was replaced, or None if none was created yet
+    """
+    global _client
+    with _client_lock:
+        previous = _client
+        if close_previous and previous is not None and previous is not client:
+            previous.close()
+        _client = client
+    return previous
+
+
+def close_client() -> None:
+    """Close the shared client and release its pooled connections. Safe to call more than once. A
+    later call to get_client will create a fresh client
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            log("[-] Closed shared MongoClient")
+        _client = None
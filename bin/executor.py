@@ -0,0 +1,160 @@
+"""
+Bounded thread pool for the blocking MongoDB work behind the API. Keeps pymongo calls off the event loop,
+and serialises calls that touch the same key (a room, a user list) because the model objects are not
+thread safe
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import asyncio
+import contextvars
+import functools
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("executor")
+
+
+class _ThreadKeyLock:
+    """threading.Lock wrapper that can be held in a WeakValueDictionary"""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+
+
+class KeyedExecutor:
+    """Runs blocking callables on a bounded thread pool. Calls made with the same key run one at a time,
+    in arrival order, while calls with different keys run in parallel. Callers waiting for a key wait on
+    the event loop, not in a pool thread, so a busy room can not starve the pool. A per-key thread lock
+    taken inside the pool keeps the guarantee when requests arrive on more than one event loop (the test
+    client runs each request on its own loop); with a single loop it is never contended.
+
+    At most max_workers calls run at once, and never more than the MongoDB connection pool can serve.
+    Throughput grows with the requests in flight until every worker is busy, then levels off: further calls
+    wait in the pool's queue, so raising concurrency past max_workers only adds latency. Size max_workers
+    (API_MAX_WORKERS) for the round trip latency of the database, not for the number of clients
+    """
+
+    def __init__(self, max_workers: int = API_MAX_WORKERS, max_connections: int = DB_MAX_POOL_SIZE) -> None:
+        """Instantiate a KeyedExecutor. The thread pool is started on first use
+
+        Args:
+            max_workers (int, optional): Most blocking calls running at once. Defaults to API_MAX_WORKERS
+            max_connections (int, optional): Size of the MongoDB connection pool the calls share. Caps
+            max_workers. Defaults to DB_MAX_POOL_SIZE
+        """
+        self.__max_workers = max(1, min(max_workers, max_connections))
+        self.__pool = None
+        self.__pool_lock = threading.Lock()
+        self.__key_locks = weakref.WeakValueDictionary()
+        self.__thread_locks = weakref.WeakValueDictionary()
+        self.__thread_locks_guard = threading.Lock()
+        self.__in_flight = 0
+        self.__completed = 0
+
+    @property
+    def max_workers(self) -> int:
+        return self.__max_workers
+
+    @property
+    def in_flight(self) -> int:
+        return self.__in_flight
+
+    def __get_pool(self) -> ThreadPoolExecutor:
+        with self.__pool_lock:
+            if self.__pool is None:
+                self.__pool = ThreadPoolExecutor(max_workers=self.__max_workers, thread_name_prefix="api-blocking")
+            return self.__pool
+
+    def __key_lock(self, key: str) -> asyncio.Lock:
+        """Return the running loop's lock for a key. Locks are only held while a call for the key is pending"""
+        loop_key = (asyncio.get_running_loop(), key)
+        lock = self.__key_locks.get(loop_key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.__key_locks[loop_key] = lock
+        return lock
+
+    def __call_locked(self, key: str, call):
+        """Run call in a pool thread while holding the key's thread lock"""
+        with self.__thread_locks_guard:
+            thread_lock = self.__thread_locks.get(key)
+            if thread_lock is None:
+                thread_lock = _ThreadKeyLock()
+                self.__thread_locks[key] = thread_lock
+        with thread_lock.lock:
+            return call()
+
+    async def run(self, key: str | None, function, *args, **kwargs):
+        """Run a blocking callable on the pool and wait for its result without blocking the event loop
+
+        Args:
+            key (str | None): Serialisation key. Calls with the same key never overlap. None runs the call
+            without serialisation
+            function (callable): Blocking callable
+            *args: Positional arguments for function
+            **kwargs: Keyword arguments for function
+        Returns:
+            Any: Return value of function
+        Raises:
+            Exception: Whatever function raises
+        """
+        call = functools.partial(function, *args, **kwargs)
+        if key is None:
+            return await self.__submit(call)
+        async with self.__key_lock(key):
+            return await self.__submit(functools.partial(self.__call_locked, key, call))
+
+    def submit(self, key: str, function, *args, **kwargs) -> Future:
+        """Queue a blocking callable on the pool from any thread, without waiting for it. It runs under the
+        key's thread lock, so it never overlaps a call made with run for the same key. Errors are logged
+
+        Args:
+            key (str): Serialisation key
+            function (callable): Blocking callable
+            *args: Positional arguments for function
+            **kwargs: Keyword arguments for function
+        Returns:
+            Future: Completes with the return value of function
+        """
+        call = functools.partial(function, *args, **kwargs)
+        future = self.__get_pool().submit(contextvars.copy_context().run, self.__call_locked, key, call)
+        future.add_done_callback(
+            lambda done: done.exception() is not None and log(f"[-] Call queued for {key} failed: {done.exception()}", 'e'))
+        return future
+
+    async def __submit(self, call):
+        self.__in_flight += 1
+        try:
+            #   Run in a copy of the caller's context, as asyncio.to_thread does, so per-request context
+            #   variables (e.g. the MongoDB command stats) are visible on the worker thread
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(self.__get_pool(), context.run, call)
+        finally:
+            self.__in_flight -= 1
+            self.__completed += 1
+
+    def stats(self) -> dict:
+        """Return the executor counters
+
+        Returns:
+            dict: Worker limit, calls in flight and calls completed
+        """
+        return {
+            'max_workers': self.__max_workers,
+            'in_flight': self.__in_flight,
+            'completed': self.__completed,
+            'keys': len(self.__key_locks)
+        }
+
+    def shutdown(self) -> None:
+        """Wait for running calls to finish and stop the pool. The pool is restarted on the next call"""
+        with self.__pool_lock:
+            if self.__pool is not None:
+                self.__pool.shutdown(wait=True)
+                self.__pool = None
+        log("[+] Shut down blocking call executor")
@@ -0,0 +1,295 @@
+"""
+Fan-out of new room messages to WebSocket subscribers. Each message is serialised once per room, and the
+encoded frame is handed to every subscriber's bounded send queue on the subscriber's event loop
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import asyncio
+import json
+import threading
+from collections import deque
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("fanout")
+
+
+def encode_message_frame(room_name: str, message) -> str:
+    """Encode a message as the text frame sent to subscribers
+
+    Args:
+        room_name (str): Room the message was put in
+        message (ChatMessage): Message to encode
+    Returns:
+        str: JSON text frame
+    """
+    return json.dumps({'type': 'message', 'room_name': room_name, 'message': message.to_dict()})
+
+
+class Subscriber:
+    """Send side of one WebSocket connection. Frames wait in a bounded queue until the connection's writer
+    takes them. When the queue is full the slow consumer policy applies: 'drop' discards the new frame and
+    tells the client how many frames it missed before the next one it receives, 'disconnect' closes the
+    connection. Replies to the client's requests may use max_replies slots past the message frames; a client
+    that keeps sending requests without reading the replies is disconnected. Only called on the event loop
+    that created it, except through RoomFanOut
+    """
+
+    __slots__ = ('__alias', '__loop', '__frames', '__waiter', '__max_frames', '__max_replies', '__policy', '__dropped',
+                 '__missed', '__close_code', '__weakref__')
+
+    def __init__(
+            self,
+            alias: str,
+            max_frames: int = WS_SEND_QUEUE_SIZE,
+            policy: str = WS_SLOW_CONSUMER_POLICY,
+            max_replies: int = WS_MAX_PENDING_REPLIES) -> None:
+        """Instantiate a Subscriber bound to the running event loop
+
+        Args:
+            alias (str): Alias of the connected user
+            max_frames (int, optional): Most frames queued for the connection. Defaults to WS_SEND_QUEUE_SIZE
+            policy (str, optional): Slow consumer policy, WS_SLOW_CONSUMER_DROP or WS_SLOW_CONSUMER_DISCONNECT.
+            Defaults to WS_SLOW_CONSUMER_POLICY
+            max_replies (int, optional): Queue slots kept for replies on top of max_frames. Defaults to
+            WS_MAX_PENDING_REPLIES
+        """
+        self.__alias = alias
+        self.__loop = asyncio.get_running_loop()
+        self.__frames = deque()
+        self.__waiter = None
+        self.__max_frames = max_frames
+        self.__max_replies = max_replies
+        self.__policy = policy
+        self.__dropped = 0
+        self.__missed = 0
+        self.__close_code = None
+
+    @property
+    def alias(self) -> str:
+        return self.__alias
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self.__loop
+
+    @property
+    def dropped(self) -> int:
+        """Frames discarded because the queue was full"""
+        return self.__dropped
+
+    @property
+    def close_code(self) -> int | None:
+        """WebSocket close code once the subscriber is closed, otherwise None"""
+        return self.__close_code
+
+    @property
+    def queued(self) -> int:
+        return len(self.__frames)
+
+    def offer(self, frame: str) -> bool:
+        """Queue a message frame, applying the slow consumer policy if the queue is full
+
+        Args:
+            frame (str): Encoded frame
+        Returns:
+            bool: True if the frame was queued
+        """
+        if self.__close_code is not None:
+            return False
+        if len(self.__frames) >= self.__max_frames:
+            if self.__policy == WS_SLOW_CONSUMER_DISCONNECT:
+                log(f"[-] Disconnecting slow consumer {self.__alias}", 'w')
+                self.close(WS_CLOSE_SLOW_CONSUMER)
+            else:
+                self.__dropped += 1
+                self.__missed += 1
+            return False
+        self.__frames.append(frame)
+        self.__wake()
+        return True
+
+    def reply(self, frame: str) -> bool:
+        """Queue a reply to a request from the client. Replies are not subject to the slow consumer policy,
+        but once the queue holds max_replies frames past max_frames the subscriber is closed with
+        WS_CLOSE_POLICY_VIOLATION
+
+        Args:
+            frame (str): Encoded frame
+        Returns:
+            bool: True if the reply was queued
+        """
+        if self.__close_code is not None:
+            return False
+        if len(self.__frames) >= self.__max_frames + self.__max_replies:
+            log(f"[-] Disconnecting {self.__alias}, who is not reading the replies to their requests", 'w')
+            self.close(WS_CLOSE_POLICY_VIOLATION)
+            return False
+        self.__frames.append(frame)
+        self.__wake()
+        return True
+
+    def close(self, code: int = 1000) -> None:
+        """Close the subscriber. Queued frames are discarded and the writer is told to stop
+
+        Args:
+            code (int, optional): WebSocket close code. Defaults to 1000
+        """
+        if self.__close_code is None:
+            self.__close_code = code
+            self.__frames.clear()
+            self.__wake()
+
+    def __wake(self) -> None:
+        if self.__waiter is not None and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    async def next_frame(self) -> str | None:
+        """Wait for the next frame to send
+
+        Returns:
+            str | None: The next frame, or None once the subscriber is closed
+        """
+        while len(self.__frames) == 0 and self.__close_code is None:
+            self.__waiter = self.__loop.create_future()
+            try:
+                await self.__waiter
+            finally:
+                self.__waiter = None
+        if self.__close_code is not None:
+            return None
+        if self.__missed > 0:
+            missed, self.__missed = self.__missed, 0
+            return json.dumps({'type': 'lagged', 'dropped': missed})
+        return self.__frames.popleft()
+
+
+class RoomFanOut:
+    """Room → subscriber registry. publish may be called from any thread (the model objects run on the
+    executor). A message is encoded once, whatever the number of subscribers, and the frames for each
+    event loop are handed over with a single call_soon_threadsafe. Each subscription carries the set of
+    aliases the subscriber has blocked in that room, and messages from those aliases are not delivered
+    """
+
+    def __init__(self) -> None:
+        """Instantiate an empty RoomFanOut"""
+        self.__lock = threading.Lock()
+        self.__rooms = dict()
+        self.__subscriptions = dict()
+        self.__frames_encoded = 0
+        self.__frames_delivered = 0
+
+    def subscribe(self, subscriber: Subscriber, room_name: str, blocked_users=frozenset()) -> bool:
+        """Subscribe to a room's new messages
+
+        Args:
+            subscriber (Subscriber): Subscribing connection
+            room_name (str): Room to subscribe to
+            blocked_users (set, optional): Aliases whose messages are not delivered. The set is read on every
+            publish, so a live set picks up later blocks. Defaults to an empty set
+        Returns:
+            bool: False if the subscriber is already subscribed to WS_MAX_ROOMS_PER_CONNECTION other rooms
+        """
+        with self.__lock:
+            rooms = self.__subscriptions.setdefault(subscriber, set())
+            if room_name not in rooms and len(rooms) >= WS_MAX_ROOMS_PER_CONNECTION:
+                return False
+            rooms.add(room_name)
+            self.__rooms.setdefault(room_name, dict())[subscriber] = blocked_users
+        return True
+
+    def unsubscribe(self, subscriber: Subscriber, room_name: str = None) -> None:
+        """Remove a subscription
+
+        Args:
+            subscriber (Subscriber): Subscribed connection
+            room_name (str, optional): Room to leave. None leaves every room. Defaults to None
+        """
+        with self.__lock:
+            rooms = self.__subscriptions.get(subscriber, set())
+            for name in ([room_name] if room_name is not None else list(rooms)):
+                rooms.discard(name)
+                subscribers = self.__rooms.get(name)
+                if subscribers is not None:
+                    subscribers.pop(subscriber, None)
+                    if len(subscribers) == 0:
+                        del self.__rooms[name]
+            if len(rooms) == 0:
+                self.__subscriptions.pop(subscriber, None)
+
+    def subscriber_count(self, room_name: str) -> int:
+        return len(self.__rooms.get(room_name, ()))
+
+    def publish(self, room_name: str, messages) -> int:
+        """Deliver new messages to the room's subscribers
+
+        Args:
+            room_name (str): Room the messages were put in
+            messages (Iterable[ChatMessage]): New messages, oldest first
+        Returns:
+            int: Number of frames handed to subscribers
+        """
+        with self.__lock:
+            subscribers = self.__rooms.get(room_name)
+            if not subscribers:
+                return 0
+            subscribers = list(subscribers.items())
+
+        deliveries = dict()
+        encoded = 0
+        for message in messages:
+            from_user = message.mess_props.from_user
+            frame = None
+            for subscriber, blocked_users in subscribers:
+                if from_user in blocked_users:
+                    continue
+                if frame is None:
+                    frame = encode_message_frame(room_name, message)
+                    encoded += 1
+                deliveries.setdefault(subscriber.loop, []).append((subscriber, frame))
+
+        delivered = 0
+        for loop, batch in deliveries.items():
+            try:
+                loop.call_soon_threadsafe(self.__deliver, batch)
+                delivered += len(batch)
+            except RuntimeError:
+                #   The subscribers' event loop has been closed
+                pass
+        with self.__lock:
+            self.__frames_encoded += encoded
+            self.__frames_delivered += delivered
+        return delivered
+
+    @staticmethod
+    def __deliver(batch: list) -> None:
+        for subscriber, frame in batch:
+            subscriber.offer(frame)
+
+    def stats(self) -> dict:
+        """Return the fan-out counters
+
+        Returns:
+            dict: Rooms with subscribers, subscribed connections, frames encoded and frames delivered
+        """
+        with self.__lock:
+            return {
+                'rooms': len(self.__rooms),
+                'subscribers': len(self.__subscriptions),
+                'frames_encoded': self.__frames_encoded,
+                'frames_delivered': self.__frames_delivered
+            }
+
+
+_fanout = RoomFanOut()
+
+
+def get_room_fanout() -> RoomFanOut:
+    """Return the process wide RoomFanOut
+
+    Returns:
+        RoomFanOut: Shared fan-out
+    """
+    return _fanout
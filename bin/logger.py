@@ -1,37 +1,147 @@
 """
-Logging helper class
+Logging helper class. Records are handed to a queue on the calling thread and written by a single
+background listener, so request threads never wait on the log line format or disk I/O
 """
 
+import atexit
 import os
+import queue
+import threading
 import logging as log
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from bin.constants import LOG_DIR, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_TO_STDERR
+
+LOG_LEVELS = {'d': log.DEBUG, 'i': log.INFO, 'w': log.WARNING, 'e': log.ERROR}
+LOG_FORMAT = "[%(levelname)s]\t[%(asctime)s] %(message)s"
+
+
+class _KeyedFileHandler(log.Handler):
+    """Writes each logger's records to its own size-rotated file. Runs on the listener thread"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__log_files = dict()
+        self.__handlers = dict()
+
+    def add_log_file(self, logger_name: str, log_file: str) -> None:
+        self.__log_files[logger_name] = log_file
+
+    def emit(self, record: log.LogRecord) -> None:
+        handler = self.__handlers.get(record.name)
+        if handler is None:
+            log_file = self.__log_files.get(record.name)
+            if log_file is None:
+                return
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            handler = RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, delay=True)
+            handler.setFormatter(self.formatter)
+            self.__handlers[record.name] = handler
+        handler.handle(record)
+
+    def close(self) -> None:
+        for handler in self.__handlers.values():
+            handler.close()
+        self.__handlers = dict()
+        super().close()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Hands records to the listener without blocking. Only records that passed the level check get here, and
+    their arguments are merged into the message on the calling thread, so the listener never formats an
+    object the caller may have changed since. The listener applies the line format. Once max_size records are
+    waiting further records are dropped and counted instead of growing the queue without bound"""
+
+    def __init__(self, record_queue: queue.SimpleQueue, max_size: int) -> None:
+        super().__init__(record_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: log.LogRecord) -> log.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: log.LogRecord) -> None:
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+class _LogListener:
+    """The queue, queue handler and background QueueListener shared by every Logger in the process"""
+
+    def __init__(self) -> None:
+        formatter = log.Formatter(LOG_FORMAT)
+        self.__lock = threading.Lock()
+        self.__queue = queue.SimpleQueue()
+        self.queue_handler = _DroppingQueueHandler(self.__queue, LOG_QUEUE_SIZE)
+        self.file_handler = _KeyedFileHandler()
+        self.file_handler.setFormatter(formatter)
+        handlers = [self.file_handler]
+        if LOG_TO_STDERR:
+            stream_handler = log.StreamHandler()
+            stream_handler.setFormatter(log.Formatter("%(message)s"))
+            handlers.append(stream_handler)
+        self.__listener = QueueListener(self.__queue, *handlers, respect_handler_level=True)
+        self.__started = False
+
+    def start(self) -> None:
+        with self.__lock:
+            if not self.__started:
+                self.__listener.start()
+                self.__started = True
+
+    def stop(self) -> None:
+        """Write every queued record, then stop the listener thread"""
+        with self.__lock:
+            if self.__started:
+                self.__listener.stop()
+                self.__started = False
+                self.file_handler.close()
+
+    def stats(self) -> dict:
+        return {'queued': self.__queue.qsize(), 'dropped': self.queue_handler.dropped}
+
+
+_listener = _LogListener()
+atexit.register(_listener.stop)
+
+
+def close_log_listener() -> None:
+    """Flush queued log records and stop the background listener. Runs at interpreter exit"""
+    _listener.stop()
+
+
+def log_stats() -> dict:
+    """Return the records waiting in the log queue and the records dropped because it was full
 
-LOG_DIR = str(os.getcwd()) + "\\logs\\"
+    Returns:
+        dict: Queue counters
+    """
+    return _listener.stats()
 
 
-def log_setup(logger_name: str, log_file: str, mode: str = 'w'):
+def log_setup(logger_name: str, log_file: str, mode: str = 'a'):
     """
-    Configure a new logger and return the new instance to the user
+    Configure a new logger and return the new instance to the user. The logger only enqueues records;
+    the shared listener writes them to log_file, rotated at LOG_MAX_BYTES, and to stderr unless
+    LOG_TO_STDERR is off
 
     Args:
         logger_name (str): User defined name for the Logger obj instance
         log_file (str): Name for the log_file
-        mode (str, optional): Log mode. Recommended: 'w'rite or 'a'ppend. Defaults to 'w'.
+        mode (str, optional): Kept for compatibility. Rotated files are always appended to
 
     Returns:
         log.Logger: New log file instance the user can write to
     """
-
-    #   Initialize handlers
     new_log = log.getLogger(logger_name)
-    formatter = log.Formatter("[%(levelname)s]\t[%(asctime)s] %(message)s")
-    file_handler = log.FileHandler(log_file, mode=mode)
-    file_handler.setFormatter(formatter)
-    stream_handler = log.StreamHandler()
-
-    #   Create logging object with handlers
-    new_log.setLevel(log.DEBUG)
-    new_log.addHandler(file_handler)
-    new_log.addHandler(stream_handler)
+    new_log.setLevel(LOG_LEVEL)
+    _listener.file_handler.add_log_file(logger_name, log_file)
+    if _listener.queue_handler not in new_log.handlers:
+        new_log.addHandler(_listener.queue_handler)
+    _listener.start()
     return new_log
 
 
@@ -45,26 +155,34 @@ class Logger:
         Args:
             key (str, optional): Assignment/Name of the logger. Defaults to "none".
         """
-        self.log_obj = log_setup(f"{key}", LOG_DIR + f"{key}.log")
+        self.log_obj = log_setup(f"{key}", os.path.join(LOG_DIR, f"{key}.log"))
 
-    def __call__(self, log_str: str, mode: str = 'i'):
+    def __call__(self, log_str: str, mode: str = 'i', *args):
         """
-        Call the object to have a message immediately logged to the debug output
+        Call the object to have a message logged. Pass expensive values as args with %s placeholders in
+        log_str rather than formatting them into the string: they are only formatted if the level is enabled
 
         Args:
             log_str (str): Message to add to the logfile
             mode (str, optional): Logging mode for the file. Defaults to 'i' for Info
+            *args: Values merged into log_str with % formatting, only once the level check passed
+        """
+        level = LOG_LEVELS.get(mode, log.INFO)
+        if self.log_obj.isEnabledFor(level):
+            #   Built directly rather than through Logger.log, which walks the stack for a source location
+            #   the format never prints
+            self.log_obj.handle(self.log_obj.makeRecord(self.log_obj.name, level, "", 0, log_str, args, None))
+
+    def enabled(self, mode: str = 'd') -> bool:
+        """Check if messages of a logging mode are written. Guard messages whose arguments are expensive
+        to build, e.g. object dumps, with it
+
+        Args:
+            mode (str, optional): Logging mode. Defaults to 'd' for Debug
+        Returns:
+            bool: True if the mode is at or above LOG_LEVEL
         """
-        if mode == 'i':
-            self.log_obj.info(log_str)
-        elif mode == 'd':
-            self.log_obj.debug(log_str)
-        elif mode == 'e':
-            self.log_obj.error(log_str)
-        elif mode == 'w':
-            self.log_obj.warning(log_str)
-        else:
-            self.log_obj.info(log_str)
+        return self.log_obj.isEnabledFor(LOG_LEVELS.get(mode, log.INFO))
 
     def log(self, log_str: str):
         """
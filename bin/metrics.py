@@ -0,0 +1,288 @@
+"""
+Request metrics. An ASGI middleware records a fixed-bucket latency histogram per route, method and status,
+a gauge of requests in flight per route, and the MongoDB commands each request made, rendered in the
+Prometheus text format for GET /metrics
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+import time
+from bisect import bisect_left
+from starlette.routing import Match
+from bin.constants import *
+from bin.logger import Logger
+from bin.command_monitor import begin_request, current_request_stats, end_request
+
+log = Logger("metrics")
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class LatencyHistogram:
+    """Counts of observations per fixed bucket, with their sum. Observing is one bisect over the bucket
+    bounds and two additions; buckets are only made cumulative when rendered"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: tuple) -> None:
+        self.bounds = bounds
+        #   One count per bound, and a last count for observations above every bound (le="+Inf")
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> list:
+        total = 0
+        cumulative = list()
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+def format_labels(labels: dict) -> str:
+    """Render labels in the Prometheus text format, escaping backslashes, quotes and newlines"""
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class RequestMetrics:
+    """Latency histograms keyed by (method, route, status) and in-flight gauges keyed by (method, route).
+    Routes are the path templates the app declares (e.g. /rooms/{room_name}/stream), never raw paths, so the
+    number of series stays bounded by the routes of the app"""
+
+    def __init__(self, buckets: tuple = METRICS_LATENCY_BUCKETS, command_buckets: tuple = DB_COMMAND_BUCKETS) -> None:
+        """Instantiate empty RequestMetrics
+
+        Args:
+            buckets (tuple, optional): Upper bounds of the latency buckets, in seconds. Defaults to
+            METRICS_LATENCY_BUCKETS
+            command_buckets (tuple, optional): Upper bounds of the MongoDB commands per request buckets.
+            Defaults to DB_COMMAND_BUCKETS
+        """
+        self.__bounds = tuple(sorted(buckets))
+        self.__command_bounds = tuple(sorted(command_buckets))
+        self.__lock = threading.Lock()
+        self.__histograms = dict()
+        self.__in_flight = dict()
+        self.__command_histograms = dict()
+        self.__command_seconds = dict()
+
+    @property
+    def buckets(self) -> tuple:
+        return self.__bounds
+
+    def start(self, method: str, route: str) -> None:
+        """Count a request as in flight"""
+        key = (method, route)
+        with self.__lock:
+            self.__in_flight[key] = self.__in_flight.get(key, 0) + 1
+
+    def finish(self, method: str, route: str, status: int, duration: float) -> None:
+        """Record the latency of a finished request and remove it from the in-flight gauge
+
+        Args:
+            method (str): HTTP method
+            route (str): Path template of the route that served the request
+            status (int): Response status code
+            duration (float): Seconds from the request arriving to the response being sent
+        """
+        key = (method, route, status)
+        with self.__lock:
+            self.__in_flight[(method, route)] -= 1
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = LatencyHistogram(self.__bounds)
+            histogram.observe(duration)
+
+    def observe_commands(self, method: str, route: str, commands: int, duration: float) -> None:
+        """Record the MongoDB commands a request made
+
+        Args:
+            method (str): HTTP method
+            route (str): Path template of the route that served the request
+            commands (int): Commands the request made
+            duration (float): Seconds the request spent waiting on them
+        """
+        key = (method, route)
+        with self.__lock:
+            histogram = self.__command_histograms.get(key)
+            if histogram is None:
+                histogram = self.__command_histograms[key] = LatencyHistogram(self.__command_bounds)
+            histogram.observe(commands)
+            self.__command_seconds[key] = self.__command_seconds.get(key, 0.0) + duration
+
+    def snapshot(self) -> dict:
+        """Return a copy of the counters
+
+        Returns:
+            dict: 'histograms' maps (method, route, status) to (cumulative bucket counts, sum, count),
+            'in_flight' maps (method, route) to the requests in flight, 'commands' maps (method, route) to
+            the (cumulative bucket counts, sum, count) of MongoDB commands per request, and
+            'command_seconds' maps (method, route) to the seconds spent in those commands
+        """
+        with self.__lock:
+            return {
+                'histograms': {
+                    key: (histogram.cumulative_counts(), histogram.sum, histogram.count)
+                    for key, histogram in self.__histograms.items()},
+                'in_flight': dict(self.__in_flight),
+                'commands': {
+                    key: (histogram.cumulative_counts(), histogram.sum, histogram.count)
+                    for key, histogram in self.__command_histograms.items()},
+                'command_seconds': dict(self.__command_seconds)
+            }
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format
+
+        Returns:
+            str: Exposition text
+        """
+        snapshot = self.snapshot()
+        lines = list()
+        self.__render_histograms(
+            lines, "http_request_duration_seconds", "Latency of HTTP requests by route, method and status",
+            ('method', 'route', 'status'), self.__bounds, snapshot['histograms'])
+        lines.append("# HELP http_requests_in_flight HTTP requests being served by route and method")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        for (method, route), in_flight in sorted(snapshot['in_flight'].items()):
+            lines.append(f"http_requests_in_flight{format_labels({'method': method, 'route': route})} {in_flight}")
+        self.__render_histograms(
+            lines, "http_request_db_commands", "MongoDB commands per HTTP request by route and method",
+            ('method', 'route'), self.__command_bounds, snapshot['commands'])
+        lines.append("# HELP http_request_db_seconds_total Seconds HTTP requests spent in MongoDB commands")
+        lines.append("# TYPE http_request_db_seconds_total counter")
+        for (method, route), seconds in sorted(snapshot['command_seconds'].items()):
+            lines.append(f"http_request_db_seconds_total{format_labels({'method': method, 'route': route})} {seconds}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def __render_histograms(lines: list, name: str, description: str, label_names: tuple, bounds: tuple, histograms: dict) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        bound_labels = [f"{bound:g}" for bound in bounds] + ["+Inf"]
+        for key, (counts, total, count) in sorted(histograms.items()):
+            labels = dict(zip(label_names, key))
+            for bound, cumulative in zip(bound_labels, counts):
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+    def clear(self) -> None:
+        """Reset every histogram. Requests in flight are kept"""
+        with self.__lock:
+            self.__histograms = dict()
+            self.__command_histograms = dict()
+            self.__command_seconds = dict()
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times every HTTP request into a RequestMetrics. The route is resolved against
+    the app's routes before the request is served, so the in-flight gauge carries it too, and resolutions
+    are cached per (method, path). The MongoDB commands made while serving the request are attributed to it
+    (see bin.command_monitor): their totals so far go out in the X-DB-Commands and X-DB-Time-Ms response
+    headers (DB_METRICS_HEADER_ENABLED), the final totals go to the metrics, and requests over
+    DB_BUDGET_MAX_COMMANDS commands or DB_BUDGET_MAX_MS milliseconds are logged with their commands.
+    WebSocket and lifespan traffic is passed through untimed"""
+
+    def __init__(self, app, routes: list, metrics=None, route_cache_size: int = METRICS_ROUTE_CACHE_SIZE) -> None:
+        """Wrap an ASGI app
+
+        Args:
+            app: ASGI app to wrap
+            routes (list): Routes of the application, e.g. FastAPI.routes. Read at request time, so routes
+            added after the middleware are matched too
+            metrics (RequestMetrics, optional): Where to record. Defaults to the shared RequestMetrics
+            route_cache_size (int, optional): Most cached route resolutions. Defaults to METRICS_ROUTE_CACHE_SIZE
+        """
+        self.app = app
+        self.__routes = routes
+        self.__metrics = metrics if metrics is not None else get_request_metrics()
+        self.__route_cache = dict()
+        self.__route_cache_size = route_cache_size
+
+    def resolve_route(self, scope: dict) -> str:
+        """Return the path template of the route that serves a request
+
+        Args:
+            scope (dict): ASGI scope of the request
+        Returns:
+            str: Route path template, or UNMATCHED_ROUTE
+        """
+        key = (scope['method'], scope['path'])
+        route = self.__route_cache.get(key)
+        if route is not None:
+            return route
+        route = UNMATCHED_ROUTE
+        for candidate in self.__routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate.path
+                break
+        if len(self.__route_cache) >= self.__route_cache_size:
+            self.__route_cache.clear()
+        self.__route_cache[key] = route
+        return route
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        route = self.resolve_route(scope)
+        status = 500
+        start_time = time.perf_counter()
+        self.__metrics.start(method, route)
+        token = begin_request()
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if DB_METRICS_HEADER_ENABLED:
+                    message = self.__with_command_headers(message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start_time
+            command_stats = end_request(token)
+            self.__metrics.finish(method, route, status, duration)
+            self.__metrics.observe_commands(method, route, command_stats.commands, command_stats.duration_ms / 1000)
+            if command_stats.over_budget():
+                log("[-] %s %s over the MongoDB budget: %s commands in %.1f ms (request took %.1f ms). %s", 'w',
+                    method, scope['path'], command_stats.commands, command_stats.duration_ms, duration * 1000,
+                    command_stats.summary())
+
+    @staticmethod
+    def __with_command_headers(message: dict) -> dict:
+        """Return the response start message with the request's MongoDB totals so far as headers"""
+        command_stats = current_request_stats()
+        headers = list(message.get('headers', ()))
+        headers.append((b"x-db-commands", str(command_stats.commands).encode()))
+        headers.append((b"x-db-time-ms", f"{command_stats.duration_ms:.1f}".encode()))
+        return {**message, 'headers': headers}
+
+
+_metrics = RequestMetrics()
+
+
+def get_request_metrics() -> RequestMetrics:
+    """Return the process wide RequestMetrics
+
+    Returns:
+        RequestMetrics: Shared metrics
+    """
+    return _metrics
@@ -0,0 +1,128 @@
+"""
+In-process notification of new room messages. ChatRoom reports the new high-water mark of a room after
+each put, and every coroutine waiting on that room is woken by the one event, without polling MongoDB
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import asyncio
+import threading
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("notifier")
+
+
+class RoomNotifier:
+    """Per-room high-water marks with waiters. notify may be called from any thread (the model objects run
+    on the executor); waiters are futures on an event loop and are resolved on that loop with
+    call_soon_threadsafe
+    """
+
+    def __init__(self) -> None:
+        """Instantiate an empty RoomNotifier"""
+        self.__lock = threading.Lock()
+        self.__high_water_marks = dict()
+        self.__waiters = dict()
+        self.__notifications = 0
+
+    def high_water_mark(self, room_name: str) -> int:
+        """Return the last high-water mark reported for a room, or 0 if it has not reported one"""
+        return self.__high_water_marks.get(room_name, 0)
+
+    def notify(self, room_name: str, high_water_mark: int) -> None:
+        """Record a room's new high-water mark and wake everything waiting on the room
+
+        Args:
+            room_name (str): Room that accepted new messages
+            high_water_mark (int): Highest sequence number in the room
+        """
+        with self.__lock:
+            if high_water_mark <= self.__high_water_marks.get(room_name, 0):
+                return
+            self.__high_water_marks[room_name] = high_water_mark
+            waiters = self.__waiters.pop(room_name, ())
+            self.__notifications += 1
+
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(self.__resolve, future, high_water_mark)
+            except RuntimeError:
+                #   The waiter's event loop has been closed
+                pass
+
+    def forget(self, room_name: str) -> bool:
+        """Drop the high-water mark of a room that is no longer resident, so rooms that have gone quiet do
+        not keep an entry for the life of the process. A room with coroutines still waiting on it is kept.
+        The room reports its mark again with its next put
+
+        Args:
+            room_name (str): Room to forget
+        Returns:
+            bool: True if the room's entry was dropped
+        """
+        with self.__lock:
+            if room_name in self.__waiters:
+                return False
+            return self.__high_water_marks.pop(room_name, None) is not None
+
+    @staticmethod
+    def __resolve(future: asyncio.Future, high_water_mark: int) -> None:
+        if not future.done():
+            future.set_result(high_water_mark)
+
+    async def wait(self, room_name: str, after_seq: int, timeout: float) -> int:
+        """Wait until the room reports a high-water mark above after_seq, or until timeout
+
+        Args:
+            room_name (str): Room to wait on
+            after_seq (int): Sequence number the caller has already seen
+            timeout (float): Most seconds to wait
+        Returns:
+            int: The room's high-water mark. Not above after_seq if the wait timed out
+        """
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            high_water_mark = self.__high_water_marks.get(room_name, 0)
+            if high_water_mark > after_seq:
+                return high_water_mark
+            waiter = (loop, loop.create_future())
+            self.__waiters.setdefault(room_name, set()).add(waiter)
+
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return self.high_water_mark(room_name)
+        finally:
+            with self.__lock:
+                waiters = self.__waiters.get(room_name)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if len(waiters) == 0:
+                        del self.__waiters[room_name]
+
+    def stats(self) -> dict:
+        """Return the notifier counters
+
+        Returns:
+            dict: Rooms tracked, coroutines waiting and notifications sent
+        """
+        with self.__lock:
+            return {
+                'rooms': len(self.__high_water_marks),
+                'waiters': sum(len(waiters) for waiters in self.__waiters.values()),
+                'notifications': self.__notifications
+            }
+
+
+_notifier = RoomNotifier()
+
+
+def get_room_notifier() -> RoomNotifier:
+    """Return the process wide RoomNotifier
+
+    Returns:
+        RoomNotifier: Shared notifier
+    """
+    return _notifier
@@ -0,0 +1,342 @@
+"""
+RabbitMQ publisher for accepted room messages. Every message a ChatRoom accepts is published to the room's
+fanout exchange, so other services can follow rooms without polling MongoDB
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import json
+import threading
+from collections import OrderedDict, deque
+import pika
+from pika import spec
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("publisher")
+
+
+def room_exchange(room_name: str) -> str:
+    """Return the name of a room's fanout exchange"""
+    return f"{RMQ_ROOM_EXCHANGE_PREFIX}{room_name}"
+
+
+def connect(on_open_callback=None, on_open_error_callback=None, on_close_callback=None) -> pika.SelectConnection:
+    """Open an asynchronous connection to the RabbitMQ broker named by the RMQ constants. This is the
+    default connection factory of RoomPublisher
+
+    Returns:
+        pika.SelectConnection: Connection. Its callbacks run once its ioloop is started
+    """
+    parameters = pika.ConnectionParameters(
+        host=RMQ_HOST, port=RMQ_PORT, credentials=pika.PlainCredentials(RMQ_USER, RMQ_PASS))
+    return pika.SelectConnection(
+        parameters,
+        on_open_callback=on_open_callback,
+        on_open_error_callback=on_open_error_callback,
+        on_close_callback=on_close_callback)
+
+
+class _PublishChannel:
+    """A confirm mode channel of the pool, with the publishes it is waiting to have confirmed and the
+    exchanges it has declared, least recently used first"""
+
+    __slots__ = ('channel', 'next_tag', 'unconfirmed', 'exchanges')
+
+    def __init__(self, channel) -> None:
+        self.channel = channel
+        self.next_tag = 1
+        self.unconfirmed = dict()
+        self.exchanges = OrderedDict()
+
+
+class RoomPublisher:
+    """Publishes messages to per-room fanout exchanges over one long-lived connection. The connection is a
+    pika SelectConnection driven by the publisher's own I/O thread, which is the only thread that touches
+    it; publish only queues the message and wakes that thread, so it never blocks the caller on the broker.
+    The I/O thread spreads queued messages over a pool of confirm mode channels. Confirms are batched: a
+    channel keeps up to confirm_batch publishes in flight and the broker acknowledges them together (a
+    Basic.Ack with multiple set), instead of one round trip per message. Nacked publishes are queued again
+    until they have been nacked max_nacks times, then dropped.
+    Publishes spread over several channels may reach the broker out of order, so consumers order messages
+    by their sequence numbers. While the broker is unreachable the I/O thread retries the connection after a
+    delay that doubles from min_reconnect_delay up to max_reconnect_delay, and messages wait in the queue
+    """
+
+    def __init__(
+            self,
+            connection_factory=connect,
+            num_channels: int = RMQ_PUBLISH_CHANNELS,
+            confirm_batch: int = RMQ_CONFIRM_BATCH,
+            max_pending: int = RMQ_PUBLISH_MAX_PENDING,
+            max_nacks: int = RMQ_PUBLISH_MAX_NACKS,
+            max_exchanges: int = RMQ_DECLARED_EXCHANGES_MAX,
+            min_reconnect_delay: float = RMQ_RECONNECT_MIN_SECONDS,
+            max_reconnect_delay: float = RMQ_RECONNECT_MAX_SECONDS) -> None:
+        """Instantiate a RoomPublisher. The connection is opened on the first publish
+
+        Args:
+            connection_factory (callable, optional): Opens a connection given pika's on_open_callback,
+            on_open_error_callback and on_close_callback. Defaults to connect
+            num_channels (int, optional): Channels in the pool. Defaults to RMQ_PUBLISH_CHANNELS
+            confirm_batch (int, optional): Most unconfirmed publishes per channel. Defaults to RMQ_CONFIRM_BATCH
+            max_pending (int, optional): Most messages queued while the broker is slow or unreachable. The
+            oldest are dropped beyond this. Defaults to RMQ_PUBLISH_MAX_PENDING
+            max_nacks (int, optional): Times a message may be nacked before it is dropped. Defaults to
+            RMQ_PUBLISH_MAX_NACKS
+            max_exchanges (int, optional): Most declared exchanges each channel remembers. The least recently
+            used is declared again on its next publish. Defaults to RMQ_DECLARED_EXCHANGES_MAX
+            min_reconnect_delay (float, optional): Seconds before the first reconnect attempt. Defaults to
+            RMQ_RECONNECT_MIN_SECONDS
+            max_reconnect_delay (float, optional): Most seconds between reconnect attempts. Defaults to
+            RMQ_RECONNECT_MAX_SECONDS
+        """
+        self.__connection_factory = connection_factory
+        self.__num_channels = num_channels
+        self.__confirm_batch = confirm_batch
+        self.__max_pending = max_pending
+        self.__max_nacks = max_nacks
+        self.__max_exchanges = max_exchanges
+        self.__min_reconnect_delay = min_reconnect_delay
+        self.__max_reconnect_delay = max_reconnect_delay
+        self.__condition = threading.Condition()
+        self.__pending = deque()
+        self.__connection = None
+        self.__thread = None
+        self.__channels = list()
+        self.__drain_scheduled = False
+        self.__connected = False
+        self.__closing = False
+        self.__published = 0
+        self.__confirmed = 0
+        self.__nacked = 0
+        self.__dropped = 0
+
+    @property
+    def confirm_batch(self) -> int:
+        return self.__confirm_batch
+
+    @property
+    def unconfirmed(self) -> int:
+        """Messages queued or published but not yet confirmed by the broker"""
+        return self.__published - self.__confirmed - self.__dropped
+
+    def publish(self, room_name: str, body: bytes) -> None:
+        """Queue a message for the room's exchange. Thread safe and non-blocking
+
+        Args:
+            room_name (str): Room the message belongs to
+            body (bytes): Message body
+        """
+        with self.__condition:
+            if len(self.__pending) >= self.__max_pending:
+                self.__pending.popleft()
+                self.__dropped += 1
+                log(f"[-] Publish queue is full, dropped the oldest message", 'w')
+            self.__pending.append((room_exchange(room_name), body, 0))
+            self.__published += 1
+            self.__start()
+            self.__schedule_drain()
+
+    def publish_messages(self, room_name: str, messages) -> None:
+        """Queue accepted ChatMessages for the room's exchange, encoded as JSON documents
+
+        Args:
+            room_name (str): Room the messages were put in
+            messages (Iterable[ChatMessage]): Messages, oldest first
+        """
+        for message in messages:
+            self.publish(room_name, json.dumps(message.to_dict()).encode())
+
+    def flush(self, timeout: float = RMQ_CONFIRM_TIMEOUT_SECONDS) -> bool:
+        """Wait until every queued message has been confirmed by the broker
+
+        Args:
+            timeout (float, optional): Most seconds to wait. Defaults to RMQ_CONFIRM_TIMEOUT_SECONDS
+        Returns:
+            bool: True if nothing is left unconfirmed
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.unconfirmed == 0, timeout)
+
+    def close(self, timeout: float = RMQ_CONFIRM_TIMEOUT_SECONDS) -> None:
+        """Wait for outstanding confirms, then close the connection and stop the I/O thread
+
+        Args:
+            timeout (float, optional): Most seconds to wait for confirms. Defaults to RMQ_CONFIRM_TIMEOUT_SECONDS
+        """
+        if not self.flush(timeout):
+            log(f"[-] Closing publisher with {self.unconfirmed} unconfirmed messages", 'w')
+        with self.__condition:
+            self.__closing = True
+            self.__condition.notify_all()
+            connection, thread = self.__connection, self.__thread
+        #   Between connections the I/O thread has no connection; it sees the closing flag and stops by itself
+        if connection is not None:
+            connection.ioloop.add_callback_threadsafe(connection.close)
+        if thread is not None:
+            thread.join(timeout)
+        log("[+] Closed room publisher")
+
+    def stats(self) -> dict:
+        """Return the publisher counters
+
+        Returns:
+            dict: Messages published, confirmed, nacked, dropped and still unconfirmed
+        """
+        with self.__condition:
+            return {
+                'published': self.__published,
+                'confirmed': self.__confirmed,
+                'nacked': self.__nacked,
+                'dropped': self.__dropped,
+                'unconfirmed': self.unconfirmed,
+                'channels': len(self.__channels)
+            }
+
+    def __start(self) -> None:
+        """Start the I/O thread if it is not running. Caller holds the condition"""
+        if self.__thread is not None:
+            return
+        self.__closing = False
+        self.__thread = threading.Thread(target=self.__run, name="rmq-publisher", daemon=True)
+        self.__thread.start()
+
+    def __run(self) -> None:
+        """Body of the I/O thread: connect and run the connection's ioloop until it stops. A failed or lost
+        connection is retried after the reconnect delay while messages are waiting; the thread ends once the
+        publisher is closing or has nothing left to publish"""
+        delay = self.__min_reconnect_delay
+        while True:
+            with self.__condition:
+                if self.__closing:
+                    self.__thread = None
+                    return
+                self.__channels = list()
+                self.__drain_scheduled = False
+                self.__connected = False
+                self.__connection = self.__connection_factory(
+                    on_open_callback=self.__on_connection_open,
+                    on_open_error_callback=self.__on_connection_error,
+                    on_close_callback=self.__on_connection_closed)
+                connection = self.__connection
+            connection.ioloop.start()
+
+            with self.__condition:
+                self.__connection = None
+                if self.__connected:
+                    delay = self.__min_reconnect_delay
+                if self.__closing or len(self.__pending) == 0:
+                    self.__thread = None
+                    return
+                log(f"[-] Publisher reconnecting in {delay:.1f} seconds, {len(self.__pending)} messages waiting", 'w')
+                if self.__condition.wait_for(lambda: self.__closing, delay):
+                    self.__thread = None
+                    return
+            delay = min(delay * 2, self.__max_reconnect_delay)
+
+    def __schedule_drain(self) -> None:
+        """Ask the I/O thread to publish queued messages over the channels that are open. Caller holds the
+        condition"""
+        if not self.__drain_scheduled and len(self.__channels) > 0:
+            self.__drain_scheduled = True
+            self.__connection.ioloop.add_callback_threadsafe(self.__drain)
+
+    def __on_connection_open(self, connection) -> None:
+        log(f"[+] Publisher connected, opening {self.__num_channels} channels")
+        with self.__condition:
+            self.__connected = True
+        for _ in range(self.__num_channels):
+            connection.channel(on_open_callback=self.__on_channel_open)
+
+    def __on_channel_open(self, channel) -> None:
+        publish_channel = _PublishChannel(channel)
+        channel.confirm_delivery(ack_nack_callback=lambda frame: self.__on_confirm(publish_channel, frame))
+        with self.__condition:
+            self.__channels.append(publish_channel)
+            self.__schedule_drain()
+
+    def __on_connection_error(self, connection, error) -> None:
+        log(f"[-] Publisher could not connect: {error}", 'e')
+        connection.ioloop.stop()
+
+    def __on_connection_closed(self, connection, reason) -> None:
+        with self.__condition:
+            #   Publishes that were never confirmed go out again on the next connection
+            for publish_channel in self.__channels:
+                self.__pending.extendleft(reversed(list(publish_channel.unconfirmed.values())))
+            self.__channels = list()
+            if not self.__closing:
+                log(f"[-] Publisher connection closed: {reason}", 'e')
+        connection.ioloop.stop()
+
+    def __drain(self) -> None:
+        """Publish queued messages on channels with room in their confirm window. Runs on the I/O thread"""
+        with self.__condition:
+            self.__drain_scheduled = False
+            batches = list()
+            for publish_channel in self.__channels:
+                room = self.__confirm_batch - len(publish_channel.unconfirmed)
+                if room > 0 and len(self.__pending) > 0:
+                    batches.append((publish_channel, [self.__pending.popleft() for _ in range(min(room, len(self.__pending)))]))
+
+        properties = spec.BasicProperties(content_type="application/json", delivery_mode=2)
+        for publish_channel, batch in batches:
+            for exchange, body, nacks in batch:
+                if exchange in publish_channel.exchanges:
+                    publish_channel.exchanges.move_to_end(exchange)
+                else:
+                    publish_channel.channel.exchange_declare(
+                        exchange=exchange, exchange_type=RMQ_DEFAULT_EXCHANGE_TYPE, durable=True)
+                    publish_channel.exchanges[exchange] = None
+                    if len(publish_channel.exchanges) > self.__max_exchanges:
+                        publish_channel.exchanges.popitem(last=False)
+                publish_channel.unconfirmed[publish_channel.next_tag] = (exchange, body, nacks)
+                publish_channel.next_tag += 1
+                publish_channel.channel.basic_publish(exchange=exchange, routing_key="", body=body, properties=properties)
+
+    def __on_confirm(self, publish_channel: _PublishChannel, frame) -> None:
+        """Settle the publishes covered by a Basic.Ack or Basic.Nack. Runs on the I/O thread"""
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in publish_channel.unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in publish_channel.unconfirmed else []
+        settled = [publish_channel.unconfirmed.pop(tag) for tag in tags]
+        with self.__condition:
+            if isinstance(method, spec.Basic.Nack):
+                self.__nacked += len(settled)
+                retries = [(exchange, body, nacks + 1) for exchange, body, nacks in settled if nacks + 1 < self.__max_nacks]
+                self.__dropped += len(settled) - len(retries)
+                self.__pending.extendleft(reversed(retries))
+                log(f"[-] Broker nacked {len(settled)} publishes, queued {len(retries)} again", 'w')
+                if len(retries) < len(settled):
+                    log(f"[-] Dropped {len(settled) - len(retries)} publishes nacked {self.__max_nacks} times", 'e')
+            else:
+                self.__confirmed += len(settled)
+            self.__condition.notify_all()
+            if len(self.__pending) > 0:
+                self.__schedule_drain()
+
+
+_publisher = RoomPublisher() if RMQ_PUBLISH_ENABLED else None
+
+
+def get_room_publisher() -> RoomPublisher | None:
+    """Return the process wide RoomPublisher, or None if publishing is disabled (RMQ_PUBLISH_ENABLED)
+
+    Returns:
+        RoomPublisher | None: Shared publisher
+    """
+    return _publisher
+
+
+def set_room_publisher(publisher: RoomPublisher | None) -> None:
+    """Replace the shared publisher, e.g. with one connected to a LocalBroker. Rooms created afterwards use it
+
+    Args:
+        publisher (RoomPublisher | None): Publisher to share, or None to disable publishing
+    """
+    global _publisher
+    _publisher = publisher
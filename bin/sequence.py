@@ -0,0 +1,207 @@
+"""
+Hi/lo sequence number allocator. Reserves blocks of sequence numbers per room with a single MongoDB
+round trip and hands them out locally. Each room has a single writing process at a time, which holds a
+lease on the room's counter
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import os
+import threading
+import time
+import uuid
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("sequence")
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+class SequenceOwnershipError(PyMongoError):
+    """Raised when another process holds the lease on a room's sequence counter. Transient: the lease runs
+    out SEQUENCE_OWNER_LEASE_SECONDS after the other process last reserved a block, or as soon as it releases
+    it on shutdown"""
+
+
+class SequenceAllocator:
+    """Allocates sequence numbers for chat rooms. Every room has its own counter document in the sequence
+    collection, so rooms never contend on a shared document. A process reserves a block of block_size
+    numbers with one atomic $inc and serves them from memory until the block runs out.
+
+    Readers use sequence numbers as cursors (after_seq, X-Next-After-Seq, the notifier's high-water marks),
+    which is only sound if a room's numbers are committed in increasing order. Two processes serving
+    numbers from their own blocks would commit them interleaved, so a room has a single writer: reserving
+    a block also takes a lease on the room's counter, renewed with every reservation, and a process whose
+    reservation finds another process's lease raises SequenceOwnershipError instead. Deployments with
+    several API workers or consumers route each room to one of them. A block is only served for half the
+    lease, so a process never hands out numbers after its lease may have passed to another one. Numbers
+    left in a block when it is abandoned are skipped, so sequences can have gaps
+    """
+
+    def __init__(
+            self,
+            collection: Collection,
+            block_size: int = SEQUENCE_BLOCK_SIZE,
+            lease_seconds: float = SEQUENCE_OWNER_LEASE_SECONDS) -> None:
+        """Instantiate a SequenceAllocator
+
+        Args:
+            collection (Collection): Collection that stores the per room counter documents
+            block_size (int, optional): Numbers reserved per round trip. Defaults to SEQUENCE_BLOCK_SIZE
+            lease_seconds (float, optional): How long a reservation keeps other processes from writing to
+            the room. Defaults to SEQUENCE_OWNER_LEASE_SECONDS
+        """
+        self.__collection = collection
+        self.__block_size = block_size
+        self.__lease_seconds = lease_seconds
+        self.__owner = uuid.uuid4().hex
+        self.__blocks = dict()
+        self.__room_locks = dict()
+        self.__lock = threading.Lock()
+        self.__pid = os.getpid()
+
+    @property
+    def collection(self) -> Collection:
+        return self.__collection
+
+    @property
+    def block_size(self) -> int:
+        return self.__block_size
+
+    def allocate(self, room_name: str) -> int:
+        """Return the next sequence number for a room
+
+        Args:
+            room_name (str): Room to allocate a sequence number for
+        Returns:
+            int: Sequence number
+        Raises:
+            SequenceOwnershipError: If another process writes to the room
+            PyMongoError: If a new block can not be reserved
+        """
+        return self.allocate_many(room_name, 1)[0]
+
+    def allocate_many(self, room_name: str, count: int) -> list:
+        """Return count increasing sequence numbers for a room. Numbers left in the current block are
+        used first, and at most one round trip reserves the rest
+
+        Args:
+            room_name (str): Room to allocate sequence numbers for
+            count (int): Number of sequence numbers to allocate
+        Returns:
+            list: Increasing sequence numbers
+        Raises:
+            SequenceOwnershipError: If another process writes to the room
+            PyMongoError: If a new block can not be reserved
+        """
+        with self.__room_lock(room_name):
+            next_num, high_num, served_until = self.__blocks.get(room_name, (1, 0, 0.0))
+            if time.monotonic() >= served_until:
+                next_num, high_num = 1, 0
+            local_count = min(count, high_num - next_num + 1)
+            sequence_nums = list(range(next_num, next_num + local_count))
+            next_num += local_count
+
+            if local_count < count:
+                needed = count - local_count
+                reserve = max(self.__block_size, needed)
+                high_num = self.__reserve(room_name, reserve)
+                served_until = time.monotonic() + self.__lease_seconds / 2
+                next_num = high_num - reserve + 1
+                sequence_nums.extend(range(next_num, next_num + needed))
+                next_num += needed
+
+            self.__blocks[room_name] = (next_num, high_num, served_until)
+            return sequence_nums
+
+    def release(self) -> None:
+        """Give up the leases this process holds, so other processes can write to its rooms at once.
+        Called on shutdown"""
+        with self.__lock:
+            self.__blocks.clear()
+        self.__collection.update_many({'owner': self.__owner}, {'$unset': {'owner': True, 'lease_until': True}})
+        log("[+] Released sequence leases")
+
+    def __room_lock(self, room_name: str) -> threading.Lock:
+        """Return the lock that serialises allocations for a room. Rooms reserve their blocks in parallel;
+        the shared lock is only held to look the room's lock up"""
+        with self.__lock:
+            if os.getpid() != self.__pid:
+                #   Blocks reserved before a fork are shared with the parent, so they must not be used
+                self.__blocks.clear()
+                self.__room_locks.clear()
+                self.__owner = uuid.uuid4().hex
+                self.__pid = os.getpid()
+            room_lock = self.__room_locks.get(room_name)
+            if room_lock is None:
+                room_lock = self.__room_locks[room_name] = threading.Lock()
+            return room_lock
+
+    def __reserve(self, room_name: str, reserve: int) -> int:
+        """Reserve a block of numbers for a room with one atomic increment, taking or renewing the room's
+        lease in the same update
+
+        Args:
+            room_name (str): Room to reserve numbers for
+            reserve (int): Size of the block
+        Returns:
+            int: Highest number in the reserved block
+        Raises:
+            SequenceOwnershipError: If another process holds the room's lease
+        """
+        if room_name not in self.__blocks:
+            self.__seed(room_name)
+
+        now = time.time()
+        try:
+            #   A counter leased to another process does not match, so the upsert collides on its _id
+            counter = self.__collection.find_one_and_update(
+                {'_id': room_name, '$or': [
+                    {'owner': self.__owner}, {'owner': {'$exists': False}}, {'lease_until': {'$lt': now}}]},
+                {'$inc': {'next': reserve}, '$set': {'owner': self.__owner, 'lease_until': now + self.__lease_seconds}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            raise SequenceOwnershipError(f"Room {room_name} is written by another process")
+        log(f"[*] Reserved sequence numbers {counter['next'] - reserve + 1}-{counter['next']} for room {room_name}", 'd')
+        return counter['next']
+
+    def __seed(self, room_name: str) -> None:
+        """Carry over the counter a room had in the legacy shared sequence document, so new numbers never
+        collide with messages that are already stored
+
+        Args:
+            room_name (str): Room to seed the counter for
+        """
+        legacy = self.__collection.find_one({'_id': SEQUENCE_LEGACY_ID}, projection={room_name: True})
+        if legacy is not None and isinstance(legacy.get(room_name), int):
+            self.__collection.update_one({'_id': room_name}, {'$max': {'next': legacy[room_name]}}, upsert=True)
+
+
+def get_sequence_allocator(collection: Collection) -> SequenceAllocator:
+    """Return the process wide allocator for a sequence collection, creating it on first use
+
+    Args:
+        collection (Collection): Collection that stores the counter documents
+    Returns:
+        SequenceAllocator: Shared allocator
+    """
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None or _allocator.collection.database.client is not collection.database.client:
+            _allocator = SequenceAllocator(collection)
+        return _allocator
+
+
+def release_sequence_leases() -> None:
+    """Release the room leases of the process wide allocator, if one was created"""
+    with _allocator_lock:
+        allocator = _allocator
+    if allocator is not None:
+        allocator.release()
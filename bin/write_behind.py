@@ -0,0 +1,210 @@
+"""
+Write-behind buffer that group commits MongoDB writes from a background flusher thread
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+import time
+from pymongo.collection import Collection
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("writeBehind")
+
+_buffers = dict()
+_buffers_lock = threading.Lock()
+
+
+class WriteBehindBuffer:
+    """Buffer of pending write operations for a single collection. Writes are accepted immediately and
+    committed in batches by a background thread. A batch is flushed when it reaches max_batch operations or
+    when the oldest pending operation has waited max_latency_ms, whichever comes first. Operations that
+    target the same key are coalesced, so only the latest version of a document is written
+    """
+
+    def __init__(
+            self,
+            collection: Collection,
+            max_batch: int = WRITE_BEHIND_MAX_BATCH,
+            max_latency_ms: int = WRITE_BEHIND_MAX_LATENCY_MS) -> None:
+        """Instantiate a WriteBehindBuffer and start its flusher thread
+
+        Args:
+            collection (Collection): Collection the buffered operations are written to
+            max_batch (int, optional): Operations per batch. Defaults to WRITE_BEHIND_MAX_BATCH
+            max_latency_ms (int, optional): Longest time an operation waits before being flushed.
+            Defaults to WRITE_BEHIND_MAX_LATENCY_MS
+        """
+        self.__collection = collection
+        self.__max_batch = max_batch
+        self.__max_latency = max_latency_ms / 1000
+        self.__pending = dict()
+        self.__oldest_time = None
+        self.__closed = False
+        self.__condition = threading.Condition()
+        self.__write_lock = threading.Lock()
+
+        #   Counters used to tune the throughput / durability trade off
+        self.__flushes = 0
+        self.__flushed_ops = 0
+        self.__failed_ops = 0
+        self.__last_flush_ms = 0.0
+        self.__max_flush_ms = 0.0
+        self.__total_flush_ms = 0.0
+
+        self.__thread = threading.Thread(target=self.__run, name=f"write-behind-{collection.name}", daemon=True)
+        self.__thread.start()
+
+    @property
+    def collection(self) -> Collection:
+        return self.__collection
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.__pending)
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
+
+    def submit(self, key, operation) -> None:
+        """Queue a write operation. If an operation with the same key is already pending it is replaced
+
+        Args:
+            key: Hashable identifier of the document the operation writes
+            operation: pymongo write operation (e.g. UpdateOne) to include in the next bulk write
+        """
+        with self.__condition:
+            if self.__closed:
+                #   Nothing will flush a closed buffer, so write straight through
+                self.__write([operation])
+                return
+
+            if len(self.__pending) == 0:
+                self.__oldest_time = time.monotonic()
+            self.__pending.pop(key, None)
+            self.__pending[key] = operation
+            self.__condition.notify()
+
+    def flush(self) -> None:
+        """Synchronously write every pending operation"""
+        with self.__write_lock:
+            with self.__condition:
+                batch = self.__take(len(self.__pending))
+            self.__write(batch)
+
+    def close(self) -> None:
+        """Stop the flusher thread and write every pending operation. Safe to call more than once"""
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify()
+        self.__thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Return the buffer counters
+
+        Returns:
+            dict: Queue depth, flush counts and flush latencies in milliseconds
+        """
+        return {
+            'queue_depth': self.queue_depth,
+            'flushes': self.__flushes,
+            'flushed_ops': self.__flushed_ops,
+            'failed_ops': self.__failed_ops,
+            'last_flush_ms': self.__last_flush_ms,
+            'max_flush_ms': self.__max_flush_ms,
+            'avg_flush_ms': self.__total_flush_ms / self.__flushes if self.__flushes > 0 else 0.0
+        }
+
+    def __take(self, count: int) -> list:
+        """Remove up to count of the oldest pending operations. Caller must hold the condition"""
+        keys = list(self.__pending)[:count]
+        batch = [self.__pending.pop(key) for key in keys]
+        self.__oldest_time = time.monotonic() if len(self.__pending) > 0 else None
+        return batch
+
+    def __write(self, batch: list) -> None:
+        """Write a batch of operations with one unordered bulk write and update the counters"""
+        if len(batch) == 0:
+            return
+
+        start_time = time.perf_counter()
+        try:
+            self.__collection.bulk_write(batch, ordered=False)
+            self.__flushed_ops += len(batch)
+        except Exception as e:
+            self.__failed_ops += len(batch)
+            log(f"[-] Failed to flush {len(batch)} buffered writes: {e}", 'e')
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        self.__flushes += 1
+        self.__last_flush_ms = elapsed_ms
+        self.__max_flush_ms = max(self.__max_flush_ms, elapsed_ms)
+        self.__total_flush_ms += elapsed_ms
+
+    def __run(self) -> None:
+        """Flusher thread. Waits for a full batch or for the latency limit of the oldest operation"""
+        while True:
+            with self.__condition:
+                while len(self.__pending) == 0 and not self.__closed:
+                    self.__condition.wait()
+                if self.__closed:
+                    return
+
+                deadline = self.__oldest_time + self.__max_latency
+                while len(self.__pending) < self.__max_batch and not self.__closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+
+            with self.__write_lock:
+                with self.__condition:
+                    batch = self.__take(self.__max_batch)
+                self.__write(batch)
+
+
+def get_write_behind_buffer(
+        collection: Collection,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_latency_ms: int = WRITE_BEHIND_MAX_LATENCY_MS) -> WriteBehindBuffer:
+    """Return the process wide buffer for a collection, creating it on first use. All rooms stored in the
+    same collection share one buffer so their writes are committed together
+
+    Args:
+        collection (Collection): Collection the buffer writes to
+        max_batch (int, optional): Operations per batch, used when the buffer is created. Defaults to
+        WRITE_BEHIND_MAX_BATCH
+        max_latency_ms (int, optional): Longest time an operation waits before being flushed, used when the
+        buffer is created. Defaults to WRITE_BEHIND_MAX_LATENCY_MS
+    Returns:
+        WriteBehindBuffer: Shared buffer for the collection
+    """
+    with _buffers_lock:
+        buffer = _buffers.get(collection.full_name)
+        if buffer is not None and buffer.collection.database.client is not collection.database.client:
+            #   The shared client was replaced (e.g. by a test), so retire the buffer bound to the old one
+            buffer.close()
+            buffer = None
+        if buffer is None:
+            buffer = WriteBehindBuffer(collection, max_batch=max_batch, max_latency_ms=max_latency_ms)
+            _buffers[collection.full_name] = buffer
+            log(f"[+] Started write-behind buffer for {collection.full_name}")
+        return buffer
+
+
+def close_write_behind_buffers() -> None:
+    """Flush and stop every write-behind buffer. Called on application shutdown"""
+    with _buffers_lock:
+        for name, buffer in _buffers.items():
+            buffer.close()
+            log(f"[-] Flushed and closed write-behind buffer for {name}")
+        _buffers.clear()
+
+
+def write_behind_stats() -> dict:
+    """Return the counters of every write-behind buffer keyed by collection name"""
+    with _buffers_lock:
+        return {name: buffer.stats() for name, buffer in _buffers.items()}
@@ -5,18 +5,75 @@ API for the message chat application
 __author__ = "Zac Foteff"
 __version__ = "2.0.0."
 
-import time
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, Response
-from src.chat_room import ChatRoom
+import asyncio
+import json
+from itertools import islice
+from typing import AsyncIterator, Iterator
+from contextlib import asynccontextmanager
+from fastapi import Body, FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from src.chat_message import ChatMessage
+from src.room_registry import RoomRegistry
 from src.room_list import RoomList
 from src.user_list import UserList
 from bin.constants import *
-from bin.logger import Logger
+from bin.logger import Logger, log_stats
+from bin.command_monitor import get_command_monitor
+from bin.db import close_client, ensure_indexes
+from bin.executor import KeyedExecutor
+from bin.fanout import Subscriber, get_room_fanout
+from bin.metrics import MetricsMiddleware, get_request_metrics
+from bin.notifier import get_room_notifier
+from bin.publisher import get_room_publisher
+from bin.sequence import SequenceOwnershipError, release_sequence_leases
+from bin.write_behind import close_write_behind_buffers, write_behind_stats
 
-app = FastAPI()
 log = Logger("api")
-log("[-+-] Started chat app")
+#   Every blocking MongoDB call runs on this pool, serialised per room or user list
+executor = KeyedExecutor()
+#   Evicted rooms are persisted under their own key, so the persist can not overlap a request on that room
+rooms = RoomRegistry(on_evict=lambda room: executor.submit(f"room:{room.room_name}", room.persist))
+notifier = get_room_notifier()
+fanout = get_room_fanout()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan. Ensures the MongoDB indexes exist on startup, then waits for in flight blocking
+    calls, flushes buffered writes, waits for outstanding RabbitMQ confirms and releases the room sequence
+    leases and the shared MongoDB connection pool when the application stops"""
+    ensure_indexes()
+    log("[-+-] Started chat app")
+    yield
+    executor.shutdown()
+    rooms.clear()
+    if get_room_publisher() is not None:
+        get_room_publisher().close()
+    close_write_behind_buffers()
+    release_sequence_leases()
+    close_client()
+    log("[-+-] Stopped chat app")
+
+
+app = FastAPI(lifespan=lifespan)
+#   Latency histograms and in-flight gauges for every HTTP route, exposed on GET /metrics
+app.add_middleware(MetricsMiddleware, routes=app.routes, metrics=get_request_metrics())
+
+
+@app.exception_handler(SequenceOwnershipError)
+async def room_written_elsewhere(request: Request, error: SequenceOwnershipError):
+    """Sends to a room another process writes to are refused with 409; the client retries, or the room is
+    routed to its writer (see SequenceAllocator)"""
+    return JSONResponse(status_code=409, content=str(error))
+
+
+class BatchMessage(BaseModel):
+    """One message of a POST /messages/batch request"""
+    room_name: str
+    message: str
+    from_alias: str
+    to_alias: str
 
 
 @app.get("/", status_code=200)
@@ -27,9 +84,6 @@ async def index():
         dict: JSON(ish) response that can be viewed in the browser to confirm
         the website is running
     """
-    start_time = time.perf_counter()
-    elapsed_time = time.perf_counter() - start_time
-    log(f"GET / {elapsed_time} result: Success")
     return JSONResponse(status_code=200, content="You've hit Zac's root endpoint!")
 
 
@@ -43,35 +97,474 @@ async def send_message(room_name: str, message: str, from_alias: str, to_alias:
         from_alias (str): sender alias
         to_alias (str): reciever alias
     Returns:
-        JSONResponse: status of sent message user can view in the browser
+        JSONResponse: status of sent message user can view in the browser. 201 if the message was sent, 403
+        if the room rejected it
     """
-    start_time = time.perf_counter()
-    chat_room = ChatRoom(room_name=room_name)
-    chat_room.send_message(message=message, room_name=room_name, from_alias=from_alias, to_alias=to_alias)
-    elapsed_time = time.perf_counter() - start_time
-    log(f"POST /message/ {elapsed_time} result: Success")
+    room_key = f"room:{room_name}"
+    chat_room = await executor.run(room_key, rooms.get, room_name)
+    if not await executor.run(
+            room_key, chat_room.send_message, message=message, from_alias=from_alias, to_alias=to_alias):
+        log(f"[-] Room {room_name} rejected a message from {from_alias} to {to_alias}", 'w')
+        return JSONResponse(status_code=403, content='Message rejected')
     return JSONResponse(status_code=201, content='Enqueued message')
 
 
+@app.post("/messages/batch", status_code=201)
+async def send_message_batch(messages: list[BatchMessage] = Body(min_length=1, max_length=BATCH_MAX_MESSAGES)):
+    """ API endpoint for sending many messages in one request. Messages are grouped by room, and each room
+    allocates the group's sequence numbers in one operation and saves it with a single bulk write. Groups
+    for different rooms are sent in parallel
+
+    Args:
+        messages (list[BatchMessage]): Messages to send, in order
+    Returns:
+        JSONResponse: Status and assigned sequence number for each message, in request order. 201 if every
+        message was sent, 207 otherwise
+    """
+    groups = dict()
+    for index, item in enumerate(messages):
+        groups.setdefault(item.room_name, []).append(index)
+
+    async def send_group(room_name: str, indexes: list) -> list:
+        room_key = f"room:{room_name}"
+        chat_room = await executor.run(room_key, rooms.get, room_name)
+        batch = [(messages[index].message, messages[index].from_alias, messages[index].to_alias) for index in indexes]
+        return await executor.run(room_key, chat_room.send_messages, batch)
+
+    group_results = await asyncio.gather(
+        *(send_group(room_name, indexes) for room_name, indexes in groups.items()), return_exceptions=True)
+
+    results = [None] * len(messages)
+    for (room_name, indexes), sequence_nums in zip(groups.items(), group_results):
+        if isinstance(sequence_nums, Exception):
+            log(f"[-] POST /messages/batch failed for room {room_name}: {sequence_nums}", 'e')
+            sequence_nums = [sequence_nums] * len(indexes)
+        for index, sequence_num in zip(indexes, sequence_nums):
+            if isinstance(sequence_num, Exception):
+                status = 'error'
+            else:
+                status = 'sent' if sequence_num is not None else 'rejected'
+            results[index] = {
+                'index': index,
+                'room_name': room_name,
+                'status': status,
+                'sequence_num': sequence_num if status == 'sent' else None
+            }
+
+    all_sent = all(result['status'] == 'sent' for result in results)
+    log("POST /messages/batch result: %s messages in %s rooms", 'd', len(messages), len(groups))
+    return JSONResponse(status_code=201 if all_sent else 207, content={'results': results})
+
+
+def read_chunk(messages: Iterator[ChatMessage], chunk_size: int = STREAM_CHUNK_SIZE) -> list:
+    """Read the next chunk of messages from a room's message generator. Blocking, so run on the executor
+
+    Args:
+        messages (Iterator[ChatMessage]): Message generator of a room
+        chunk_size (int, optional): Most messages to read. Defaults to STREAM_CHUNK_SIZE
+    Returns:
+        list: Up to chunk_size messages. Fewer means the generator is exhausted
+    """
+    return list(islice(messages, chunk_size))
+
+
+def read_first_chunk(chat_room, messages: Iterator[ChatMessage], chunk_size: int | None = STREAM_CHUNK_SIZE) -> tuple:
+    """Read the first chunk of messages together with the room's high-water mark, so the mark is never
+    lower than a message in the response. Blocking, so run on the executor
+
+    Args:
+        chat_room (ChatRoom): Room being read
+        messages (Iterator[ChatMessage]): Message generator of the room
+        chunk_size (int | None, optional): Most messages to read. None reads them all. Defaults to STREAM_CHUNK_SIZE
+    Returns:
+        tuple: The messages read and the room's high-water mark
+    """
+    return list(islice(messages, chunk_size)), chat_room.high_water_mark
+
+
+async def stream_message_texts(
+        room_key: str,
+        chat_room,
+        alias: str,
+        first_chunk: list,
+        messages: Iterator[ChatMessage],
+        chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[str]:
+    """Serialise the text of each message into a JSON array, yielding it a chunk of messages at a time.
+    Each further chunk is read from the room on the executor, under the room's key. Once the whole array
+    has been sent, the reader's receipt is advanced there too; a read cut short leaves it where it was
+
+    Args:
+        room_key (str): Executor key of the room being read
+        chat_room (ChatRoom): Room being read
+        alias (str): Alias of the reader
+        first_chunk (list): Messages that were already read
+        messages (Iterator[ChatMessage]): Message generator the rest of the messages are read from
+        chunk_size (int, optional): Messages per yielded chunk. Defaults to STREAM_CHUNK_SIZE
+    Returns:
+        AsyncIterator[str]: Pieces of the JSON array
+    """
+    yield '['
+    separator = ''
+    highest_read = 0
+    chunk = first_chunk
+    while len(chunk) > 0:
+        yield separator + ','.join(json.dumps(message.message) for message in chunk)
+        separator = ','
+        highest_read = max(highest_read, max(message.mess_props.sequence_num for message in chunk))
+        if len(chunk) < chunk_size:
+            break
+        chunk = await executor.run(room_key, read_chunk, messages, chunk_size)
+    yield ']'
+    if highest_read > 0:
+        await executor.run(room_key, chat_room.mark_read, alias, highest_read)
+
+
 @app.get('/messages/', status_code=200)
-async def get_messages(request: Request, alias: str, room_name: str, messages_to_get: int = GET_ALL_MESSAGES):
-    """ Message retrieval endpoint for the application
+async def get_messages(
+        request: Request,
+        alias: str,
+        room_name: str,
+        messages_to_get: int = GET_ALL_MESSAGES,
+        before_seq: int | None = None,
+        direct_only: bool = False,
+        after_seq: int | None = None,
+        wait_seconds: float = Query(default=0, ge=0, le=LONG_POLL_MAX_SECONDS)):
+    """ Message retrieval endpoint for the application. Returns the newest messages of the room, oldest
+    first, or pages backwards through older history when a before_seq cursor is supplied. With direct_only
+    set, only messages sent to alias are returned, read from the room's inbox index. The sequence
+    number to use as the cursor for the next (older) page is returned in the X-Next-Before-Seq header.
+    Clients keep in sync by passing after_seq, which returns only newer messages (the oldest
+    messages_to_get of them). The cursor for the next sync is returned in the X-Next-After-Seq header,
+    and the room's highest sequence number in the X-High-Water-Mark header. A sync with wait_seconds set
+    is a long poll: when there is nothing new, the request waits up to wait_seconds for the room to accept
+    a message before answering.
+    The response body is serialised incrementally as the room is read
 
     Args:
-        request (Request): 
-        alias (str): 
-        room_name (str): 
-        messages_to_get (int, optional): 
+        request (Request): Incoming request
+        alias (str): Alias of the user requesting the messages
+        room_name (str): Room to read messages from
+        messages_to_get (int, optional): Page size. Defaults to GET_ALL_MESSAGES
+        before_seq (int, optional): Only return messages with a lower sequence number. Defaults to None
+        direct_only (bool, optional): Only return messages sent to alias. Defaults to False
+        after_seq (int, optional): Only return messages with a higher sequence number. Defaults to None
+        wait_seconds (float, optional): Long poll timeout for a sync with no new messages. Defaults to 0
     Returns:
         dict: JSON(ish) response so the user can view all the messages in the browser
     """
-    log(f"Attempting to send messages to chat room {room_name} . . .")
-    start_time = time.perf_counter()
-    chat_room = ChatRoom(room_name=room_name)
-    messages = chat_room.get_messages(alias)
-    elapsed_time = time.perf_counter() - start_time
-    log(f"GET /messages/ {elapsed_time} result: Success")
-    return JSONResponse(status_code=200, content=messages)
+    if before_seq is not None and after_seq is not None:
+        return JSONResponse(status_code=400, content="before_seq and after_seq can not be combined")
+    log("Attempting to send messages to chat room %s . . .", 'd', room_name)
+    room_key = f"room:{room_name}"
+    chat_room = await executor.run(room_key, rooms.get, room_name)
+    messages = chat_room.iter_messages(
+        alias, num_messages=messages_to_get, before_seq=before_seq, direct_only=direct_only, after_seq=after_seq)
+    #   A sync reads its whole (new messages only) result up front so the next cursor can go in the headers
+    first_chunk, high_water_mark = await executor.run(
+        room_key, read_first_chunk, chat_room, messages, None if after_seq is not None else STREAM_CHUNK_SIZE)
+    if after_seq is not None and wait_seconds > 0 and len(first_chunk) == 0:
+        #   Messages up to the high-water mark were all filtered out, so only a newer message ends the wait
+        await notifier.wait(room_name, max(after_seq, high_water_mark), wait_seconds)
+        chat_room = await executor.run(room_key, rooms.get, room_name)
+        messages = chat_room.iter_messages(alias, num_messages=messages_to_get, direct_only=direct_only, after_seq=after_seq)
+        first_chunk, high_water_mark = await executor.run(room_key, read_first_chunk, chat_room, messages, None)
+
+    headers = {'X-High-Water-Mark': str(high_water_mark)}
+    if len(first_chunk) > 0:
+        headers['X-Next-Before-Seq'] = str(first_chunk[0].mess_props.sequence_num)
+    if after_seq is not None:
+        next_after_seq = first_chunk[-1].mess_props.sequence_num if len(first_chunk) > 0 else max(after_seq, high_water_mark)
+        headers['X-Next-After-Seq'] = str(next_after_seq)
+    return StreamingResponse(
+        stream_message_texts(room_key, chat_room, alias, first_chunk, messages),
+        status_code=200, media_type="application/json", headers=headers)
+
+def format_event(message: ChatMessage) -> str:
+    """Encode a message as a Server-Sent Event. The event id is the sequence number, so a reconnecting
+    client resumes from it through the Last-Event-ID header
+
+    Args:
+        message (ChatMessage): Message to encode
+    Returns:
+        str: SSE frame
+    """
+    return f"id: {message.mess_props.sequence_num}\nevent: message\ndata: {json.dumps(message.to_dict())}\n\n"
+
+
+@app.get('/rooms/{room_name}/stream', status_code=200)
+async def stream_room(request: Request, room_name: str, alias: str, after_seq: int | None = None):
+    """ Server-Sent Events stream of a room's new messages. Messages are pushed as the room accepts them,
+    oldest first, with messages from users blocked by alias left out. Without after_seq (or a Last-Event-ID
+    header) the stream starts with the next new message. A comment is sent every SSE_KEEPALIVE_SECONDS
+    while the room is quiet
+
+    Args:
+        request (Request): Incoming request
+        room_name (str): Room to stream
+        alias (str): Alias of the user streaming the room
+        after_seq (int, optional): Also send stored messages with a higher sequence number. Defaults to None
+    Returns:
+        StreamingResponse: text/event-stream response
+    """
+    room_key = f"room:{room_name}"
+    chat_room = await executor.run(room_key, rooms.get, room_name)
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id is not None and last_event_id.isdigit():
+        after_seq = int(last_event_id)
+    if after_seq is None:
+        after_seq = chat_room.high_water_mark
+
+    async def events() -> AsyncIterator[str]:
+        cursor = after_seq
+        while not await request.is_disconnected():
+            chat_room = await executor.run(room_key, rooms.get, room_name)
+            messages, high_water_mark = await executor.run(
+                room_key, read_first_chunk, chat_room, chat_room.iter_messages(alias, after_seq=cursor), None)
+            for message in messages:
+                yield format_event(message)
+            if len(messages) > 0:
+                await executor.run(room_key, chat_room.mark_read, alias, messages[-1].mess_props.sequence_num)
+            cursor = max(cursor, high_water_mark)
+            if await notifier.wait(room_name, cursor, SSE_KEEPALIVE_SECONDS) <= cursor:
+                yield ": keepalive\n\n"
+
+    log(f"GET /rooms/{room_name}/stream opened for {alias} after {after_seq}")
+    return StreamingResponse(events(), status_code=200, media_type="text/event-stream",
+                             headers={'Cache-Control': 'no-cache'})
+
+
+def read_receipt(chat_room, alias: str) -> dict:
+    """Read a user's receipt for a room. Blocking, so run on the executor"""
+    return {
+        'room_name': chat_room.room_name,
+        'alias': alias,
+        'read_seq': chat_room.read_cursor(alias),
+        'unread': chat_room.unread_count(alias),
+        'high_water_mark': chat_room.high_water_mark
+    }
+
+
+@app.get('/rooms/{room_name}/receipts', status_code=200)
+async def get_read_receipt(room_name: str, alias: str):
+    """ Read receipt of a user in a room: the highest sequence number they have read and the number of
+    messages sent to them since
+
+    Args:
+        room_name (str): Room to look in
+        alias (str): Alias of the reader
+    Returns:
+        JSONResponse: Read cursor, unread count and the room's high-water mark
+    """
+    room_key = f"room:{room_name}"
+    chat_room = await executor.run(room_key, rooms.get, room_name)
+    receipt = await executor.run(room_key, read_receipt, chat_room, alias)
+    log(f"GET /rooms/{room_name}/receipts result: {receipt}")
+    return JSONResponse(status_code=200, content=receipt)
+
+
+@app.get('/rooms/{room_name}/search', status_code=200)
+async def search_messages(
+        room_name: str,
+        q: str = Query(min_length=1),
+        limit: int = Query(default=SEARCH_RESULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+        alias: str | None = None):
+    """ Full text search over a room's history. Every term of q must appear in a message, and a term
+    ending in '*' matches as a prefix. Results are newest first
+
+    Args:
+        room_name (str): Room to search
+        q (str): Search terms
+        limit (int, optional): Most results to return. Defaults to SEARCH_RESULT_LIMIT
+        alias (str, optional): Alias of the user searching, to leave out messages from users they blocked.
+        Defaults to None
+    Returns:
+        JSONResponse: Matching messages
+    """
+    room_key = f"room:{room_name}"
+    chat_room = await executor.run(room_key, rooms.get, room_name)
+    messages = await executor.run(room_key, chat_room.search, q, limit=limit, alias=alias)
+    return JSONResponse(status_code=200, content=[message.to_dict() for message in messages])
+
+@app.get('/metrics', status_code=200)
+async def get_metrics():
+    """Request latency histograms and in-flight gauges, per route, method and status, in the Prometheus
+    text format
+
+    Returns:
+        PlainTextResponse: Exposition text
+    """
+    return PlainTextResponse(get_request_metrics().render(), media_type="text/plain; version=0.0.4")
+
+@app.get('/stats/write_behind/', status_code=200)
+async def get_write_behind_stats():
+    """Write-behind buffer counters (queue depth, flush counts and flush latency) for tuning
+
+    Returns:
+        JSONResponse: Counters keyed by the collection each buffer writes to
+    """
+    return JSONResponse(status_code=200, content=write_behind_stats())
+
+@app.get('/stats/rooms/', status_code=200)
+async def get_room_registry_stats():
+    """Room registry counters (hits, misses, evictions, resident rooms and memory) for sizing
+
+    Returns:
+        JSONResponse: Registry counters
+    """
+    return JSONResponse(status_code=200, content=rooms.stats())
+
+@app.get('/stats/executor/', status_code=200)
+async def get_executor_stats():
+    """Blocking call executor counters (worker limit, calls in flight and completed) for sizing
+
+    Returns:
+        JSONResponse: Executor counters
+    """
+    return JSONResponse(status_code=200, content=executor.stats())
+
+def open_subscription(chat_room, alias: str) -> tuple:
+    """Read what a new subscription needs from the room: the subscriber's blocked users in the room and the
+    room's high-water mark. Blocking, so run on the executor
+
+    Args:
+        chat_room (ChatRoom): Room being subscribed to
+        alias (str): Alias of the subscriber
+    Returns:
+        tuple: The live blocked user set of the member (empty if alias is not a member) and the high-water mark
+    """
+    member = chat_room.get_group_member(alias)
+    return (member.blocked_users if member is not None else frozenset()), chat_room.high_water_mark
+
+
+def socket_error(detail: str, room_name: str = None) -> dict:
+    return {'type': 'error', 'room_name': room_name, 'detail': detail}
+
+
+async def handle_socket_request(subscriber: Subscriber, text: str) -> dict:
+    """Carry out one request frame from a WebSocket client
+
+    Args:
+        subscriber (Subscriber): Connection the frame arrived on
+        text (str): JSON request frame
+    Returns:
+        dict: Reply frame
+    """
+    try:
+        request = json.loads(text)
+    except json.JSONDecodeError:
+        return socket_error("Request frames must be JSON objects")
+    if not isinstance(request, dict) or not isinstance(request.get('room_name'), str):
+        return socket_error("Request frames must be JSON objects with a room_name")
+
+    action = request.get('action')
+    room_name = request['room_name']
+    room_key = f"room:{room_name}"
+    if action == 'subscribe':
+        chat_room = await executor.run(room_key, rooms.get, room_name)
+        blocked_users, high_water_mark = await executor.run(room_key, open_subscription, chat_room, subscriber.alias)
+        if not fanout.subscribe(subscriber, room_name, blocked_users):
+            return socket_error(f"Connections can subscribe to at most {WS_MAX_ROOMS_PER_CONNECTION} rooms", room_name)
+        return {'type': 'subscribed', 'room_name': room_name, 'high_water_mark': high_water_mark}
+    if action == 'unsubscribe':
+        fanout.unsubscribe(subscriber, room_name)
+        return {'type': 'unsubscribed', 'room_name': room_name}
+    if action == 'send':
+        message, to_alias = request.get('message'), request.get('to_alias')
+        if not isinstance(message, str) or not isinstance(to_alias, str):
+            return socket_error("send requires message and to_alias", room_name)
+        chat_room = await executor.run(room_key, rooms.get, room_name)
+        sequence_nums = await executor.run(room_key, chat_room.send_messages, [(message, subscriber.alias, to_alias)])
+        if sequence_nums[0] is None:
+            return socket_error("Message was rejected by the room", room_name)
+        return {'type': 'sent', 'room_name': room_name, 'sequence_num': sequence_nums[0]}
+    return socket_error(f"Unknown action {action}", room_name)
+
+
+async def write_frames(websocket: WebSocket, subscriber: Subscriber) -> None:
+    """Send a subscriber's queued frames until it is closed. This task is the only writer of the socket
+
+    Args:
+        websocket (WebSocket): Connection to write to
+        subscriber (Subscriber): Send queue of the connection
+    """
+    try:
+        while (frame := await subscriber.next_frame()) is not None:
+            await websocket.send_text(frame)
+        if subscriber.close_code in (WS_CLOSE_SLOW_CONSUMER, WS_CLOSE_POLICY_VIOLATION):
+            await websocket.close(code=subscriber.close_code)
+    except Exception as e:
+        log(f"[-] Stopped writing to the socket of {subscriber.alias}: {e}", 'd')
+        subscriber.close()
+
+
+@app.websocket('/ws')
+async def room_socket(websocket: WebSocket, alias: str):
+    """ WebSocket endpoint for interactive clients. The client sends JSON request frames:
+        * {"action": "subscribe", "room_name": ...} answers with the room's high_water_mark. Later messages
+          are pushed as {"type": "message"} frames; anything up to the mark is read with GET /messages/?after_seq
+        * {"action": "unsubscribe", "room_name": ...}
+        * {"action": "send", "room_name": ..., "message": ..., "to_alias": ...} sends as alias
+    Messages from users alias has blocked in a room are not pushed. A client that falls WS_SEND_QUEUE_SIZE
+    frames behind is handled by WS_SLOW_CONSUMER_POLICY: dropped frames are reported with a
+    {"type": "lagged"} frame, or the connection is closed with code WS_CLOSE_SLOW_CONSUMER. A client that
+    leaves more than WS_MAX_PENDING_REPLIES replies unread is closed with code WS_CLOSE_POLICY_VIOLATION
+
+    Args:
+        websocket (WebSocket): Incoming connection
+        alias (str): Alias of the connecting user
+    """
+    await websocket.accept()
+    subscriber = Subscriber(alias)
+    writer = asyncio.create_task(write_frames(websocket, subscriber))
+    log(f"WS /ws opened for {alias}")
+    try:
+        while subscriber.close_code is None:
+            text = await websocket.receive_text()
+            subscriber.reply(json.dumps(await handle_socket_request(subscriber, text)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        fanout.unsubscribe(subscriber)
+        subscriber.close()
+        await writer
+        log(f"WS /ws closed for {alias}")
+
+
+@app.get('/stats/fanout/', status_code=200)
+async def get_fanout_stats():
+    """WebSocket fan-out counters (rooms with subscribers, subscribed connections, frames encoded and delivered)
+
+    Returns:
+        JSONResponse: Fan-out counters
+    """
+    return JSONResponse(status_code=200, content=fanout.stats())
+
+@app.get('/stats/notifier/', status_code=200)
+async def get_notifier_stats():
+    """Room notifier counters (rooms tracked, long polls and streams waiting, notifications sent)
+
+    Returns:
+        JSONResponse: Notifier counters
+    """
+    return JSONResponse(status_code=200, content=notifier.stats())
+
+@app.get('/stats/logger/', status_code=200)
+async def get_logger_stats():
+    """Log queue counters (records waiting to be written, records dropped because the queue was full)
+
+    Returns:
+        JSONResponse: Log queue counters
+    """
+    return JSONResponse(status_code=200, content=log_stats())
+
+@app.get('/stats/db/', status_code=200)
+async def get_db_stats():
+    """Process wide MongoDB command counters (commands, failed commands, milliseconds spent in commands)
+
+    Returns:
+        JSONResponse: Command counters
+    """
+    return JSONResponse(status_code=200, content=get_command_monitor().stats())
 
 """
 User routes
@@ -80,32 +573,35 @@ User routes
 async def get_users(list_name: str=DB_DEFAULT_USER_LIST):
     """
     """
-    start_time = time.perf_counter()
-    users = UserList(list_name=list_name)
+    users = await executor.run(f"users:{list_name}", UserList, list_name=list_name)
     if len(users.get_all_users()) > 0:
-        elapsed_time = time.perf_counter() - start_time
-        log(f"GET /users/ {elapsed_time} result: 200")
         return JSONResponse(status_code=200, content=users.get_all_users())
     else:
-        elapsed_time = time.perf_counter() - start_time
-        log(f"GET /users/ {elapsed_time} result: 405")
         return JSONResponse(status_code=405, content="No users registered")
 
 @app.post('/register/user/', status_code=201)
 async def register_user(user_alias: str):
     """Register a new user to to the User List
     """
-    start_time = time.perf_counter()
-    users = UserList()
-    users.register(user_alias)
-    elapsed_time = time.perf_counter() - start_time
-    users.register(new_alias=user_alias)
-    log(f"POST /register/user/ {elapsed_time} result: 201")
+    users_key = f"users:{DB_DEFAULT_USER_LIST}"
+    users = await executor.run(users_key, UserList)
+    await executor.run(users_key, users.register, user_alias)
     return JSONResponse(status_code=201, content="Success")
 
 """
 Room routes
 """
+def add_room(room_name: str, owner_alias: str, room_type: int) -> bool:
+    """Build the room and add it to the room list. Blocking, so run on the executor
+
+    Returns:
+        bool: True if the room was added to the room list
+    """
+    room_list = RoomList()
+    new_room = rooms.get(room_name, room_type=room_type, owner_alias=owner_alias)
+    return room_list.add(new_room)
+
+
 @app.post("/room/", status_code=201)
 async def create_room(room_name: str, owner_alias: str, room_type: int = CHAT_ROOM_TYPE_PUBLIC):
     """API endpoint for creating a room
@@ -115,15 +611,9 @@ async def create_room(room_name: str, owner_alias: str, room_type: int = CHAT_RO
         owner_alias (str): _description_
         room_type (int, optional): _description_. Defaults to CHAT_ROOM_TYPE_PUBLIC.
     """
-    start_time = time.perf_counter()
     log(f"Creating a new room with the name {room_name}")
-    room_list = RoomList()
-    new_room = ChatRoom(room_name=room_name, room_type=room_type, owner_alias=owner_alias)
-    if room_list.add(new_room):
-        elapsed_time = time.perf_counter() - start_time
-        log(f"POST /room/{room_name}/{owner_alias}/{room_type} {elapsed_time} result: Success")
+    if await executor.run(f"room:{room_name}", add_room, room_name, owner_alias, room_type):
         return JSONResponse(status_code=201, content="Successfully created new room")
     else:
-        elapsed_time = time.perf_counter() - start_time
-        log(f"POST /room/{room_name}/{owner_alias}/{room_type} {elapsed_time} result: Room already exists")
+        log(f"[-] Room {room_name} already exists", 'w')
         return JSONResponse(status_code=405, content="Room not created")
@@ -11,6 +11,10 @@ log = Logger("chatMessageHandler")
 
 
 class ChatMessage:
+    """ChatMessage class object. Uses __slots__ to keep the footprint of resident messages small"""
+
+    __slots__ = ('__message', '__mess_props', '__dirty')
+
     def __init__(self, message: str, mess_props: MessageProperties = None):
         """Instantiates a ChatMessage object. The object contains a message to be stored in the MongoDB to be 
         delivered to a user later. The object also contains all necessary properties and metadata of the message
@@ -38,6 +42,11 @@ class ChatMessage:
     def mess_props(self) -> MessageProperties:
         return self.__mess_props
 
+    @property
+    def message_id(self) -> str:
+        """Deterministic id of the message, derived from its room name and sequence number"""
+        return f"{self.__mess_props.room_name}:{self.__mess_props.sequence_num}"
+
     @property
     def dirty(self) -> bool:
         return self.__dirty
@@ -5,18 +5,38 @@ Class for interactions with MongoDB and RabbitMQ to create a Chat Room instance
 __author__ = "Zac Foteff"
 __version__ = "2.0.0."
 
+import sys
+import time
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime
-from pymongo import MongoClient, ReturnDocument
+from pymongo import UpdateOne, ASCENDING, DESCENDING
 from collections import deque
+from itertools import islice
+from typing import Iterator
 from src.chat_user import ChatUser
 from src.user_list import UserList
 from src.message_props import MessageProperties
 from src.chat_message import ChatMessage
+from src.message_store import ColumnarMessageStore
+from src.read_receipts import ReadReceipts
+from src.search_index import SearchIndex
 from bin.constants import *
 from bin.logger import Logger
+from bin.db import MESSAGE_DOCUMENT_FILTER, get_client, get_database
+from bin.write_behind import get_write_behind_buffer
+from bin.sequence import get_sequence_allocator
+from bin.fanout import get_room_fanout
+from bin.notifier import get_room_notifier
+from bin.publisher import get_room_publisher
 
 log = Logger("chatRoom")
 
+
+def sequence_num_of(message: ChatMessage) -> int:
+    """Sort key for ordering messages by sequence number"""
+    return message.mess_props.sequence_num
+
+
 class ChatRoom(deque):
     """ChatRoom class object. Inherits from dequeue to create an internal cache of ChatMessage objects"""
     def __init__(
@@ -25,7 +45,10 @@ class ChatRoom(deque):
             room_type: int = CHAT_ROOM_TYPE_PUBLIC,
             owner_alias: str = "",
             create_time: datetime = datetime.now(),
-            modify_time: datetime = datetime.now()):
+            modify_time: datetime = datetime.now(),
+            write_behind: bool = WRITE_BEHIND_ENABLED,
+            restore_limit: int = CHAT_ROOM_RESTORE_LIMIT,
+            columnar_history: bool = CHAT_ROOM_COLUMNAR_HISTORY):
         """Instantiate a ChatRoom class object. All properties are created in the constructor, or
         restored from an existing entry in storage
 
@@ -35,6 +58,14 @@ class ChatRoom(deque):
             room_type (int, optional): Type of room. Defaults to CHAT_ROOM_TYPE_PUBLIC
             create_time (datetime, optional): Time that the room was created
             modify_time (datetime, optional): Last time that the room was modified
+            write_behind (bool, optional): Hand message writes to the shared write-behind buffer instead
+            of waiting on MongoDB in put. Defaults to WRITE_BEHIND_ENABLED
+            restore_limit (int, optional): Number of newest messages kept in the deque when the room is
+            restored. Older messages are fetched on demand. Use GET_ALL_MESSAGES to restore the whole
+            history. Defaults to CHAT_ROOM_RESTORE_LIMIT
+            columnar_history (bool, optional): On restore, keep the history older than the restored tail
+            resident in a ColumnarMessageStore instead of fetching it from MongoDB on demand. Suited to
+            rooms with very long histories. Defaults to CHAT_ROOM_COLUMNAR_HISTORY
         """
         super(ChatRoom, self).__init__()
         self.__room_name = room_name
@@ -42,16 +73,25 @@ class ChatRoom(deque):
         self.__member_list = UserList(self.__room_name)
         self.__room_type = room_type
         self.__dirty = True
+        self.__dirty_messages = list()
+        self.__messages_by_id = dict()
+        self.__inbox = dict()
+        self.__sequence_index = list()
+        self.__search_index = None
+        self.__restore_limit = restore_limit
+        self.__approx_bytes = CHAT_ROOM_OVERHEAD_BYTES
+        self.__history_complete = True
+        self.__refreshed_through = 0
+        self.__history = ColumnarMessageStore(room_name) if columnar_history else None
         self.__removed = False
         self.__create_time = create_time
         self.__modify_time = modify_time
 
-        #   Initialize MongoDB resources
-        # PROD ONLY: self.__mongo_client = MongoClient(PROD_DB_HOST, PROD_DB_PORT)
-        self.__mongo_client = MongoClient(TEST_DB_HOST)
-        self.__mongo_db = self.__mongo_client.cpsc313
-        self.__mongo_room_collection = self.__mongo_db.get_collection("rooms")
-        self.__mongo_seq_collection = self.__mongo_db.get_collection('sequence')
+        #   Initialize MongoDB resources from the shared connection pool
+        self.__mongo_client = get_client()
+        self.__mongo_db = get_database()
+        self.__mongo_room_collection = self.__mongo_db.get_collection(DB_CHAT_ROOM_COLLECTION)
+        self.__mongo_seq_collection = self.__mongo_db.get_collection(DB_SEQUENCE_COLLECTION)
 
         if self.__mongo_room_collection is None:
             #   Initialize the chat queue collection in the DB if it does not already exist
@@ -61,7 +101,15 @@ class ChatRoom(deque):
         if self.__mongo_seq_collection is None:
             #   Initialize the sequence number collection in the DB if it does not already exist
             log("[-] No sequence collection in the database. Creating . . .")
-            self.__mongo_seq_collection = self.__mongo_db.create_collection('sequence')
+            self.__mongo_seq_collection = self.__mongo_db.create_collection(DB_SEQUENCE_COLLECTION)
+
+        self.__sequence_allocator = get_sequence_allocator(self.__mongo_seq_collection)
+        self.__write_behind = get_write_behind_buffer(self.__mongo_room_collection) if write_behind else None
+        self.__receipts = ReadReceipts(
+            self.__room_name, self.__mongo_db.get_collection(DB_RECEIPT_COLLECTION), write_behind=RECEIPT_WRITE_BEHIND_ENABLED)
+        self.__notifier = get_room_notifier()
+        self.__fanout = get_room_fanout()
+        self.__publisher = get_room_publisher()
 
         if self.restore():
             #   Element is restored from storage, so indicate there are no changes to be saved
@@ -105,43 +153,89 @@ class ChatRoom(deque):
         self.__owner_alias = new_owner_alias
         self.__dirty = True
 
-    @property
-    def member_list(self) -> UserList:
-        return self.__member_list
-
     @property
     def length(self) -> int:
         return len(self)
 
+    @property
+    def restore_limit(self) -> int:
+        return self.__restore_limit
+
+    @property
+    def high_water_mark(self) -> int:
+        """Highest sequence number among the resident messages, or 0 if the room holds none. Clients pass it
+        back as after_seq to receive only newer messages"""
+        return self.__sequence_index[-1].mess_props.sequence_num if len(self.__sequence_index) > 0 else 0
+
+    @property
+    def history(self) -> ColumnarMessageStore | None:
+        """Column store holding the history older than the restored tail, if the room keeps one"""
+        return self.__history
+
+    @property
+    def approx_bytes(self) -> int:
+        """Rough estimate of the memory held by the room, its resident messages and its search index"""
+        if self.__search_index is not None:
+            return self.__approx_bytes + self.__search_index.approx_bytes
+        return self.__approx_bytes
+
+    @property
+    def search_index(self) -> SearchIndex | None:
+        """Inverted index over the room history. Built on the first search and released once idle"""
+        return self.__search_index
+
     def persist(self) -> None:
-        """Persist object data in MongoDB. First, save the user list if it isn't already there
-        or there are changes that need to be persisted. Next, for each message in the list create
-        and save a document for that user
-        """
+        """Persist object data in MongoDB. The room metadata document is only written when the
+        room itself has changes (dirty flag raised). Messages are written incrementally: only
+        messages with their dirty flag raised are saved, using a single unordered bulk write of
+        upserts, and their dirty flags are cleared afterwards. In write-behind mode the upserts are
+        handed to the write-behind buffer, which commits them in the background
 
-        if self.__mongo_room_collection.find_one({'room_name': {'$exists': 'false'}}) is None:
+        Raises:
+            PyMongoError: If the write fails. The messages stay queued for the next persist
+        """
+        if self.__dirty:
             room_update_filter = {'room_name': self.room_name}
             new_values = {"$set": self.to_dict()}
             self.__mongo_room_collection.update_one(room_update_filter, new_values, upsert=True)
+            self.__dirty = False
 
-        for message in list(self):
-            message_update_filter = {'message': message.message}
-            new_values = {"$set": message.to_dict()}
-            self.__mongo_room_collection.update_one(message_update_filter, new_values, upsert=True)
+        #   Messages stay queued until they are written or handed off, so a failed write is retried by the
+        #   next persist instead of being lost
+        dirty_messages = [message for message in self.__dirty_messages if message.dirty]
+        if len(dirty_messages) == 0:
+            self.__dirty_messages = list()
+            return
+
+        if self.__write_behind is not None:
+            for message in dirty_messages:
+                self.__write_behind.submit(
+                    message.message_id,
+                    UpdateOne({'_id': message.message_id}, {"$set": message.to_dict()}, upsert=True))
+                message.dirty = False
+        else:
+            requests = [
+                UpdateOne({'_id': message.message_id}, {"$set": message.to_dict()}, upsert=True)
+                for message in dirty_messages]
+            self.__mongo_room_collection.bulk_write(requests, ordered=False)
+            for message in dirty_messages:
+                message.dirty = False
+        self.__dirty_messages = list()
 
     def restore(self) -> bool:
         """Restore object data from MongoDB. Find record using the room name as a key and
         populate name, create, and modify time.
-        Next, retrieve that messages associated with the chat room (every document with 
-        a key called 'message'). For each dictionary we get back (the documents), create 
-        a message properties instance and a message instance and put them in the deque by 
-        calling the put method
+        Next, retrieve the newest restore_limit messages associated with the chat room (message
+        documents with this room's name, newest first). For each dictionary we get back (the documents),
+        create a message properties instance and a message instance and place them in the deque.
+        Older messages stay in storage and are fetched on demand with load_before, unless the room keeps
+        a columnar history, in which case they are loaded into the ColumnarMessageStore
 
         Returns:
             bool: Returns True if the object and its messages were restored successfully. 
             False otherwise
         """
-        metadata = self.__mongo_room_collection.find_one({'room_name': {'$exists': 'true'}})
+        metadata = self.__mongo_room_collection.find_one({'room_name': self.__room_name})
         if metadata is None:
             log("[*] No metadata found for ChatRoom object. Creating new collection . . .", 'w')
             self.persist()
@@ -151,38 +245,195 @@ class ChatRoom(deque):
         self.__room_type = metadata['room_type']
         self.__create_time = metadata['create_time']
         self.__modify_time = metadata['modify_time']
-        for mess_data in self.__mongo_room_collection.find({'message': {'$exists': 'true'}}):
-            new_mess_props = MessageProperties(
-                mess_data['mess_props']['mess_type'],
-                mess_data['mess_props']['room_name'],
-                mess_data['mess_props']['to_user'],
-                mess_data['mess_props']['from_user'],
-                mess_data['mess_props']['sequence_num'],
-                mess_data['mess_props']['sent_time'],
-                mess_data['mess_props']['rec_time'])
-            new_message = ChatMessage(mess_data['message'], new_mess_props)
-            self.put(new_message)
-        log(f"[+] Restored ChatRoom object {self.to_dict()}")
+        restored_messages = self.__find_messages(limit=self.__restore_limit)
+        for new_message in restored_messages:
+            #   Restored messages are already in storage, so place them without persisting. Documents
+            #   arrive newest first, and the newest message belongs at the left end of the deque
+            super().append(new_message)
+            self.__index_message(new_message)
+        self.__rebuild_indexes()
+        self.__history_complete = self.__restore_limit == GET_ALL_MESSAGES or len(restored_messages) < self.__restore_limit
+        if self.__history is not None and not self.__history_complete:
+            #   Older history is read once, oldest first, into the column store
+            self.__history.extend(reversed(self.__find_messages(before_seq=self[-1].mess_props.sequence_num)))
+            self.__approx_bytes += self.__history.nbytes
+            self.__history_complete = True
+        self.__refreshed_through = self.high_water_mark
+        log(f"[+] Restored ChatRoom {self.__room_name}")
+        if log.enabled('d'):
+            log(f"[*] Restored ChatRoom object {self.to_dict()}", 'd')
         return True
 
-    def __get_next_sequence_num(self) -> int:
-        """Queries the sequence number collection from MongoDB and selects the next 
-        sequence number to assign to the message. Returns a sequence number of -1 if there is an err
+    def refresh(self) -> list:
+        """Place the messages other processes (another API worker, the RabbitMQ consumer) saved to the room
+        since the last refresh, without persisting them, and wake the room's waiters and subscribers. The
+        query starts at the high water mark of the previous refresh, so messages saved late with a lower
+        sequence number than a resident one are still found; messages already resident are skipped
 
         Returns:
-            int: Next sequence number to assign to new messages. Returns -1 on 
+            list: Messages placed, oldest first
         """
-        try:
-            sequence_num = self.__mongo_seq_collection.find_one_and_update(
-                {'_id': 'userid'},
-                {'$inc': {self.room_name: 1}},
-                projection={self.room_name: True, '_id': False},
-                upsert=True,
-                return_document=ReturnDocument.AFTER)
-        except: 
-            sequence_num = -1
+        stored = self.__find_messages(after_seq=self.__refreshed_through, oldest_first=True)
+        placed = list()
+        for message in stored:
+            if message.message_id in self.__messages_by_id:
+                continue
+            self.__place_stored(message)
+            placed.append(message)
+        self.__refreshed_through = self.high_water_mark
+        if len(placed) > 0:
+            log("[*] Refreshed ChatRoom %s with %s stored messages", 'd', self.__room_name, len(placed))
+            self.__notifier.notify(self.__room_name, self.high_water_mark)
+            self.__fanout.publish(self.__room_name, placed)
+        return placed
+
+    def __find_messages(
+            self,
+            before_seq: int = None,
+            limit: int = GET_ALL_MESSAGES,
+            exclude_senders: frozenset = frozenset(),
+            to_user: str = None,
+            after_seq: int = None,
+            oldest_first: bool = False) -> list:
+        """Query this room's messages from MongoDB, newest first, or oldest first with oldest_first
+
+        Args:
+            before_seq (int, optional): Only return messages with a lower sequence number. Defaults to None
+            limit (int, optional): Maximum number of messages to return. Defaults to GET_ALL_MESSAGES
+            exclude_senders (frozenset, optional): Aliases whose messages are filtered out by the query.
+            Defaults to an empty set
+            to_user (str, optional): Only return messages sent to this alias. Defaults to None
+            after_seq (int, optional): Only return messages with a higher sequence number. Defaults to None
+            oldest_first (bool, optional): Select and order from the oldest message. Defaults to False
+        Returns:
+            list: ChatMessage objects ordered from newest to oldest, or oldest to newest with oldest_first
+        """
+        message_filter = {'mess_props.room_name': self.__room_name, **MESSAGE_DOCUMENT_FILTER}
+        sequence_filter = dict()
+        if before_seq is not None:
+            sequence_filter['$lt'] = before_seq
+        if after_seq is not None:
+            sequence_filter['$gt'] = after_seq
+        if len(sequence_filter) > 0:
+            message_filter['mess_props.sequence_num'] = sequence_filter
+        if to_user is not None:
+            message_filter['mess_props.to_user'] = to_user
+        if len(exclude_senders) > 0:
+            message_filter['mess_props.from_user'] = {'$nin': list(exclude_senders)}
+        cursor = self.__mongo_room_collection.find(message_filter).sort(
+            'mess_props.sequence_num', ASCENDING if oldest_first else DESCENDING)
+        if limit != GET_ALL_MESSAGES:
+            cursor = cursor.limit(limit)
+        return [self.__message_from_document(mess_data) for mess_data in cursor]
+
+    def load_before(
+            self,
+            before_seq: int,
+            limit: int = GET_ALL_MESSAGES,
+            exclude_senders: frozenset = frozenset()) -> list:
+        """Page backwards through the room history. Messages that are resident in the deque are served
+        from memory, and anything older than the restored tail is read from the columnar history, or
+        fetched from MongoDB, without being added to the deque. Messages from excluded senders are skipped in memory and filtered out by
+        the MongoDB query, so they do not count towards the limit
+
+        Args:
+            before_seq (int): Cursor. Only messages with a lower sequence number are returned
+            limit (int, optional): Maximum number of messages to return. Defaults to GET_ALL_MESSAGES
+            exclude_senders (frozenset, optional): Aliases whose messages are skipped. Defaults to an
+            empty set
+        Returns:
+            list: ChatMessage objects ordered from newest to oldest
+        """
+        messages = list()
+        for message in self:
+            if limit != GET_ALL_MESSAGES and len(messages) >= limit:
+                return messages
+            if message.mess_props.sequence_num < before_seq and message.mess_props.from_user not in exclude_senders:
+                messages.append(message)
+
+        if limit != GET_ALL_MESSAGES and len(messages) >= limit:
+            return messages
+
+        oldest_resident = self[-1].mess_props.sequence_num if self.length > 0 else before_seq
+        remaining = limit - len(messages) if limit != GET_ALL_MESSAGES else GET_ALL_MESSAGES
+        if self.__history is not None:
+            messages.extend(self.__history.select(
+                before_seq=min(before_seq, oldest_resident), limit=remaining, exclude_senders=exclude_senders))
+            return messages
+
+        if self.__history_complete:
+            return messages
+        messages.extend(self.__find_messages(
+            before_seq=min(before_seq, oldest_resident), limit=remaining, exclude_senders=exclude_senders))
+        return messages
+
+    def load_after(
+            self,
+            after_seq: int,
+            limit: int = GET_ALL_MESSAGES,
+            exclude_senders: frozenset = frozenset(),
+            to_user: str = None) -> list:
+        """Sync forwards from a cursor: the oldest limit messages with a higher sequence number than after_seq.
+        Resident messages are found with a binary search of the sequence index (or of to_user's inbox), so
+        the cost grows with the number of new messages rather than the size of the room. If the cursor is
+        older than the resident tail, the gap is read from the columnar history or MongoDB first
 
-        return sequence_num
+        Args:
+            after_seq (int): Cursor. Only messages with a higher sequence number are returned
+            limit (int, optional): Maximum number of messages to return. Defaults to GET_ALL_MESSAGES
+            exclude_senders (frozenset, optional): Aliases whose messages are skipped. Defaults to an empty set
+            to_user (str, optional): Only return messages sent to this alias. Defaults to None
+        Returns:
+            list: ChatMessage objects ordered from oldest to newest
+        """
+        messages = list()
+        oldest_resident = self.__sequence_index[0].mess_props.sequence_num if len(self.__sequence_index) > 0 else None
+        if oldest_resident is None or after_seq < oldest_resident:
+            gap_args = dict(before_seq=oldest_resident, limit=limit, exclude_senders=exclude_senders,
+                            to_user=to_user, after_seq=after_seq, oldest_first=True)
+            if self.__history is not None:
+                messages.extend(self.__history.select(**gap_args))
+            elif not self.__history_complete:
+                messages.extend(self.__find_messages(**gap_args))
+
+        index = self.__inbox.get(to_user, []) if to_user is not None else self.__sequence_index
+        for position in range(bisect_right(index, after_seq, key=sequence_num_of), len(index)):
+            if limit != GET_ALL_MESSAGES and len(messages) >= limit:
+                break
+            if index[position].mess_props.from_user not in exclude_senders:
+                messages.append(index[position])
+        return messages
+
+    def __message_from_document(self, mess_data: dict) -> ChatMessage:
+        """Build a clean ChatMessage from a message document stored in MongoDB
+
+        Args:
+            mess_data (dict): Message document
+        Returns:
+            ChatMessage: Message with its dirty flag lowered
+        """
+        new_mess_props = MessageProperties(
+            mess_data['mess_props']['mess_type'],
+            mess_data['mess_props']['room_name'],
+            mess_data['mess_props']['to_user'],
+            mess_data['mess_props']['from_user'],
+            mess_data['mess_props']['sequence_num'],
+            mess_data['mess_props']['sent_time'],
+            mess_data['mess_props']['rec_time'])
+        new_message = ChatMessage(mess_data['message'], new_mess_props)
+        new_message.dirty = False
+        return new_message
+
+    def __get_next_sequence_num(self) -> int:
+        """Select the next sequence number to assign to a message in this room. Numbers are served
+        from a block reserved by the shared SequenceAllocator, so most calls make no round trip
+
+        Returns:
+            int: Next sequence number to assign to new messages
+        Raises:
+            PyMongoError: If a new block of sequence numbers can not be reserved
+        """
+        return self.__sequence_allocator.allocate(self.room_name)
 
     def register_group_member(self, alias: str) -> bool:
         """Register new user to the room's list of Users. Takes an alias and returns True if
@@ -196,6 +447,7 @@ class ChatRoom(deque):
         """
         if self.member_list.register(alias):
             self.__modify_time = datetime.now()
+            self.__dirty = True
             self.persist()
             return True
         return False
@@ -211,6 +463,7 @@ class ChatRoom(deque):
         """
         if self.member_list.deregister(alias):
             self.__modify_time = datetime.now()
+            self.__dirty = True
             self.persist()
             return True
         return False
@@ -225,11 +478,18 @@ class ChatRoom(deque):
         """
         return self.member_list.get(alias)
 
-    def get_messages(self, alias: str, num_messages: int=GET_ALL_MESSAGES, return_objects: bool=False) -> list:
+    def get_messages(
+            self,
+            alias: str,
+            num_messages: int=GET_ALL_MESSAGES,
+            return_objects: bool=False,
+            before_seq: int=None,
+            direct_only: bool=False,
+            after_seq: int=None) -> list:
         """Retrieve the ChatRoom's messages from storage. Also retrieves new messages from Mongo. 
         Users have the option of returning the objects as ChatMessage objects, or just the message 
         content. The method will also filter the messages to ensure that no blocked users' messages
-        are included in the list of returned messages
+        are included in the list of returned messages. Collects the output of iter_messages
 
         Args:
             alias (str): Alias of the user requesting the messages
@@ -237,40 +497,215 @@ class ChatRoom(deque):
             Defaults to GET_ALL_MESSAGES
             return_objects (bool, optional): Flag indicating if the method should return ChatMessage 
             objects if True, or strings if False. Defaults to False.
+            before_seq (int, optional): Cursor for paging through older history. When set, only messages
+            with a lower sequence number are returned (see load_before). Defaults to None
+            direct_only (bool, optional): Only return messages sent to alias. Defaults to False
+            after_seq (int, optional): Cursor for syncing newer messages (see load_after). Defaults to None
+        Returns:
+            list: List of messages associated with the ChatRoom object, oldest first
+        """
+        messages = list(self.iter_messages(
+            alias, num_messages=num_messages, before_seq=before_seq, direct_only=direct_only, after_seq=after_seq))
+        if len(messages) > 0:
+            #   One receipt per read, however many messages it returned
+            self.mark_read(alias, max(message.mess_props.sequence_num for message in messages))
+        if return_objects:
+            return messages
+        return [message.message for message in messages]
+
+    def iter_messages(
+            self,
+            alias: str,
+            num_messages: int=GET_ALL_MESSAGES,
+            before_seq: int=None,
+            direct_only: bool=False,
+            after_seq: int=None) -> Iterator[ChatMessage]:
+        """Generate the messages a user may see, reading from the right of the deque so messages come
+        out oldest first. When num_messages is set, the newest num_messages visible messages are
+        selected by walking the left (newest) end of the deque once with islice; otherwise the deque
+        is streamed from the right without being copied. In direct_only mode the messages are read from
+        the alias' inbox index, so the cost grows with the number of messages sent to the alias rather
+        than with the size of the room. The alias' read cursor is not advanced here: the generator may be
+        closed from any thread, so callers record a completed read with mark_read (get_messages does)
+
+        Args:
+            alias (str): Alias of the user requesting the messages
+            num_messages (int, optional): Number of (newest) messages to generate. Defaults to GET_ALL_MESSAGES
+            before_seq (int, optional): Cursor for paging through older history (see load_before).
+            Defaults to None
+            direct_only (bool, optional): Only generate messages sent to alias. Defaults to False
+            after_seq (int, optional): Cursor for syncing newer messages. When set, the oldest num_messages
+            messages with a higher sequence number are generated (see load_after). Can not be combined with
+            before_seq. Defaults to None
         Returns:
-            list: List of messages associated with the ChatRoom object and the amount of strings 
-            retrieved
+            Iterator[ChatMessage]: Visible messages, oldest first
+        Raises:
+            ValueError: If both before_seq and after_seq are set
         """
+        if before_seq is not None and after_seq is not None:
+            raise ValueError("before_seq and after_seq can not be combined")
+
         requesting_user = self.get_group_member(alias)
-        message_container = list()
-        log(f"[*] Requested {GET_ALL_MESSAGES} messages. Requesting user: {requesting_user}. Number of messages in internal queue: {self.length}")
-        
-        if num_messages == GET_ALL_MESSAGES or num_messages > self.length:
-            for message in list(self):
-                if message.mess_props.from_user not in requesting_user.blocked_users:
-                    #   Message should only continue to be checked if the sender is not in the recievers blocker user list
-                    if message.mess_props.rec_time == None:
-                        #   If the message has not been recieved yet, acknowledge the message in the mess_type, rec_time, and the dirty flag
-                        message.mess_props.rec_time = datetime.now()
-                        message.mess_props.mess_type = MESSAGE_RECEIVED
-                        message.dirty = True
-
-                    message_container.append(message) if return_objects else message_container.append(message.message)
+        blocked_users = frozenset(requesting_user.blocked_users) if requesting_user is not None else frozenset()
+        is_visible = self.__message_filter(blocked_users)
+        log("[*] Requested %s messages. Requesting user: %s. Number of messages in internal queue: %s", 'd', num_messages, requesting_user, self.length)
 
+        if after_seq is not None:
+            messages = self.load_after(
+                after_seq, num_messages, exclude_senders=blocked_users, to_user=alias if direct_only else None)
+        elif direct_only:
+            messages = reversed(self.__find_direct_messages(alias, before_seq, num_messages, blocked_users))
+        elif before_seq is not None:
+            #   The blocked user filter is pushed down into the MongoDB query for history that is not resident
+            messages = reversed(self.load_before(before_seq, num_messages, exclude_senders=blocked_users))
+        elif num_messages == GET_ALL_MESSAGES:
+            messages = self.__iter_from_right(self.length)
+            messages = filter(is_visible, messages) if is_visible is not None else messages
         else:
-            for message_iterator in range(0, num_messages):
-                message = list(self)[message_iterator]
-                if message.mess_props.from_user not in requesting_user.blocked_users:
-                    #   Message should only continue to be checked if the sender is not in the recievers blocker user list
-                    if message.mess_props.rec_time == None:
-                        #   If the message has not been recieved yet, acknowledge the message in the mess_type, rec_time, and the dirty flag
-                        message.mess_props.rec_time = datetime.now()
-                        message.mess_props.mess_type = MESSAGE_RECEIVED
-                        message.dirty = True
+            messages = filter(is_visible, iter(self)) if is_visible is not None else iter(self)
+            messages = reversed(list(islice(messages, num_messages)))
 
-                    message_container.append(message) if return_objects else message_container.append(message.message)
+        yield from messages
+
+    def __find_direct_messages(
+            self,
+            alias: str,
+            before_seq: int = None,
+            limit: int = GET_ALL_MESSAGES,
+            exclude_senders: frozenset = frozenset()) -> list:
+        """Select messages sent to alias, newest first, from the inbox index. When the resident messages run
+        out before the limit is reached, older history is read from the columnar history or from MongoDB
+
+        Args:
+            alias (str): Alias the messages were sent to
+            before_seq (int, optional): Only return messages with a lower sequence number. Defaults to None
+            limit (int, optional): Maximum number of messages to return. Defaults to GET_ALL_MESSAGES
+            exclude_senders (frozenset, optional): Aliases whose messages are skipped. Defaults to an empty set
+        Returns:
+            list: ChatMessage objects ordered from newest to oldest
+        """
+        inbox = self.__inbox.get(alias, [])
+        end = len(inbox) if before_seq is None else bisect_left(inbox, before_seq, key=sequence_num_of)
+        messages = list()
+        for position in range(end - 1, -1, -1):
+            if limit != GET_ALL_MESSAGES and len(messages) >= limit:
+                return messages
+            if inbox[position].mess_props.from_user not in exclude_senders:
+                messages.append(inbox[position])
+
+        if (limit != GET_ALL_MESSAGES and len(messages) >= limit) or (self.__history is None and self.__history_complete):
+            return messages
+
+        oldest_resident = self[-1].mess_props.sequence_num if self.length > 0 else before_seq
+        if before_seq is not None and oldest_resident is not None:
+            oldest_resident = min(before_seq, oldest_resident)
+        remaining = limit - len(messages) if limit != GET_ALL_MESSAGES else GET_ALL_MESSAGES
+        if self.__history is not None:
+            messages.extend(self.__history.select(
+                before_seq=oldest_resident, limit=remaining, exclude_senders=exclude_senders, to_user=alias))
+        else:
+            messages.extend(self.__find_messages(
+                before_seq=oldest_resident, limit=remaining, exclude_senders=exclude_senders, to_user=alias))
+        return messages
+
+    def __iter_from_right(self, count: int) -> Iterator[ChatMessage]:
+        """Iterate over the count oldest messages, starting at the right end of the deque. Puts only add
+        messages at the left end, so if one happens while a caller is still consuming this iterator the
+        walk resumes at the same position instead of failing
+
+        Args:
+            count (int): Number of messages to iterate over
+        Returns:
+            Iterator[ChatMessage]: Messages, oldest first
+        """
+        position = 0
+        while position < count:
+            try:
+                for message in islice(reversed(self), position, count):
+                    position += 1
+                    yield message
+                return
+            except RuntimeError:
+                log("[*] ChatRoom %s changed while being read. Resuming at message %s", 'd', self.room_name, position)
+
+    def __message_filter(self, blocked_users: frozenset):
+        """Build the visibility predicate for one get_messages call. The requesting user's blocked aliases
+        are captured once as a set, so each message is checked with a single hash lookup
+
+        Args:
+            blocked_users (frozenset): Aliases blocked by the requesting user
+        Returns:
+            callable: Predicate that returns True for messages the requesting user may see, or None when
+            every message is visible
+        """
+        if len(blocked_users) == 0:
+            return None
+        return lambda message: message.mess_props.from_user not in blocked_users
+
+    def mark_read(self, alias: str, sequence_num: int) -> bool:
+        """Record a completed read: advance alias' read cursor to the newest message it returned
+
+        Args:
+            alias (str): Alias of the reader
+            sequence_num (int): Highest sequence number read
+        Returns:
+            bool: True if the cursor moved forward
+        """
+        return self.__receipts.advance(alias, sequence_num)
+
+    def read_cursor(self, alias: str) -> int:
+        """Return the highest sequence number alias has read in the room
+
+        Args:
+            alias (str): Alias of the reader
+        Returns:
+            int: Highest sequence number read, 0 if alias has not read the room
+        """
+        return self.__receipts.cursor(alias)
 
-        return message_container
+    def delivery_status(self, message: ChatMessage) -> int:
+        """Return the delivery status of a message, worked out from its recipient's read cursor
+
+        Args:
+            message (ChatMessage): Message of this room
+        Returns:
+            int: MESSAGE_RECEIVED if the recipient has read the room past the message, MESSAGE_SENT otherwise
+        """
+        if self.__receipts.is_read(message.mess_props.to_user, message.mess_props.sequence_num):
+            return MESSAGE_RECEIVED
+        return MESSAGE_SENT
+
+    def unread_count(self, alias: str) -> int:
+        """Count the messages sent to alias beyond their read cursor. Messages from users alias has blocked
+        are not counted. Resident messages are counted from the inbox index, and older history from the
+        columnar history or with a MongoDB count
+
+        Args:
+            alias (str): Alias of the reader
+        Returns:
+            int: Number of unread messages
+        """
+        cursor = self.__receipts.cursor(alias)
+        requesting_user = self.get_group_member(alias)
+        blocked_users = frozenset(requesting_user.blocked_users) if requesting_user is not None else frozenset()
+        inbox = self.__inbox.get(alias, [])
+        unread = inbox[bisect_right(inbox, cursor, key=sequence_num_of):]
+        count = len(unread) if len(blocked_users) == 0 else sum(
+            1 for message in unread if message.mess_props.from_user not in blocked_users)
+
+        oldest_resident = self[-1].mess_props.sequence_num if self.length > 0 else None
+        if oldest_resident is None or oldest_resident <= cursor + 1:
+            return count
+        if self.__history is not None:
+            return count + self.__history.count_to_user(alias, cursor, oldest_resident, blocked_users)
+        if self.__history_complete:
+            return count
+        sequence_range = {'$gt': cursor, '$lt': oldest_resident}
+        message_filter = {'mess_props.room_name': self.__room_name, 'mess_props.to_user': alias,
+                          **MESSAGE_DOCUMENT_FILTER, 'mess_props.sequence_num': sequence_range}
+        if len(blocked_users) > 0:
+            message_filter['mess_props.from_user'] = {'$nin': list(blocked_users)}
+        return count + self.__mongo_room_collection.count_documents(message_filter)
 
     def send_message(self, message: str, from_alias: str, to_alias: str) -> bool:
         """Insert message into the message list for the room, and create a mongodb document 
@@ -286,49 +721,198 @@ class ChatRoom(deque):
         Returns:
             bool: Return true if the message is successfully sent, false otherwise
         """
-        if self.room_type == CHAT_ROOM_TYPE_PRIVATE and from_alias in self.member_list.get_all_users() and to_alias in self.member_list.get_all_users():
-            mess_props = MessageProperties(
-                mess_type=MESSAGE_SENT,
-                room_name=self.__room_name,
-                from_user=from_alias,
-                to_user=to_alias,
-                sequence_num=self.__get_next_sequence_num())
-            new_message = ChatMessage(message=message, mess_props=mess_props)
-            self.put(new_message)
-            return True
+        if not self.__admit(from_alias, to_alias):
+            log(f"[-] Cannot send message. One of the alias's is not registered for this ChatRoom", 'e')
+            return False
+
+        mess_props = MessageProperties(
+            mess_type=MESSAGE_SENT,
+            room_name=self.__room_name,
+            from_user=from_alias,
+            to_user=to_alias,
+            sequence_num=self.__get_next_sequence_num())
+        self.put(ChatMessage(message=message, mess_props=mess_props))
+        return True
 
-        elif self.room_type == CHAT_ROOM_TYPE_PUBLIC:
+    def send_messages(self, messages: list) -> list:
+        """Send a batch of messages. Every message is checked the same way as in send_message, sequence
+        numbers for the accepted messages are allocated in one operation, and the batch is saved with a
+        single persist (one bulk write)
+
+        Args:
+            messages (list): (message, from_alias, to_alias) tuples, in the order they should be sequenced
+        Returns:
+            list: The sequence number assigned to each message, or None where the message was rejected
+        """
+        admitted = [self.__admit(from_alias, to_alias) for _, from_alias, to_alias in messages]
+        sequence_nums = iter(self.__sequence_allocator.allocate_many(self.room_name, sum(admitted)) if any(admitted) else [])
+        results = list()
+        placed = list()
+        for (message, from_alias, to_alias), is_admitted in zip(messages, admitted):
+            if not is_admitted:
+                log(f"[-] Cannot send message from {from_alias} to {to_alias}. One of the alias's is not registered for this ChatRoom", 'e')
+                results.append(None)
+                continue
             mess_props = MessageProperties(
                 mess_type=MESSAGE_SENT,
                 room_name=self.__room_name,
                 from_user=from_alias,
                 to_user=to_alias,
-                sequence_num=self.__get_next_sequence_num())
-            new_message = ChatMessage(message=message, mess_props=mess_props)
-            if self.get_group_member(alias=from_alias) == None: self.register_group_member(from_alias)
-            if self.get_group_member(alias=to_alias) == None: self.register_group_member(to_alias)
-            self.put(new_message)
-            return True
-            
-        else:
-            log(f"[-] Cannot send message. One of the alias's is not registered for this ChatRoom", 'e')
+                sequence_num=next(sequence_nums))
+            chat_message = ChatMessage(message=message, mess_props=mess_props)
+            self.__place(chat_message)
+            placed.append(chat_message)
+            results.append(mess_props.sequence_num)
+
+        if len(placed) > 0:
+            self.__modify_time = datetime.now()
+            self.__dirty = True
+            self.persist()
+            self.__announce(placed)
+        return results
+
+    def __admit(self, from_alias: str, to_alias: str) -> bool:
+        """Check that a message may be sent between two aliases. Private rooms require both aliases to be
+        registered. Public rooms register them on their first message, and the room change is saved with
+        the next persist
+
+        Args:
+            from_alias (str): Alias of the sender
+            to_alias (str): Alias of the recipient
+        Returns:
+            bool: True if the message may be sent
+        """
+        if self.room_type == CHAT_ROOM_TYPE_PRIVATE:
+            return self.member_list.is_registered(from_alias) and self.member_list.is_registered(to_alias)
+        if self.room_type != CHAT_ROOM_TYPE_PUBLIC:
             return False
 
+        for alias in (from_alias, to_alias):
+            if not self.member_list.is_registered(alias) and self.member_list.register(alias):
+                self.__modify_time = datetime.now()
+                self.__dirty = True
+        return True
+
     def find_message(self, message_text: str) -> ChatMessage | None:
-        """Find message object in the deque using the text of the message as a key
-        
-        TODO: Transition to using unique oids
+        """Find message object in the deque using the text of the message as a key. Prefer
+        find_message_by_id when the room and sequence number are known, and search for full text queries
 
         Args:
-            message_text (str): _description_
+            message_text (str): Text of the message to search for
         Returns:
-            ChatMessage: _description_
+            ChatMessage: First message with matching text, or None if no message matches
         """
-        for chat_message in list(self):
+        for chat_message in self:
             if chat_message.message == message_text:
                 return chat_message
         return None
 
+    def build_search_index(self) -> SearchIndex:
+        """Build the room's search index in bulk from every message document stored for the room, then add
+        resident messages that may not have reached storage yet
+
+        Returns:
+            SearchIndex: The new search index
+        """
+        search_index = SearchIndex(self.__room_name)
+        search_index.rebuild(self.__mongo_room_collection.find(
+            {'mess_props.room_name': self.__room_name, **MESSAGE_DOCUMENT_FILTER},
+            {'message': 1, 'mess_props.sequence_num': 1}))
+        for message in reversed(self):
+            search_index.add(message.mess_props.sequence_num, message.message)
+        self.__search_index = search_index
+        return search_index
+
+    def release_search_index(self, idle_seconds: float = SEARCH_INDEX_IDLE_SECONDS) -> bool:
+        """Drop the search index if it has not been used for idle_seconds. It is rebuilt on the next search
+
+        Args:
+            idle_seconds (float, optional): Idle time after which the index is dropped. Defaults to
+            SEARCH_INDEX_IDLE_SECONDS
+        Returns:
+            bool: True if an index was dropped
+        """
+        if self.__search_index is None or time.monotonic() - self.__search_index.last_used < idle_seconds:
+            return False
+        log(f"[*] Released idle search index of ChatRoom {self.__room_name}", 'd')
+        self.__search_index = None
+        return True
+
+    def search(self, query: str, limit: int = SEARCH_RESULT_LIMIT, alias: str = None) -> list:
+        """Full text search over the room history. Every term of the query must appear in a message, and a
+        term ending in '*' matches as a prefix. Messages from users blocked by alias are left out. Searching
+        does not acknowledge the messages
+
+        Args:
+            query (str): Search terms
+            limit (int, optional): Most results to return, capped at SEARCH_MAX_LIMIT. Defaults to
+            SEARCH_RESULT_LIMIT
+            alias (str, optional): Alias of the user searching. Defaults to None
+        Returns:
+            list: Matching ChatMessage objects, newest first
+        """
+        limit = min(limit, SEARCH_MAX_LIMIT)
+        if limit <= 0:
+            return []
+        search_index = self.__search_index if self.__search_index is not None else self.build_search_index()
+        requesting_user = self.get_group_member(alias) if alias is not None else None
+        blocked_users = frozenset(requesting_user.blocked_users) if requesting_user is not None else frozenset()
+        sequence_nums = search_index.search(query, limit=limit if len(blocked_users) == 0 else GET_ALL_MESSAGES)
+
+        messages = list()
+        for position in range(0, len(sequence_nums), limit):
+            for message in self.__messages_by_sequence(sequence_nums[position:position + limit]):
+                if message.mess_props.from_user not in blocked_users:
+                    messages.append(message)
+            if len(messages) >= limit:
+                return messages[:limit]
+        return messages
+
+    def __messages_by_sequence(self, sequence_nums: list) -> list:
+        """Resolve sequence numbers to messages. Resident messages are read from memory, the rest from the
+        columnar history or with a single MongoDB query
+
+        Args:
+            sequence_nums (list): Sequence numbers to resolve
+        Returns:
+            list: ChatMessage objects in the order of sequence_nums. Numbers that can not be found are skipped
+        """
+        found = dict()
+        missing = list()
+        for sequence_num in sequence_nums:
+            message = self.__messages_by_id.get(f"{self.__room_name}:{sequence_num}")
+            if message is None and self.__history is not None:
+                position = self.__history.position_of(sequence_num)
+                message = self.__history.message_at(position) if position is not None else None
+            if message is None:
+                missing.append(f"{self.__room_name}:{sequence_num}")
+            else:
+                found[sequence_num] = message
+
+        if len(missing) > 0:
+            for mess_data in self.__mongo_room_collection.find({'_id': {'$in': missing}}):
+                message = self.__message_from_document(mess_data)
+                found[message.mess_props.sequence_num] = message
+        return [found[sequence_num] for sequence_num in sequence_nums if sequence_num in found]
+
+    def find_message_by_id(self, message_id: str) -> ChatMessage | None:
+        """Find a message by its id (see ChatMessage.message_id). Resident messages are found with a
+        dictionary lookup; otherwise the message document is fetched from MongoDB by its _id
+
+        Args:
+            message_id (str): Id of the message, built from the room name and sequence number
+        Returns:
+            ChatMessage | None: Message with a matching id, or None if it does not exist
+        """
+        message = self.__messages_by_id.get(message_id)
+        if message is not None:
+            return message
+
+        mess_data = self.__mongo_room_collection.find_one({'_id': message_id})
+        if mess_data is None:
+            return None
+        return self.__message_from_document(mess_data)
+
     def get(self) -> ChatMessage:
         """Return the last message in the deque
 
@@ -343,16 +927,96 @@ class ChatRoom(deque):
     def put(self, message: ChatMessage) -> None:
         """Puts message into the dequeue. Overrides default put method to place ChatMessages
         into the left end of the deque. We choose to read from the right. Method also saves the 
-        new messages into the db
+        new messages into the db, then announces it to anything waiting on or subscribed to the room
 
         Args:
             message (ChatMessage): ChatMessage to send to place in the deque and to persist in 
             the db
         """
-        log(f"[*] Put message: {message}", 'd')
-        super().appendleft(message)
+        log("[*] Put message: %s", 'd', message)
+        self.__place(message)
         self.__modify_time = datetime.now()
+        self.__dirty = True
         self.persist()
+        self.__announce([message])
+
+    def __announce(self, messages: list) -> None:
+        """Wake long polls and streams waiting on the room, fan the new messages out to subscribers and, when
+        publishing is enabled, queue them for the room's RabbitMQ exchange
+
+        Args:
+            messages (list): Messages that were just saved, oldest first
+        """
+        self.__notifier.notify(self.__room_name, self.high_water_mark)
+        self.__fanout.publish(self.__room_name, messages)
+        if self.__publisher is not None:
+            self.__publisher.publish_messages(self.__room_name, messages)
+
+    def __place(self, message: ChatMessage) -> None:
+        """Place a new message at the left end of the deque, add it to the room's indexes and queue it for
+        the next persist
+
+        Args:
+            message (ChatMessage): New message
+        """
+        super().appendleft(message)
+        self.__index_message(message)
+        self.__insert_in_order(self.__sequence_index, message)
+        self.__insert_in_order(self.__inbox.setdefault(message.mess_props.to_user, []), message)
+        if self.__search_index is not None:
+            self.__search_index.add(message.mess_props.sequence_num, message.message)
+        self.__mark_dirty(message)
+
+    def __place_stored(self, message: ChatMessage) -> None:
+        """Place a message read from storage at its sequence position in the deque and add it to the room's
+        indexes. It is already saved, so it is not queued for persist
+
+        Args:
+            message (ChatMessage): Stored message that is not resident
+        """
+        newer = len(self.__sequence_index) - bisect_right(
+            self.__sequence_index, message.mess_props.sequence_num, key=sequence_num_of)
+        super().insert(newer, message)
+        self.__index_message(message)
+        self.__insert_in_order(self.__sequence_index, message)
+        self.__insert_in_order(self.__inbox.setdefault(message.mess_props.to_user, []), message)
+        if self.__search_index is not None:
+            self.__search_index.add(message.mess_props.sequence_num, message.message)
+
+    def __index_message(self, message: ChatMessage) -> None:
+        """Add a message that was just placed in the deque to the room's lookup structures and memory estimate
+
+        Args:
+            message (ChatMessage): Message placed in the deque
+        """
+        self.__messages_by_id[message.message_id] = message
+        self.__approx_bytes += CHAT_MESSAGE_OVERHEAD_BYTES + sys.getsizeof(message.message)
+
+    def __rebuild_indexes(self) -> None:
+        """Rebuild the sequence index and the per-recipient inbox index from the deque. Both list resident
+        messages in ascending sequence number order; each inbox holds the messages sent to one alias"""
+        self.__sequence_index = sorted(self, key=sequence_num_of)
+        self.__inbox = dict()
+        for message in self.__sequence_index:
+            self.__inbox.setdefault(message.mess_props.to_user, []).append(message)
+
+    @staticmethod
+    def __insert_in_order(index: list, message: ChatMessage) -> None:
+        """Add a message to a list kept in ascending sequence number order. New messages almost always have
+        the highest sequence number, so this is usually an append"""
+        if len(index) == 0 or index[-1].mess_props.sequence_num < message.mess_props.sequence_num:
+            index.append(message)
+        else:
+            insort(index, message, key=sequence_num_of)
+
+    def __mark_dirty(self, message: ChatMessage) -> None:
+        """Raise the dirty flag of a message and queue it for the next persist
+
+        Args:
+            message (ChatMessage): Message with changes that need to be saved
+        """
+        message.dirty = True
+        self.__dirty_messages.append(message)
 
     def metadata(self) -> dict:
         """Custom method to return metadata. This method is used by ther room_list to store 
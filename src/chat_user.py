@@ -1,6 +1,7 @@
 __version__ = "1.0.0."
 __author__ = "Zac Foteff"
 
+import sys
 from bin.logger import Logger
 from datetime import datetime
 
@@ -9,13 +10,15 @@ log = Logger("users")
 
 class ChatUser:
     """Chat room user class object. Users must register using the application to send and receive messages. Also
-    maintains a blocked user list of users whose messages this user does not wish to see
+    maintains a set of blocked users whose messages this user does not wish to see
     """
 
+    __slots__ = ('__alias', '__user_id', '__blocked_users', '__removed', '__create_time', '__modify_time', '__dirty')
+
     def __init__(self,
                  alias: str,
                  user_id=None,
-                 blocked_users=list(),
+                 blocked_users=None,
                  create_time: datetime = datetime.now(),
                  modify_time: datetime = datetime.now()) -> None:
         """Initialize a new User object. Mark the user as dirty by default, unless the user was restored from the
@@ -24,14 +27,15 @@ class ChatUser:
         Args:
             alias (str): Alias of the user
             user_id (int, optional): Unique identifier for the User object. Defaults to None.
-            blocked_users (list, optional): List of blocked users for this user. Defaults to []
+            blocked_users (iterable, optional): Aliases of blocked users for this user. Stored as a set.
+            Defaults to an empty set
             create_time (datetime, optional): Create time for the object. Defaults to datetime.now().
             modify_time (datetime, optional): Last time the object was modified. Defaults to datetime.now().
         """
         
-        self.__alias = alias
+        self.__alias = sys.intern(alias)
         self.__user_id = user_id
-        self.__blocked_users = blocked_users
+        self.__blocked_users = set(map(sys.intern, blocked_users)) if blocked_users is not None else set()
         self.__removed = False
         self.__create_time = create_time
         self.__modify_time = modify_time
@@ -53,7 +57,7 @@ class ChatUser:
         self.__user_id = new_user_id
 
     @property
-    def blocked_users(self) -> list:
+    def blocked_users(self) -> set:
         return self.__blocked_users
 
     @property
@@ -73,8 +77,8 @@ class ChatUser:
         self.__dirty = new_dirty
 
     def block_user(self, block_alias: str) -> None:
-        """Block a users messages from being received by this user. Adds the alias to the user's internal list of
-        blocked users
+        """Block a users messages from being received by this user. Adds the alias to the user's internal set of
+        blocked users and marks the user dirty so the change is saved
 
         Args:
             block_alias (str): User alias to block
@@ -83,23 +87,25 @@ class ChatUser:
             log(f"[*] User {block_alias} is already blocked")
             return
 
-        self.__blocked_users.append(block_alias)
+        self.__blocked_users.add(sys.intern(block_alias))
+        self.__modify_time = datetime.now()
+        self.__dirty = True
         log(f"[+] Blocked user {block_alias}")
 
     def is_blocked(self, alias: str) -> bool:
-        """Checks if a user is in this user's list of blocked users
+        """Checks if a user is in this user's set of blocked users
 
         Args:
             alias (str): User alias to look for in the blocked list
         Returns:
             bool: true if alias is in the list, false otherwise
         """
-        return alias in self.__alias
+        return alias in self.__blocked_users
 
     def metadata(self) -> dict:
         return {
             'alias': self.__alias,
-            'blacklist': self.__blocked_users,
+            'blacklist': sorted(self.__blocked_users),
             "create_time": self.__create_time,
             "modify_time": self.__modify_time
         }
@@ -112,7 +118,7 @@ class ChatUser:
         """
         return {
             "alias": self.__alias,
-            "blocked_users": self.__blocked_users,
+            "blocked_users": sorted(self.__blocked_users),
             "removed": self.__removed,
             "create_time": self.__create_time,
             "modify_time": self.__modify_time
@@ -0,0 +1,355 @@
+"""
+RabbitMQ consumer that ingests messages into chat rooms. Producers publish send requests to the room's queue
+(default exchange, routing key = room name) and consumer processes persist them, so ingestion scales by
+adding consumers instead of every HTTP request writing to MongoDB. A room has a single writing process (see
+bin.sequence.SequenceAllocator), so each room's queue is consumed by one consumer; a batch for a room that
+another process writes to is requeued until that process's lease runs out. Requests a room rejects, e.g. a
+private room whose members do not include both aliases, are moved to the queue's dead letter queue
+
+Run with:
+    python -m src.consumer [--queues general foteff] [--prefetch 500] [--batch-size 200]
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import argparse
+import json
+import queue
+import threading
+from functools import partial
+from pika import spec
+from pymongo.errors import PyMongoError
+from bin.constants import *
+from bin.logger import Logger
+from bin.db import ensure_indexes
+from bin.publisher import connect
+from bin.sequence import release_sequence_leases
+from src.room_registry import RoomRegistry
+
+log = Logger("consumer")
+
+
+def dead_letter_queue(queue_name: str) -> str:
+    """Return the name of the queue rejected send requests of a room's queue are moved to"""
+    return f"{queue_name}{RMQ_DEAD_LETTER_SUFFIX}"
+
+
+def encode_send_request(message: str, from_alias: str, to_alias: str) -> bytes:
+    """Encode a send request the way RoomConsumer expects it in a room's queue
+
+    Args:
+        message (str): Text of the message
+        from_alias (str): Alias of the sender
+        to_alias (str): Alias of the recipient
+    Returns:
+        bytes: JSON document
+    """
+    return json.dumps({'message': message, 'from_alias': from_alias, 'to_alias': to_alias}).encode()
+
+
+def decode_send_request(body: bytes) -> tuple:
+    """Decode a send request from a room's queue
+
+    Args:
+        body (bytes): JSON document written by encode_send_request
+    Returns:
+        tuple: (message, from_alias, to_alias), the arguments of ChatRoom.send_messages
+    Raises:
+        ValueError: If the body is not a JSON object with a string message, from_alias and to_alias
+    """
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError("Send request is not a JSON object")
+    fields = tuple(request.get(name) for name in ('message', 'from_alias', 'to_alias'))
+    if not all(isinstance(field, str) for field in fields) or fields[1] == "" or fields[2] == "":
+        raise ValueError("Send request needs a string message, from_alias and to_alias")
+    return fields
+
+
+class _QueueBatch:
+    """Deliveries of one queue waiting to be persisted, with the channel they were delivered on"""
+
+    __slots__ = ('queue', 'room_type', 'channel', 'deliveries', 'timer_scheduled')
+
+    def __init__(self, queue_name: str, room_type: int, channel) -> None:
+        self.queue = queue_name
+        self.room_type = room_type
+        self.channel = channel
+        self.deliveries = list()
+        self.timer_scheduled = False
+
+
+class RoomConsumer:
+    """Consumes send requests from per-room queues and persists them in batches. Each queue gets its own
+    channel with a QoS prefetch window, so the broker keeps up to prefetch_count deliveries in flight without
+    a round trip per message. Deliveries are collected per queue until batch_size have arrived or the oldest
+    has waited max_wait_ms, then the batch is handed to a writer thread, which sends it to the ChatRoom named
+    by the queue in one send_messages call: one block of sequence numbers and one bulk write. Rooms are built
+    without write-behind, so the batch is in MongoDB when send_messages returns, and only then is it
+    acknowledged, with a single Basic.Ack with multiple set. Requests that can not be decoded or are rejected
+    by the room are published to the queue's dead letter queue before that ack, so they can be inspected
+    and replayed instead of being lost. If the write fails the batch is nacked and redelivered; a batch that
+    fails with anything but a MongoDB error a second time is dead lettered, so it can not stop the writer or
+    be retried forever.
+    Delivery is at least once: a consumer that dies between the write and the ack delivers the batch twice
+    """
+
+    def __init__(
+            self,
+            queues: list = (RMQ_DEFAULT_PUBLIC_QUEUE, RMQ_PRIVATE_QUEUE),
+            connection_factory=connect,
+            registry: RoomRegistry = None,
+            prefetch_count: int = RMQ_CONSUMER_PREFETCH,
+            batch_size: int = RMQ_CONSUMER_BATCH,
+            max_wait_ms: int = RMQ_CONSUMER_MAX_WAIT_MS) -> None:
+        """Instantiate a RoomConsumer. Nothing is consumed until run or start is called
+
+        Args:
+            queues (list, optional): Queues to consume. Each is the name of the room its requests are sent
+            to. Defaults to RMQ_DEFAULT_PUBLIC_QUEUE and RMQ_PRIVATE_QUEUE
+            connection_factory (callable, optional): Opens a connection given pika's on_open_callback,
+            on_open_error_callback and on_close_callback. Defaults to connect
+            registry (RoomRegistry, optional): Rooms to persist into. Defaults to a new registry
+            prefetch_count (int, optional): Most unacknowledged deliveries per queue. Defaults to RMQ_CONSUMER_PREFETCH
+            batch_size (int, optional): Most requests persisted together. Defaults to RMQ_CONSUMER_BATCH
+            max_wait_ms (int, optional): Longest a delivery waits for its batch to fill. Defaults to
+            RMQ_CONSUMER_MAX_WAIT_MS
+        """
+        self.__queues = list(queues)
+        self.__connection_factory = connection_factory
+        self.__registry = registry if registry is not None else RoomRegistry()
+        self.__prefetch_count = max(prefetch_count, batch_size)
+        self.__batch_size = batch_size
+        self.__max_wait = max_wait_ms / 1000
+        self.__connection = None
+        self.__thread = None
+        self.__writer = None
+        self.__work = queue.Queue()
+        self.__batches = dict()
+        self.__closing = False
+        self.__lock = threading.Lock()
+        self.__consumed = 0
+        self.__persisted = 0
+        self.__rejected = 0
+        self.__failed_batches = 0
+        self.__batch_count = 0
+
+    @property
+    def prefetch_count(self) -> int:
+        return self.__prefetch_count
+
+    @property
+    def batch_size(self) -> int:
+        return self.__batch_size
+
+    def run(self) -> None:
+        """Connect and consume until stop is called or the connection closes. Blocks the calling thread,
+        which becomes the connection's I/O thread. A consumer runs once"""
+        self.__writer = threading.Thread(target=self.__write_batches, name="rmq-consumer-writer", daemon=True)
+        self.__writer.start()
+        self.__connection = self.__connection_factory(
+            on_open_callback=self.__on_connection_open,
+            on_open_error_callback=self.__on_connection_error,
+            on_close_callback=self.__on_connection_closed)
+        self.__connection.ioloop.start()
+        self.__work.put(None)
+        self.__writer.join()
+        log("[+] Room consumer stopped")
+
+    def start(self) -> None:
+        """Run the consumer on a background thread"""
+        self.__thread = threading.Thread(target=self.run, name="rmq-consumer", daemon=True)
+        self.__thread.start()
+
+    def join(self, timeout: float = None) -> None:
+        """Wait for a consumer started with start to stop
+
+        Args:
+            timeout (float, optional): Most seconds to wait. Defaults to waiting until it stops
+        """
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def stop(self, timeout: float = RMQ_CONFIRM_TIMEOUT_SECONDS) -> None:
+        """Stop consuming. Batches already handed to the writer are persisted and acknowledged first;
+        deliveries still collecting are left unacknowledged and the broker redelivers them
+
+        Args:
+            timeout (float, optional): Most seconds to wait for the consumer thread. Defaults to
+            RMQ_CONFIRM_TIMEOUT_SECONDS
+        """
+        self.__closing = True
+        #   The writer closes the connection once it has acknowledged everything queued before this
+        self.__work.put(None)
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def stats(self) -> dict:
+        """Return the consumer counters
+
+        Returns:
+            dict: Deliveries consumed, requests persisted and rejected, batches written and failed
+        """
+        with self.__lock:
+            return {
+                'consumed': self.__consumed,
+                'persisted': self.__persisted,
+                'rejected': self.__rejected,
+                'batches': self.__batch_count,
+                'failed_batches': self.__failed_batches,
+                'queued_batches': self.__work.qsize()
+            }
+
+    def __on_connection_open(self, connection) -> None:
+        log(f"[+] Consumer connected, consuming {', '.join(self.__queues)}")
+        for queue_name in self.__queues:
+            connection.channel(on_open_callback=partial(self.__on_channel_open, queue_name))
+
+    def __on_connection_error(self, connection, error) -> None:
+        log(f"[-] Consumer could not connect: {error}", 'e')
+        connection.ioloop.stop()
+
+    def __on_connection_closed(self, connection, reason) -> None:
+        if not self.__closing:
+            log(f"[-] Consumer connection closed: {reason}", 'e')
+        connection.ioloop.stop()
+
+    def __on_channel_open(self, queue_name: str, channel) -> None:
+        #   One channel per queue: delivery tags are per channel, so acknowledging a batch with multiple set
+        #   can only cover deliveries of the same queue, whose earlier batches were written first
+        room_type = CHAT_ROOM_TYPE_PRIVATE if queue_name == RMQ_PRIVATE_QUEUE else CHAT_ROOM_TYPE_PUBLIC
+        self.__batches[queue_name] = _QueueBatch(queue_name, room_type, channel)
+        channel.basic_qos(
+            prefetch_count=self.__prefetch_count,
+            callback=lambda _: channel.queue_declare(
+                queue=dead_letter_queue(queue_name),
+                durable=True,
+                callback=lambda _: channel.queue_declare(
+                    queue=queue_name,
+                    durable=True,
+                    callback=lambda _: channel.basic_consume(
+                        queue=queue_name, on_message_callback=partial(self.__on_message, queue_name)))))
+
+    def __on_message(self, queue_name: str, channel, method, properties, body: bytes) -> None:
+        """Collect a delivery into its queue's batch. Runs on the I/O thread"""
+        if self.__closing:
+            #   Left unacknowledged, so the broker redelivers it once the channel closes
+            return
+        batch = self.__batches[queue_name]
+        batch.deliveries.append((method.delivery_tag, body, method.redelivered))
+        with self.__lock:
+            self.__consumed += 1
+        if len(batch.deliveries) >= self.__batch_size:
+            self.__hand_off(batch)
+        elif not batch.timer_scheduled:
+            batch.timer_scheduled = True
+            self.__connection.ioloop.call_later(self.__max_wait, partial(self.__on_timer, batch))
+
+    def __on_timer(self, batch: _QueueBatch) -> None:
+        batch.timer_scheduled = False
+        if not self.__closing:
+            self.__hand_off(batch)
+
+    def __hand_off(self, batch: _QueueBatch) -> None:
+        """Queue the collected deliveries for the writer. Runs on the I/O thread"""
+        if len(batch.deliveries) == 0:
+            return
+        deliveries, batch.deliveries = batch.deliveries, list()
+        self.__work.put((batch, deliveries))
+
+    def __write_batches(self) -> None:
+        """Persist queued batches in order and schedule their acknowledgements. Runs on the writer thread"""
+        while True:
+            work = self.__work.get()
+            if work is None:
+                break
+            self.__write_batch(*work)
+        connection = self.__connection
+        if connection is not None and connection.is_open:
+            connection.ioloop.add_callback_threadsafe(connection.close)
+
+    def __write_batch(self, batch: _QueueBatch, deliveries: list) -> None:
+        requests = list()
+        rejected = list()
+        for delivery_tag, body, _ in deliveries:
+            try:
+                requests.append((body, decode_send_request(body)))
+            except ValueError as error:
+                log(f"[-] Rejected malformed send request in queue {batch.queue}: {error}", 'e')
+                rejected.append(body)
+
+        try:
+            room = self.__registry.get(batch.queue, room_type=batch.room_type, write_behind=False)
+            sequence_nums = room.send_messages([request for _, request in requests]) if len(requests) > 0 else []
+        except Exception as error:
+            #   MongoDB errors are usually transient, so the batch goes back to the queue. Anything else is
+            #   retried once, and dead lettered when it fails again on redelivery, so it can not loop forever
+            requeue = isinstance(error, PyMongoError) or not all(redelivered for _, _, redelivered in deliveries)
+            log(f"[-] Could not persist {len(deliveries)} requests to {batch.queue}, "
+                f"{'requeueing' if requeue else 'dead lettering'} them: {error!r}", 'e')
+            #   Drop the room so its next batch starts from storage instead of the half-applied state
+            try:
+                self.__registry.remove(batch.queue)
+            except Exception:
+                pass
+            with self.__lock:
+                self.__failed_batches += 1
+                if not requeue:
+                    self.__rejected += len(deliveries)
+            if requeue:
+                self.__settle(batch, deliveries[-1][0], requeue=True)
+            else:
+                self.__settle(batch, deliveries[-1][0], [body for _, body, _ in deliveries])
+            return
+
+        rejected.extend(body for (body, _), sequence_num in zip(requests, sequence_nums) if sequence_num is None)
+        with self.__lock:
+            self.__batch_count += 1
+            self.__persisted += len(deliveries) - len(rejected)
+            self.__rejected += len(rejected)
+        self.__settle(batch, deliveries[-1][0], rejected)
+
+    def __settle(self, batch: _QueueBatch, last_tag: int, rejected: list = (), requeue: bool = False) -> None:
+        """Schedule the settlement of a written batch on the I/O thread, which owns the channel. Rejected
+        request bodies are published to the dead letter queue, then the whole batch is acknowledged with one
+        multiple ack; with requeue set the whole batch is nacked back to its queue instead"""
+        channel = batch.channel
+        properties = spec.BasicProperties(content_type="application/json", delivery_mode=2)
+
+        def settle() -> None:
+            if not channel.is_open:
+                return
+            if requeue:
+                channel.basic_nack(delivery_tag=last_tag, multiple=True, requeue=True)
+                return
+            for body in rejected:
+                channel.basic_publish(
+                    exchange=RMQ_DEFAULT_PUBLIC_EXCHANGE, routing_key=dead_letter_queue(batch.queue), body=body,
+                    properties=properties)
+            channel.basic_ack(delivery_tag=last_tag, multiple=True)
+
+        self.__connection.ioloop.add_callback_threadsafe(settle)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queues", nargs="+", default=[RMQ_DEFAULT_PUBLIC_QUEUE, RMQ_PRIVATE_QUEUE], help="Room queues to consume")
+    parser.add_argument("--prefetch", type=int, default=RMQ_CONSUMER_PREFETCH, help="Unacknowledged deliveries per queue")
+    parser.add_argument("--batch-size", type=int, default=RMQ_CONSUMER_BATCH, help="Requests persisted per bulk write")
+    parser.add_argument("--max-wait-ms", type=int, default=RMQ_CONSUMER_MAX_WAIT_MS, help="Longest wait for a batch to fill")
+    args = parser.parse_args()
+
+    ensure_indexes()
+    consumer = RoomConsumer(args.queues, prefetch_count=args.prefetch, batch_size=args.batch_size, max_wait_ms=args.max_wait_ms)
+    consumer.start()
+    try:
+        consumer.join()
+    except KeyboardInterrupt:
+        consumer.stop()
+    release_sequence_leases()
+    log(f"[*] Consumer stats: {consumer.stats()}")
+
+
+if __name__ == "__main__":
+    main()
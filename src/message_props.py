@@ -7,25 +7,59 @@ Message properties object class file
 __version__ = "1.0.0"
 __author__ = "Zac Foteff"
 
+import sys
+import time
 from datetime import datetime
 from bin.logger import Logger
 
 logger = Logger("messageProperties")
 
 
+def intern_str(value):
+    """Intern strings so repeated aliases and room names share one object. Other values are returned as is"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def to_epoch(value) -> float | None:
+    """Convert a time to epoch seconds. Accepts datetime objects, numbers, and the strings the
+    to_dict methods store in MongoDB. None, "None" and unparsable values become None
+
+    Args:
+        value: Time to convert
+    Returns:
+        float | None: Seconds since the epoch, or None if there is no time
+    """
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, int):
+        return float(value)
+    if isinstance(value, str) and value != "None":
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            logger(f"[-] Could not parse message time {value}", 'w')
+    return None
+
+
 class MessageProperties:
     """
-    MessageProperties class object
+    MessageProperties class object. Uses __slots__ and stores times as epoch floats to keep the
+    footprint of resident messages small
     """
 
+    __slots__ = ('__mess_type', '__room_name', '__from_user', '__to_user', '__sequence_num', '__sent_time', '__rec_time')
+
     def __init__(self,
                  mess_type: int,
                  room_name: str,
                  to_user: str,
                  from_user: str,
                  sequence_num: int = -1,
-                 sent_time: datetime = datetime.now(),
-                 rec_time: datetime = None):
+                 sent_time: datetime = None,
+                 rec_time: datetime = None,
+                 default_sent_time: bool = True):
         """Instantiate a new MessageProperties class object. The object encapsulates
         all the properties of messages that are sent using the chat application API
 
@@ -36,16 +70,21 @@ class MessageProperties:
             from_user (str): Alias of the user who sent the message
             sequence_num (int, optional): Location of the message in the sequence of messages that exist in the
             room. Defaults to -1
-            sent_time (datetime, optional): Time the message was received by the system. Defaults to the current time
-            rec_time (datetime, optional): Time the message was received by the system. Defaults to None
+            sent_time (datetime | float, optional): Time the message was sent. Defaults to the current time
+            rec_time (datetime | float, optional): Time the message was received by the system. Defaults to None
+            default_sent_time (bool, optional): Use the current time when sent_time is None. Pass False for
+            stored messages that have no sent time. Defaults to True
         """
         self.__mess_type = mess_type
-        self.__room_name = room_name
-        self.__from_user = from_user
-        self.__to_user = to_user
+        self.__room_name = intern_str(room_name)
+        self.__from_user = intern_str(from_user)
+        self.__to_user = intern_str(to_user)
         self.__sequence_num = sequence_num
-        self.__sent_time = sent_time
-        self.__rec_time = rec_time
+        if sent_time is None:
+            self.__sent_time = time.time() if default_sent_time else None
+        else:
+            self.__sent_time = to_epoch(sent_time)
+        self.__rec_time = to_epoch(rec_time)
 
     @property
     def room_name(self) -> str:
@@ -73,15 +112,23 @@ class MessageProperties:
 
     @property
     def sent_time(self) -> datetime:
+        return datetime.fromtimestamp(self.__sent_time) if self.__sent_time is not None else None
+
+    @property
+    def sent_timestamp(self) -> float:
         return self.__sent_time
 
     @property
     def rec_time(self) -> datetime:
-        return self.__rec_time
+        return datetime.fromtimestamp(self.__rec_time) if self.__rec_time is not None else None
 
     @rec_time.setter
     def rec_time(self, new_rec_time) -> None:
-        self.__rec_time = new_rec_time
+        self.__rec_time = to_epoch(new_rec_time)
+
+    @property
+    def rec_timestamp(self) -> float:
+        return self.__rec_time
 
     def to_dict(self) -> dict:
         """Custom to_dict method for message property objects. The custom approach is designed
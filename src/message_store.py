@@ -0,0 +1,418 @@
+"""
+Columnar, array backed store for the message history of large ChatRooms. Each message field is kept in
+its own column instead of one object graph per message. Reads hand out StoredMessage views over the
+columns, and a ChatMessage is only built when one is asked for
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import math
+import operator
+from array import array
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+from itertools import compress, islice, repeat, tee
+from typing import Iterator
+from bin.constants import *
+from bin.logger import Logger
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+log = Logger("messageStore")
+
+NO_TIME = math.nan
+
+
+class _Columns:
+    """The columns of one ColumnarMessageStore, shared with the views it hands out. The columns are only
+    grown or updated in place, so the references stay valid for the life of the store"""
+
+    __slots__ = ('room_name', 'sequence_nums', 'sent_times', 'rec_times', 'mess_types', 'from_users', 'to_users',
+                 'body_offsets', 'bodies', 'aliases')
+
+    def __init__(self, room_name: str) -> None:
+        self.room_name = room_name
+        self.sequence_nums = array('q')
+        self.sent_times = array('d')
+        self.rec_times = array('d')
+        self.mess_types = array('b')
+        self.from_users = array('l')
+        self.to_users = array('l')
+        self.body_offsets = array('q', [0])
+        self.bodies = bytearray()
+        self.aliases = list()
+
+
+def stored_time(value: float) -> float | None:
+    """Convert a time column value to an epoch time, None where the time is missing"""
+    return value if not math.isnan(value) else None
+
+
+class StoredMessageProperties(tuple):
+    """Read only view of the properties of a message in a ColumnarMessageStore, with the read side of the
+    MessageProperties interface. A (columns, position) pair; each field is read from its column when it is
+    accessed"""
+
+    __slots__ = ()
+
+    @property
+    def room_name(self) -> str:
+        return self[0].room_name
+
+    @property
+    def mess_type(self) -> int:
+        return self[0].mess_types[self[1]]
+
+    @property
+    def from_user(self) -> str:
+        return self[0].aliases[self[0].from_users[self[1]]]
+
+    @property
+    def to_user(self) -> str:
+        return self[0].aliases[self[0].to_users[self[1]]]
+
+    @property
+    def sequence_num(self) -> int:
+        return self[0].sequence_nums[self[1]]
+
+    @property
+    def sent_timestamp(self) -> float | None:
+        return stored_time(self[0].sent_times[self[1]])
+
+    @property
+    def rec_timestamp(self) -> float | None:
+        return stored_time(self[0].rec_times[self[1]])
+
+    @property
+    def sent_time(self) -> datetime | None:
+        sent_time = self.sent_timestamp
+        return datetime.fromtimestamp(sent_time) if sent_time is not None else None
+
+    @property
+    def rec_time(self) -> datetime | None:
+        rec_time = self.rec_timestamp
+        return datetime.fromtimestamp(rec_time) if rec_time is not None else None
+
+    def to_mess_props(self) -> MessageProperties:
+        """Build the MessageProperties the view reads from"""
+        return MessageProperties(
+            self.mess_type, self.room_name, self.to_user, self.from_user, self.sequence_num,
+            self.sent_timestamp, self.rec_timestamp, default_sent_time=False)
+
+    def to_dict(self) -> dict:
+        return self.to_mess_props().to_dict()
+
+
+class StoredMessage(tuple):
+    """Read only view of a message in a ColumnarMessageStore, with the read side of the ChatMessage
+    interface. A (columns, position) pair, so building one costs a small tuple; the body is decoded and the
+    properties view made only when they are accessed. Stored messages are always clean"""
+
+    __slots__ = ()
+
+    dirty = False
+
+    @property
+    def message(self) -> str:
+        offsets = self[0].body_offsets
+        return self[0].bodies[offsets[self[1]]:offsets[self[1] + 1]].decode()
+
+    @property
+    def mess_props(self) -> StoredMessageProperties:
+        return StoredMessageProperties(self)
+
+    @property
+    def message_id(self) -> str:
+        return f"{self[0].room_name}:{self[0].sequence_nums[self[1]]}"
+
+    def to_message(self) -> ChatMessage:
+        """Build a clean ChatMessage holding the stored message"""
+        message = ChatMessage(self.message, self.mess_props.to_mess_props())
+        message.dirty = False
+        return message
+
+    def to_dict(self) -> dict:
+        return {'message': self.message, 'mess_props': self.mess_props.to_dict()}
+
+
+class ColumnarMessageStore:
+    """Append only column store for the messages of a single room. Messages must be appended in
+    ascending sequence number order, which is how they are assigned and how history is loaded.
+        * Sequence numbers, sent and received times live in array('q') / array('d') columns
+        * Message types live in an array('b') column
+        * Aliases are stored as indices into a per-room string table
+        * Message bodies share one contiguous UTF-8 buffer, sliced with an offset column
+    Filtering, time range slicing and counting run over whole columns with map / compress, so the
+    per-message work happens in C rather than in the interpreter. While sent times arrive in order,
+    which is the usual case, time ranges are found with a binary search instead of a scan
+    """
+
+    def __init__(self, room_name: str) -> None:
+        """Instantiate an empty ColumnarMessageStore
+
+        Args:
+            room_name (str): Name of the room the messages belong to
+        """
+        self.__room_name = room_name
+        self.__columns = _Columns(room_name)
+        self.__sequence_nums = self.__columns.sequence_nums
+        self.__sent_times = self.__columns.sent_times
+        self.__rec_times = self.__columns.rec_times
+        self.__mess_types = self.__columns.mess_types
+        self.__from_users = self.__columns.from_users
+        self.__to_users = self.__columns.to_users
+        self.__body_offsets = self.__columns.body_offsets
+        self.__bodies = self.__columns.bodies
+        self.__aliases = self.__columns.aliases
+        self.__alias_index = dict()
+        self.__sent_sorted = True
+
+    @property
+    def room_name(self) -> str:
+        return self.__room_name
+
+    @property
+    def length(self) -> int:
+        return len(self.__sequence_nums)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns, the body buffer and the string table"""
+        columns = (self.__sequence_nums, self.__sent_times, self.__rec_times, self.__mess_types,
+                   self.__from_users, self.__to_users, self.__body_offsets)
+        return (sum(column.itemsize * len(column) for column in columns) + len(self.__bodies)
+                + sum(len(alias) for alias in self.__aliases))
+
+    def __len__(self) -> int:
+        return len(self.__sequence_nums)
+
+    def __alias_id(self, alias: str) -> int:
+        """Return the string table index of an alias, adding it to the table if it is new"""
+        alias_id = self.__alias_index.get(alias)
+        if alias_id is None:
+            alias_id = len(self.__aliases)
+            self.__aliases.append(alias)
+            self.__alias_index[alias] = alias_id
+        return alias_id
+
+    def append(self, message: ChatMessage) -> None:
+        """Add a message to the end of the store
+
+        Args:
+            message (ChatMessage): Message to store. Its sequence number must be higher than every stored message
+        Raises:
+            ValueError: If the message is older than the newest stored message
+        """
+        mess_props = message.mess_props
+        if len(self.__sequence_nums) > 0 and mess_props.sequence_num <= self.__sequence_nums[-1]:
+            raise ValueError(f"Message {message.message_id} is out of order for the message store of {self.__room_name}")
+
+        sent_time = mess_props.sent_timestamp if mess_props.sent_timestamp is not None else NO_TIME
+        if len(self.__sent_times) > 0 and not sent_time >= self.__sent_times[-1]:
+            self.__sent_sorted = False
+
+        self.__sequence_nums.append(mess_props.sequence_num)
+        self.__sent_times.append(sent_time)
+        self.__rec_times.append(mess_props.rec_timestamp if mess_props.rec_timestamp is not None else NO_TIME)
+        self.__mess_types.append(mess_props.mess_type)
+        self.__from_users.append(self.__alias_id(mess_props.from_user))
+        self.__to_users.append(self.__alias_id(mess_props.to_user))
+        self.__bodies += message.message.encode()
+        self.__body_offsets.append(len(self.__bodies))
+
+    def extend(self, messages) -> None:
+        """Append messages, oldest first
+
+        Args:
+            messages (Iterable[ChatMessage]): Messages in ascending sequence number order
+        """
+        for message in messages:
+            self.append(message)
+
+    def view_at(self, position: int) -> StoredMessage:
+        """Return a read only view of the message stored at a position
+
+        Args:
+            position (int): Position in the store, 0 being the oldest message
+        Returns:
+            StoredMessage: View of the message stored at the position
+        """
+        return StoredMessage((self.__columns, position))
+
+    def message_at(self, position: int) -> ChatMessage:
+        """Build the ChatMessage stored at a position. The message comes back clean (dirty flag lowered)
+
+        Args:
+            position (int): Position in the store, 0 being the oldest message
+        Returns:
+            ChatMessage: Message stored at the position
+        """
+        return StoredMessage((self.__columns, position)).to_message()
+
+    def position_of(self, sequence_num: int) -> int | None:
+        """Find the position of a sequence number with a binary search
+
+        Args:
+            sequence_num (int): Sequence number to look up
+        Returns:
+            int | None: Position of the message, or None if it is not stored
+        """
+        position = bisect_left(self.__sequence_nums, sequence_num)
+        if position < len(self.__sequence_nums) and self.__sequence_nums[position] == sequence_num:
+            return position
+        return None
+
+    def set_received(self, sequence_num: int, rec_time: float, mess_type: int = MESSAGE_RECEIVED) -> bool:
+        """Record that a stored message has been received
+
+        Args:
+            sequence_num (int): Sequence number of the message
+            rec_time (float): Epoch time the message was received
+            mess_type (int, optional): New message type. Defaults to MESSAGE_RECEIVED
+        Returns:
+            bool: True if the message is in the store
+        """
+        position = self.position_of(sequence_num)
+        if position is None:
+            return False
+        self.__rec_times[position] = rec_time
+        self.__mess_types[position] = mess_type
+        return True
+
+    def __sender_mask(self, exclude_senders: frozenset) -> bytes:
+        """Build a lookup table indexed by string table position, 1 for senders that are kept"""
+        mask = bytearray(b'\x01') * len(self.__aliases)
+        for alias in exclude_senders:
+            alias_id = self.__alias_index.get(alias)
+            if alias_id is not None:
+                mask[alias_id] = 0
+        return bytes(mask)
+
+    @staticmethod
+    def __keep(positions, column: array, selector):
+        """Lazily keep the positions whose value in column passes selector"""
+        positions, probe = tee(positions)
+        return compress(positions, map(selector, map(column.__getitem__, probe)))
+
+    def select(
+            self,
+            before_seq: int = None,
+            limit: int = GET_ALL_MESSAGES,
+            exclude_senders: frozenset = frozenset(),
+            to_user: str = None,
+            after_seq: int = None,
+            oldest_first: bool = False) -> list:
+        """Select messages newest first, the same contract as ChatRoom.load_before. With oldest_first the
+        oldest matching messages are selected instead, in ascending order (see ChatRoom.load_after)
+
+        Args:
+            before_seq (int, optional): Only return messages with a lower sequence number. Defaults to None
+            limit (int, optional): Maximum number of messages to return. Defaults to GET_ALL_MESSAGES
+            exclude_senders (frozenset, optional): Aliases whose messages are skipped. Defaults to an empty set
+            to_user (str, optional): Only select messages sent to this alias. Defaults to None
+            after_seq (int, optional): Only return messages with a higher sequence number. Defaults to None
+            oldest_first (bool, optional): Select and order from the oldest message. Defaults to False
+        Returns:
+            list: StoredMessage views ordered from newest to oldest, or oldest to newest with oldest_first
+        """
+        end = bisect_left(self.__sequence_nums, before_seq) if before_seq is not None else len(self.__sequence_nums)
+        start = bisect_right(self.__sequence_nums, after_seq) if after_seq is not None else 0
+        positions = range(start, end) if oldest_first else range(end - 1, start - 1, -1)
+        if to_user is not None:
+            alias_id = self.__alias_index.get(to_user)
+            if alias_id is None:
+                return []
+            positions = self.__keep(positions, self.__to_users, alias_id.__eq__)
+        if len(exclude_senders) > 0:
+            mask = self.__sender_mask(exclude_senders)
+            positions = self.__keep(positions, self.__from_users, mask.__getitem__)
+        if limit != GET_ALL_MESSAGES:
+            positions = islice(positions, limit)
+        return list(map(StoredMessage, zip(repeat(self.__columns), positions)))
+
+    def time_range(self, start_time: float, end_time: float) -> Iterator[StoredMessage]:
+        """Generate the messages sent in [start_time, end_time), oldest first
+
+        Args:
+            start_time (float): Epoch time of the start of the range
+            end_time (float): Epoch time of the end of the range, exclusive
+        Returns:
+            Iterator[StoredMessage]: Views of the messages sent within the range
+        """
+        if self.__sent_sorted:
+            positions = range(*self.__sorted_range(start_time, end_time))
+        else:
+            positions = compress(range(len(self.__sent_times)), self.__in_range(start_time, end_time))
+        return map(StoredMessage, zip(repeat(self.__columns), positions))
+
+    def count(
+            self,
+            from_user: str = None,
+            start_time: float = None,
+            end_time: float = None) -> int:
+        """Count stored messages without building them
+
+        Args:
+            from_user (str, optional): Only count messages sent by this alias. Defaults to None
+            start_time (float, optional): Only count messages sent at or after this epoch time. Defaults to None
+            end_time (float, optional): Only count messages sent before this epoch time. Defaults to None
+        Returns:
+            int: Number of matching messages
+        """
+        if from_user is not None:
+            alias_id = self.__alias_index.get(from_user)
+            if alias_id is None:
+                return 0
+        if start_time is None and end_time is None:
+            return self.__from_users.count(alias_id) if from_user is not None else len(self.__sequence_nums)
+
+        if self.__sent_sorted:
+            start, end = self.__sorted_range(start_time, end_time)
+            return self.__from_users[start:end].count(alias_id) if from_user is not None else end - start
+
+        in_range = self.__in_range(start_time, end_time)
+        if from_user is None:
+            return sum(in_range)
+        return sum(map(operator.and_, in_range, map(alias_id.__eq__, self.__from_users)))
+
+    def count_to_user(
+            self,
+            to_user: str,
+            after_seq: int = None,
+            before_seq: int = None,
+            exclude_senders: frozenset = frozenset()) -> int:
+        """Count stored messages sent to an alias within a sequence number range, without building them
+
+        Args:
+            to_user (str): Alias the messages were sent to
+            after_seq (int, optional): Only count messages with a higher sequence number. Defaults to None
+            before_seq (int, optional): Only count messages with a lower sequence number. Defaults to None
+            exclude_senders (frozenset, optional): Aliases whose messages are not counted. Defaults to an empty set
+        Returns:
+            int: Number of matching messages
+        """
+        alias_id = self.__alias_index.get(to_user)
+        if alias_id is None:
+            return 0
+        start = bisect_right(self.__sequence_nums, after_seq) if after_seq is not None else 0
+        end = bisect_left(self.__sequence_nums, before_seq) if before_seq is not None else len(self.__sequence_nums)
+        if start >= end:
+            return 0
+        if len(exclude_senders) == 0:
+            return self.__to_users[start:end].count(alias_id)
+        positions = self.__keep(range(start, end), self.__to_users, alias_id.__eq__)
+        mask = self.__sender_mask(exclude_senders)
+        return sum(1 for _ in self.__keep(positions, self.__from_users, mask.__getitem__))
+
+    def __sorted_range(self, start_time: float | None, end_time: float | None) -> tuple:
+        """Binary search the positions of [start_time, end_time) in a sorted sent time column"""
+        start = bisect_left(self.__sent_times, start_time) if start_time is not None else 0
+        end = bisect_left(self.__sent_times, end_time) if end_time is not None else len(self.__sent_times)
+        return start, max(start, end)
+
+    def __in_range(self, start_time: float | None, end_time: float | None):
+        """Build a lazy boolean column of sent times that fall within [start_time, end_time)"""
+        start_time = -math.inf if start_time is None else float(start_time)
+        end_time = math.inf if end_time is None else float(end_time)
+        return map(operator.and_, map(start_time.__le__, self.__sent_times), map(end_time.__gt__, self.__sent_times))
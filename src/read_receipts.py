@@ -0,0 +1,93 @@
+"""
+Read receipts for a single ChatRoom. Each user's progress through the room is one cursor, the highest
+sequence number they have read, instead of a received flag on every message document
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import time
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from bin.constants import *
+from bin.logger import Logger
+from bin.write_behind import get_write_behind_buffer
+
+log = Logger("readReceipts")
+
+
+class ReadReceipts:
+    """Per-user read cursors for one room. Cursors only move forward. Reads advance the in-memory cursor,
+    and the new position is handed to a write-behind buffer keyed by (room, alias), so any number of reads
+    between two flushes cost one upsert. The upsert uses $max, so a late or repeated flush can never move a
+    stored cursor backwards. Cursors are loaded from MongoDB the first time a user is looked up
+    """
+
+    def __init__(self, room_name: str, collection: Collection, write_behind: bool = True) -> None:
+        """Instantiate the read receipts of a room
+
+        Args:
+            room_name (str): Name of the room
+            collection (Collection): Collection the receipts are stored in
+            write_behind (bool, optional): Flush receipts in bulk every RECEIPT_FLUSH_INTERVAL_MS instead of
+            writing each one through. Defaults to True
+        """
+        self.__room_name = room_name
+        self.__collection = collection
+        self.__write_behind = get_write_behind_buffer(
+            collection, max_latency_ms=RECEIPT_FLUSH_INTERVAL_MS) if write_behind else None
+        self.__cursors = dict()
+
+    @property
+    def room_name(self) -> str:
+        return self.__room_name
+
+    def cursor(self, alias: str) -> int:
+        """Return the highest sequence number alias has read in the room
+
+        Args:
+            alias (str): Alias of the reader
+        Returns:
+            int: Highest sequence number read, 0 if alias has not read anything
+        """
+        sequence_num = self.__cursors.get(alias)
+        if sequence_num is None:
+            receipt = self.__collection.find_one({'room_name': self.__room_name, 'alias': alias})
+            sequence_num = receipt['sequence_num'] if receipt is not None else 0
+            #   A read that happened while the receipt was loading must not be overwritten
+            sequence_num = self.__cursors.setdefault(alias, sequence_num)
+        return sequence_num
+
+    def advance(self, alias: str, sequence_num: int) -> bool:
+        """Record that alias has read the room up to sequence_num
+
+        Args:
+            alias (str): Alias of the reader
+            sequence_num (int): Highest sequence number read
+        Returns:
+            bool: True if the cursor moved forward
+        """
+        if sequence_num <= self.cursor(alias):
+            return False
+
+        self.__cursors[alias] = sequence_num
+        operation = UpdateOne(
+            {'room_name': self.__room_name, 'alias': alias},
+            {'$max': {'sequence_num': sequence_num}, '$set': {'read_time': time.time()}},
+            upsert=True)
+        if self.__write_behind is not None:
+            self.__write_behind.submit((self.__room_name, alias), operation)
+        else:
+            self.__collection.bulk_write([operation])
+        return True
+
+    def is_read(self, alias: str, sequence_num: int) -> bool:
+        """Check if alias has read the message with sequence_num
+
+        Args:
+            alias (str): Alias of the reader
+            sequence_num (int): Sequence number of the message
+        Returns:
+            bool: True if the message is at or behind the reader's cursor
+        """
+        return sequence_num <= self.cursor(alias)
@@ -6,10 +6,10 @@ messaging service
 __author__ = "Zac Foteff"
 __version__ = "1.0.0."
 
-from pymongo import MongoClient
 from datetime import datetime
 from bin.constants import *
 from bin.logger import Logger
+from bin.db import get_client, get_database
 from src.chat_room import ChatRoom
 
 log = Logger("./roomList")
@@ -35,10 +35,9 @@ class RoomList:
         self.__create_time = datetime.now()
         self.__modify_time = datetime.now()
 
-        #   Initialize MongoDB resources
-        # PROD ONLY: self.__mongo_client = MongoClient(PROD_DB_HOST, PROD_DB_PORT)
-        self.__mongo_client = MongoClient(TEST_DB_HOST)
-        self.__mongo_db = self.__mongo_client.cpsc313
+        #   Initialize MongoDB resources from the shared connection pool
+        self.__mongo_client = get_client()
+        self.__mongo_db = get_database()
         self.__mongo_collection = self.__mongo_db.get_collection(list_name)
         if self.__mongo_collection is None:
             #   Initialize the chat queue collection in the DB if it does not already exist
@@ -0,0 +1,228 @@
+"""
+Process level registry of ChatRoom instances. Keeps hot rooms resident so API requests do not rebuild
+and restore a room from MongoDB every time
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import threading
+import time
+from collections import OrderedDict
+from pymongo.errors import PyMongoError
+from bin.constants import *
+from bin.logger import Logger
+from bin.notifier import get_room_notifier
+from src.chat_room import ChatRoom
+
+log = Logger("roomRegistry")
+
+
+class RoomRegistry:
+    """LRU cache of ChatRoom objects keyed by room name. The cache is bounded both by the number of rooms
+    and by their approximate memory (see ChatRoom.approx_bytes). The least recently used room is evicted
+    first, and its dirty state is persisted after it is dropped. A resident room reads the messages other
+    processes saved to it (ChatRoom.refresh) at most once every refresh_seconds, when it is looked up.
+    Callers serialise lookups of one room (e.g. with its KeyedExecutor key), so the refresh has the room to
+    itself
+    """
+
+    def __init__(
+            self,
+            max_rooms: int = ROOM_REGISTRY_MAX_ROOMS,
+            max_bytes: int = ROOM_REGISTRY_MAX_BYTES,
+            ttl_seconds: float = ROOM_REGISTRY_TTL_SECONDS,
+            refresh_seconds: float = ROOM_REGISTRY_REFRESH_SECONDS,
+            on_evict=None) -> None:
+        """Instantiate an empty RoomRegistry
+
+        Args:
+            max_rooms (int, optional): Most rooms kept resident. Defaults to ROOM_REGISTRY_MAX_ROOMS
+            max_bytes (int, optional): Approximate memory budget for resident rooms. Defaults to
+            ROOM_REGISTRY_MAX_BYTES
+            ttl_seconds (float, optional): Reload a room from storage once it has been resident this long,
+            to pick up writes made by other processes. 0 keeps rooms until they are evicted. Defaults to
+            ROOM_REGISTRY_TTL_SECONDS
+            refresh_seconds (float, optional): Least time between two refreshes of a resident room from
+            storage. 0 refreshes on every lookup. Defaults to ROOM_REGISTRY_REFRESH_SECONDS
+            on_evict (callable, optional): Called with each evicted or expired room, outside the registry lock, to
+            persist it. Pass one that hands the persist to the room's executor key so it can not overlap a
+            call on that room. Defaults to persisting the room on the calling thread
+        """
+        self.__max_rooms = max_rooms
+        self.__max_bytes = max_bytes
+        self.__ttl_seconds = ttl_seconds
+        self.__refresh_seconds = refresh_seconds
+        self.__on_evict = on_evict if on_evict is not None else ChatRoom.persist
+        self.__notifier = get_room_notifier()
+        self.__rooms = OrderedDict()
+        self.__load_times = dict()
+        self.__refresh_times = dict()
+        self.__lock = threading.RLock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__last_sweep = time.monotonic()
+
+    @property
+    def length(self) -> int:
+        return len(self.__rooms)
+
+    @property
+    def approx_bytes(self) -> int:
+        with self.__lock:
+            return sum(room.approx_bytes for room in self.__rooms.values())
+
+    def get(self, room_name: str, **room_args) -> ChatRoom:
+        """Return the resident ChatRoom with this name, building (and restoring) it on a miss
+
+        Args:
+            room_name (str): Name of the room
+            **room_args: Extra ChatRoom constructor arguments, only used when the room is built
+        Returns:
+            ChatRoom: Resident room instance
+        """
+        expired_room = None
+        with self.__lock:
+            self.__sweep_search_indexes()
+            room = self.__rooms.get(room_name)
+            if room is not None and not self.__expired(room_name):
+                self.__rooms.move_to_end(room_name)
+                self.__hits += 1
+                refresh = self.__refresh_due(room_name)
+            else:
+                self.__misses += 1
+                if room is not None:
+                    expired_room = self.__pop(room_name)
+                room = None
+
+        #   An expired room is persisted like an evicted one, outside the lock
+        if expired_room is not None:
+            self.__on_evict(expired_room)
+        if room is not None:
+            if refresh:
+                self.__refresh(room)
+            return room
+
+        #   Build the room outside the lock so a slow restore does not hold up requests for other rooms
+        new_room = ChatRoom(room_name=room_name, **room_args)
+        with self.__lock:
+            room = self.__rooms.get(room_name)
+            if room is None:
+                room = new_room
+                self.__rooms[room_name] = room
+                self.__load_times[room_name] = self.__refresh_times[room_name] = time.monotonic()
+            self.__rooms.move_to_end(room_name)
+            evicted = self.__evict()
+        for evicted_room in evicted:
+            self.__on_evict(evicted_room)
+        return room
+
+    def __contains__(self, room_name: str) -> bool:
+        return room_name in self.__rooms
+
+    def remove(self, room_name: str) -> bool:
+        """Drop a room from the registry and persist it. The persist runs after the registry lock is released
+
+        Args:
+            room_name (str): Name of the room
+        Returns:
+            bool: True if the room was resident
+        """
+        with self.__lock:
+            if room_name not in self.__rooms:
+                return False
+            room = self.__pop(room_name)
+        room.persist()
+        return True
+
+    def flush(self) -> None:
+        """Persist the dirty state of every resident room"""
+        with self.__lock:
+            for room in self.__rooms.values():
+                room.persist()
+
+    def clear(self) -> None:
+        """Drop and persist every resident room. Called on application shutdown"""
+        with self.__lock:
+            dropped = [self.__pop(room_name) for room_name in list(self.__rooms)]
+        for room in dropped:
+            room.persist()
+
+    def stats(self) -> dict:
+        """Return the registry counters used for sizing
+
+        Returns:
+            dict: Hits, misses, evictions, resident rooms and their approximate memory
+        """
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                'rooms': self.length,
+                'approx_bytes': self.approx_bytes,
+                'max_rooms': self.__max_rooms,
+                'max_bytes': self.__max_bytes,
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'hit_ratio': self.__hits / lookups if lookups > 0 else 0.0
+            }
+
+    def __sweep_search_indexes(self) -> None:
+        """Release the search indexes of rooms that have not been searched for SEARCH_INDEX_IDLE_SECONDS.
+        Runs at most once per half of that interval. Caller must hold the lock"""
+        now = time.monotonic()
+        if now - self.__last_sweep < SEARCH_INDEX_IDLE_SECONDS / 2:
+            return
+        self.__last_sweep = now
+        for room in self.__rooms.values():
+            room.release_search_index()
+
+    def __expired(self, room_name: str) -> bool:
+        """Check if a resident room has outlived the TTL. Caller must hold the lock"""
+        if self.__ttl_seconds <= 0:
+            return False
+        return time.monotonic() - self.__load_times[room_name] > self.__ttl_seconds
+
+    def __refresh_due(self, room_name: str) -> bool:
+        """Check if a resident room should be refreshed from storage, and if so restart its interval. Caller
+        must hold the lock"""
+        now = time.monotonic()
+        if now - self.__refresh_times[room_name] < self.__refresh_seconds:
+            return False
+        self.__refresh_times[room_name] = now
+        return True
+
+    @staticmethod
+    def __refresh(room: ChatRoom) -> None:
+        """Refresh a room from storage. A failed refresh is logged and the resident room served as it is"""
+        try:
+            room.refresh()
+        except PyMongoError as e:
+            log(f"[-] Could not refresh room {room.room_name} from storage: {e}", 'e')
+
+    def __pop(self, room_name: str) -> ChatRoom:
+        """Remove a room from the registry, and its high-water mark from the notifier. Caller must hold the
+        lock"""
+        self.__notifier.forget(room_name)
+        self.__load_times.pop(room_name, None)
+        self.__refresh_times.pop(room_name, None)
+        return self.__rooms.pop(room_name)
+
+    def __evict(self) -> list:
+        """Evict least recently used rooms until both bounds hold. The most recently used room is
+        always kept. Caller must hold the lock, and hand the evicted rooms to on_evict once it is released
+
+        Returns:
+            list: Evicted rooms, not yet persisted
+        """
+        evicted = list()
+        #   Summed once; each evicted room's share is taken off instead of summing the rest again
+        approx_bytes = self.approx_bytes
+        while self.length > 1 and (self.length > self.__max_rooms or approx_bytes > self.__max_bytes):
+            room_name = next(iter(self.__rooms))
+            evicted.append(self.__pop(room_name))
+            approx_bytes -= evicted[-1].approx_bytes
+            self.__evictions += 1
+            log(f"[-] Evicted room {room_name} from the registry", 'd')
+        return evicted
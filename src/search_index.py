@@ -0,0 +1,167 @@
+"""
+Inverted index over the message bodies of a single ChatRoom. Maps each token to the sequence numbers of
+the messages that contain it, so searches do not scan the room history
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import heapq
+import re
+import sys
+import time
+from array import array
+from bisect import bisect_left, insort
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("searchIndex")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+PREFIX_MARKER = '*'
+
+
+def tokenize(text: str) -> list:
+    """Split text into lower case word tokens
+
+    Args:
+        text (str): Text to split
+    Returns:
+        list: Tokens in the order they appear
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """Token → sequence number postings for one room. Postings are kept in ascending array('q') columns
+    and the vocabulary is kept sorted, so prefix terms expand with a binary search. Queries are AND
+    queries: every term must match, and a term ending in '*' matches any token with that prefix
+    """
+
+    def __init__(self, room_name: str) -> None:
+        """Instantiate an empty SearchIndex
+
+        Args:
+            room_name (str): Name of the room the index belongs to
+        """
+        self.__room_name = room_name
+        self.__postings = dict()
+        self.__vocabulary = list()
+        self.__num_postings = 0
+        self.__last_used = time.monotonic()
+
+    @property
+    def room_name(self) -> str:
+        return self.__room_name
+
+    @property
+    def num_tokens(self) -> int:
+        return len(self.__vocabulary)
+
+    @property
+    def num_postings(self) -> int:
+        return self.__num_postings
+
+    @property
+    def last_used(self) -> float:
+        """Monotonic time of the last search"""
+        return self.__last_used
+
+    @property
+    def approx_bytes(self) -> int:
+        """Rough estimate of the memory held by the index"""
+        return (SEARCH_INDEX_TOKEN_OVERHEAD_BYTES * len(self.__vocabulary)
+                + sum(len(token) for token in self.__vocabulary) + 8 * self.__num_postings)
+
+    def add(self, sequence_num: int, text: str) -> None:
+        """Index the tokens of a message. Adding a message that is already indexed has no effect
+
+        Args:
+            sequence_num (int): Sequence number of the message
+            text (str): Message body
+        """
+        for token in set(tokenize(text)):
+            posting = self.__postings.get(token)
+            if posting is None:
+                token = sys.intern(token)
+                posting = array('q')
+                self.__postings[token] = posting
+                insort(self.__vocabulary, token)
+
+            if len(posting) == 0 or posting[-1] < sequence_num:
+                posting.append(sequence_num)
+            else:
+                #   Messages usually arrive in sequence order. Anything else is placed with a binary search
+                position = bisect_left(posting, sequence_num)
+                if position < len(posting) and posting[position] == sequence_num:
+                    continue
+                posting.insert(position, sequence_num)
+            self.__num_postings += 1
+
+    def rebuild(self, documents) -> None:
+        """Rebuild the index in bulk from message documents
+
+        Args:
+            documents (Iterable[dict]): Message documents with 'message' and 'mess_props.sequence_num' fields
+        """
+        self.__postings = dict()
+        self.__vocabulary = list()
+        self.__num_postings = 0
+        grouped = dict()
+        for document in documents:
+            sequence_num = document['mess_props']['sequence_num']
+            for token in set(tokenize(document['message'])):
+                grouped.setdefault(token, []).append(sequence_num)
+
+        for token, sequence_nums in grouped.items():
+            sequence_nums.sort()
+            self.__postings[sys.intern(token)] = array('q', sequence_nums)
+            self.__num_postings += len(sequence_nums)
+        self.__vocabulary = sorted(self.__postings)
+        log(f"[+] Rebuilt search index for {self.__room_name}: {self.num_tokens} tokens, {self.__num_postings} postings")
+
+    def __expand(self, term: str) -> set:
+        """Return the sequence numbers matching one query term"""
+        if not term.endswith(PREFIX_MARKER):
+            return set(self.__postings.get(term, ()))
+
+        prefix = term[:-1]
+        matches = set()
+        position = bisect_left(self.__vocabulary, prefix)
+        for token in self.__vocabulary[position:position + SEARCH_MAX_PREFIX_EXPANSION]:
+            if not token.startswith(prefix):
+                break
+            matches.update(self.__postings[token])
+        return matches
+
+    def search(self, query: str, limit: int = SEARCH_RESULT_LIMIT) -> list:
+        """Find messages containing every term of the query
+
+        Args:
+            query (str): Space separated terms. A term ending in '*' is a prefix
+            limit (int, optional): Most results to return. Use GET_ALL_MESSAGES for every match. Defaults to
+            SEARCH_RESULT_LIMIT
+        Returns:
+            list: Matching sequence numbers, newest first
+        """
+        self.__last_used = time.monotonic()
+        terms = list()
+        for word in query.lower().split()[:SEARCH_MAX_TERMS]:
+            tokens = tokenize(word)
+            if len(tokens) == 0:
+                continue
+            terms.extend(tokens[:-1])
+            terms.append(tokens[-1] + PREFIX_MARKER if word.endswith(PREFIX_MARKER) else tokens[-1])
+        if len(terms) == 0:
+            return []
+
+        #   Intersect the smallest candidate sets first
+        candidates = sorted((self.__expand(term) for term in set(terms)), key=len)
+        matches = candidates[0]
+        for candidate in candidates[1:]:
+            if len(matches) == 0:
+                break
+            matches = matches & candidate
+        if limit == GET_ALL_MESSAGES:
+            return sorted(matches, reverse=True)
+        return heapq.nlargest(limit, matches)
@@ -4,15 +4,17 @@ __version__ = "2.0.0."
 __author__ = "Zac Foteff"
 
 from datetime import datetime
-from pymongo import MongoClient
+from pymongo import DeleteOne
 from src.chat_user import ChatUser
 from bin.logger import Logger
+from bin.db import get_client, get_database
 from bin.constants import *
 
 log = Logger("userList")
 
 class UserList:
-    """List of ChatUsers. Inherits from List class
+    """List of ChatUsers. Users are kept in a dictionary keyed by alias, which preserves registration
+    order and gives constant time lookups
     """
 
     def __init__(self, list_name: str = DB_DEFAULT_USER_LIST) -> None:
@@ -23,11 +25,13 @@ class UserList:
             list_name (str, optional): ID of the UserList. Defaults to DB_DEFAULT_USER_LIST.
         """
         
-        # PROD ONLY: self.__mongo_client = MongoClient(PROD_DB_HOST, PROD_DB_PORT)
-        self.__mongo_client = MongoClient(TEST_DB_HOST)
-        self.__mongo_db = self.__mongo_client.cpsc313
+        self.__mongo_client = get_client()
+        self.__mongo_db = get_database()
         self.__mongo_collection = self.__mongo_db.users
-        self.__user_list = list()
+        self.__users = dict()
+        self.__dirty_users = list()
+        self.__removed_users = list()
+        self.__alias_view = None
         self.__id = None
 
         if self.__restore():
@@ -49,7 +53,7 @@ class UserList:
 
     @property
     def user_list(self) -> list:
-        return self.__user_list
+        return list(self.__users.values())
 
     @property
     def dirty(self) -> bool:
@@ -65,25 +69,32 @@ class UserList:
         Second, for each user in the list create and save a document for that user
         """
         if self.__mongo_collection.find_one({'list_name': {'$exists': 'true'}}) is None:
-            self.__id = self.__mongo_collection.insert_one(self.metadata())
+            self.__id = self.__mongo_collection.insert_one(self.metadata()).inserted_id
             log("[+] Created UserList metadata in MongoDB")
         else:
             if self.dirty is True:
                 #   If the userlist has changes, store them in the MongoDB
-                list_update_filter = {'_id': self._id}
+                list_update_filter = {'list_name': self.list_name}
                 self.__mongo_collection.replace_one(list_update_filter, self.metadata(), upsert=True)
                 log("[+] Saved UserList metadata to MongoDB")
+        self.__dirty = False
 
-        for user in self.user_list:
-            if user.dirty:
-                if self.__mongo_collection.find_one({'alias': user.alias}) is None:
-                    user.user_id = self.__mongo_collection.insert_one(user.metadata())
-                else:
-                    user_update_filter = {'_id': user.user_id}
-                    self.__mongo_collection.update_one(user_update_filter, user.metadata(), upsert=True)
-    
-                log(f"[+] Saved user {user} to database")
-                user.dirty = False
+        if len(self.__removed_users) > 0:
+            self.__mongo_collection.bulk_write(self.__removed_users, ordered=False)
+            log(f"[-] Deleted {len(self.__removed_users)} deregistered users from the UserList collection")
+            self.__removed_users = list()
+
+        dirty_users = [user for user in self.__dirty_users if user.dirty]
+        self.__dirty_users = list()
+        for user in dirty_users:
+            if user.user_id is None:
+                user.user_id = self.__mongo_collection.insert_one(user.metadata()).inserted_id
+            else:
+                user_update_filter = {'_id': user.user_id}
+                self.__mongo_collection.update_one(user_update_filter, {'$set': user.metadata()}, upsert=True)
+
+            log("[+] Saved user %s to database", 'd', user)
+            user.dirty = False
 
         log("[+] Saved all users to UserList collection")
 
@@ -95,17 +106,20 @@ class UserList:
             log("[*] No metadata found for UserList object.", 'w')
             return False
             
+        self.__id = metadata['_id']
         self.__list_name = metadata['list_name']
         self.__create_time = metadata['create_time']
         self.__modify_time = metadata['modify_time']
         for user_dict in self.__mongo_collection.find({'alias': {'$exists': 'true'}}):
-            self.__user_list.append(ChatUser(
+            self.__users[user_dict['alias']] = ChatUser(
                                         alias=user_dict['alias'],
                                         user_id=user_dict['_id'],
                                         blocked_users=user_dict['blacklist'],
                                         create_time=user_dict['create_time'],
-                                        modify_time=user_dict['modify_time']))
-        log(f"[+] Restored UserList {self.to_dict()}")
+                                        modify_time=user_dict['modify_time'])
+        log(f"[+] Restored UserList {self.list_name}")
+        if log.enabled('d'):
+            log(f"[*] Restored UserList {self.to_dict()}", 'd')
         return True
 
     def register(self, new_alias: str) -> bool:
@@ -123,12 +137,35 @@ class UserList:
             return False
 
         new_user = ChatUser(new_alias)
-        self.__user_list.append(new_user)
+        self.__users[new_alias] = new_user
+        self.__dirty_users.append(new_user)
+        self.__alias_view = None
         self.__modify_time = datetime.now()
+        self.__dirty = True
         self.__persist()
         log(f"[+] {new_user} registered to UserList {self.list_name}")
         return True
 
+    def block_user(self, alias: str, block_alias: str) -> bool:
+        """Add block_alias to the blocked users of a registered user and save the change
+
+        Args:
+            alias (str): Alias of the user doing the blocking
+            block_alias (str): Alias of the user to block
+        Returns:
+            bool: Returns true if the user exists and the block was saved, false otherwise
+        """
+        user = self.get(alias)
+        if user is None:
+            log(f"[*] Target user {alias} is not in the UserList")
+            return False
+
+        user.block_user(block_alias)
+        if user.dirty:
+            self.__dirty_users.append(user)
+            self.__persist()
+        return True
+
     def deregister(self, alias) -> bool:
         """Deregister user from the UserList and mark them for removal. Method checks if the user exists, and then removes
         them from the list of users. 
@@ -141,8 +178,11 @@ class UserList:
         target_user = self.get(alias)
         if target_user is not None:
             target_user.removed = True
-            self.__user_list.remove(target_user)
+            del self.__users[alias]
+            self.__removed_users.append(DeleteOne({'alias': alias}))
+            self.__alias_view = None
             self.__modify_time = datetime.now()
+            self.__dirty = True
             self.__persist()
             log(f"[-] Target user {alias} deregistered from the UserList")
             return True
@@ -157,10 +197,7 @@ class UserList:
         Returns:
             bool: Return true if the user exists, false otherwise
         """
-        for user in self.__user_list:
-            if user.alias == alias: 
-                return True
-        return False
+        return alias in self.__users
 
     def get(self, target_alias: str) -> ChatUser | None:
         """Find a user using their alias in the UserList. Should 
@@ -172,18 +209,25 @@ class UserList:
             ChatUser: Returns the chat user found in the UserList. If nothing
             is found, None is returned
         """
-        for user in self.user_list:
-            if user.alias == target_alias:
-                return user
-        return None
+        return self.__users.get(target_alias)
 
-    def get_all_users(self) -> list:
-        """Returns a list of all user alias's in the UserList
+    def get_all_users(self) -> tuple:
+        """Returns all user alias's in the UserList, in registration order. The view is cached until the
+        next register or deregister, so repeated calls do not rebuild it. Prefer is_registered for
+        membership checks
 
         Returns:
-            list: List of users in the UserList
+            tuple: Read only view of the aliases in the UserList
         """
-        return [user.alias for user in self.user_list]
+        if self.__alias_view is None:
+            self.__alias_view = tuple(self.__users)
+        return self.__alias_view
+
+    def __contains__(self, alias: str) -> bool:
+        return alias in self.__users
+
+    def __len__(self) -> int:
+        return len(self.__users)
 
     def metadata(self) -> dict:
         """Dictionary of all necessary metadata for saving/restoring the object from Mongo"""
@@ -198,7 +242,7 @@ class UserList:
         return {
             "list_name": self.__list_name,
             "id": self.id,
-            "member_list": [user.to_dict() for user in self.__user_list],
+            "member_list": [user.to_dict() for user in self.__users.values()],
             "create_time": self.__create_time,
             "modify_time": self.__modify_time
         }
@@ -1,10 +1,14 @@
+import asyncio
+import json
 import random
+import threading
 import string
 import unittest
 import time
 from bin.logger import Logger
 from bin.constants import *
-from room_chat_api import app
+from room_chat_api import app, stream_room
+from starlette.requests import Request
 from fastapi.testclient import TestClient
 
 OWNER_ALIAS = "zfoteff"
@@ -102,3 +106,166 @@ class APITests(unittest.TestCase):
         self.assertIn(TEST_MESSAGE, get_response.json())
         elapsed_time = time.perf_counter() - start_time
         log(f"[+] Completed send, then get test in {elapsed_time}")
+
+    def test_get_direct_messages(self):
+        room_name = self.generate_random_string(10)
+        for to_alias in [TO_ALIAS, OWNER_ALIAS, TO_ALIAS]:
+            send_message_query_string = f"?room_name={room_name}&message=for {to_alias}&from_alias={FROM_ALIAS}&to_alias={to_alias}"
+            self.client.post("/message/" + send_message_query_string)
+        get_message_query_string = f"?alias={TO_ALIAS}&room_name={room_name}&direct_only=true"
+        get_response = self.client.get("/messages/" + get_message_query_string)
+        self.assertEqual(get_response.status_code, 200)
+        self.assertEqual(get_response.json(), [f"for {TO_ALIAS}", f"for {TO_ALIAS}"])
+
+    def test_search_messages(self):
+        room_name = self.generate_random_string(10)
+        for message in ["lunch at noon", "lunch moved to one", "dinner at six"]:
+            send_message_query_string = f"?room_name={room_name}&message={message}&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}"
+            self.client.post("/message/" + send_message_query_string)
+        search_response = self.client.get(f"/rooms/{room_name}/search?q=lunch at")
+        self.assertEqual(search_response.status_code, 200)
+        self.assertEqual([message['message'] for message in search_response.json()], ["lunch at noon"])
+        search_response = self.client.get(f"/rooms/{room_name}/search?q=lun*&limit=1")
+        self.assertEqual([message['message'] for message in search_response.json()], ["lunch moved to one"])
+
+    def test_send_message_batch(self):
+        room_names = [self.generate_random_string(10), self.generate_random_string(10)]
+        batch = [{'room_name': room_names[counter % 2], 'message': f"batch message {counter}",
+                  'from_alias': FROM_ALIAS, 'to_alias': TO_ALIAS} for counter in range(6)]
+        batch_response = self.client.post("/messages/batch", json=batch)
+        self.assertEqual(batch_response.status_code, 201)
+        results = batch_response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['sent'] * 6)
+        self.assertEqual([result['room_name'] for result in results[:2]], room_names)
+        first_room_sequence = [result['sequence_num'] for result in results[:6:2]]
+        self.assertEqual(first_room_sequence, sorted(first_room_sequence))
+        get_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_names[0]}")
+        self.assertEqual(get_response.json(), ["batch message 0", "batch message 2", "batch message 4"])
+        self.assertEqual(self.client.post("/messages/batch", json=[]).status_code, 422)
+
+    def test_send_message_rejected(self):
+        room_name = self.generate_random_string(10)
+        from_alias, to_alias = self.generate_random_string(10), self.generate_random_string(10)
+        self.client.post(f"/room/?room_name={room_name}&owner_alias={OWNER_ALIAS}&room_type={CHAT_ROOM_TYPE_PRIVATE}")
+        send_response = self.client.post(
+            f"/message/?room_name={room_name}&message=private&from_alias={from_alias}&to_alias={to_alias}")
+        self.assertEqual(send_response.status_code, 403)
+        batch = [{'room_name': room_name, 'message': "private", 'from_alias': from_alias, 'to_alias': to_alias}]
+        batch_response = self.client.post("/messages/batch", json=batch)
+        self.assertEqual(batch_response.status_code, 207)
+        self.assertEqual(batch_response.json()['results'][0]['status'], 'rejected')
+
+    def test_sync_after_seq(self):
+        room_name = self.generate_random_string(10)
+        for counter in range(3):
+            self.client.post(f"/message/?room_name={room_name}&message=sync {counter}&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+        first_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq=0")
+        self.assertEqual(first_response.json(), ["sync 0", "sync 1", "sync 2"])
+        high_water_mark = first_response.headers['X-High-Water-Mark']
+        self.assertEqual(first_response.headers['X-Next-After-Seq'], high_water_mark)
+        self.client.post(f"/message/?room_name={room_name}&message=sync 3&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+        sync_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq={high_water_mark}")
+        self.assertEqual(sync_response.json(), ["sync 3"])
+        self.assertGreater(int(sync_response.headers['X-High-Water-Mark']), int(high_water_mark))
+        empty_response = self.client.get(
+            f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq={sync_response.headers['X-High-Water-Mark']}")
+        self.assertEqual(empty_response.json(), [])
+        bad_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq=0&before_seq=5")
+        self.assertEqual(bad_response.status_code, 400)
+
+    def test_read_receipt(self):
+        room_name = self.generate_random_string(10)
+        for counter in range(3):
+            self.client.post(f"/message/?room_name={room_name}&message=receipt {counter}&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+        self.assertEqual(self.client.get(f"/rooms/{room_name}/receipts?alias={TO_ALIAS}").json()['unread'], 3)
+        self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}")
+        receipt = self.client.get(f"/rooms/{room_name}/receipts?alias={TO_ALIAS}").json()
+        self.assertEqual((receipt['unread'], receipt['read_seq']), (0, receipt['high_water_mark']))
+
+    def test_long_poll(self):
+        start_time = time.perf_counter()
+        room_name = self.generate_random_string(10)
+        self.client.post(f"/message/?room_name={room_name}&message=poll 0&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+        first_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq=0")
+        high_water_mark = first_response.headers['X-High-Water-Mark']
+        sender = threading.Timer(0.2, self.client.post, args=(
+            f"/message/?room_name={room_name}&message=poll 1&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}",))
+        sender.start()
+        poll_response = self.client.get(f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq={high_water_mark}&wait_seconds=10")
+        sender.join()
+        self.assertEqual(poll_response.json(), ["poll 1"])
+        timeout_response = self.client.get(
+            f"/messages/?alias={TO_ALIAS}&room_name={room_name}&after_seq={poll_response.headers['X-High-Water-Mark']}&wait_seconds=0.1")
+        self.assertEqual(timeout_response.json(), [])
+        elapsed_time = time.perf_counter() - start_time
+        self.assertLess(elapsed_time, 10)
+
+    def test_websocket_subscribe(self):
+        room_name = self.generate_random_string(10)
+        with self.client.websocket_connect(f"/ws?alias={TO_ALIAS}") as websocket:
+            websocket.send_text(json.dumps({'action': 'subscribe', 'room_name': room_name}))
+            self.assertEqual(websocket.receive_json()['type'], "subscribed")
+            self.client.post(f"/message/?room_name={room_name}&message=socket 0&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+            frame = websocket.receive_json()
+            self.assertEqual((frame['type'], frame['message']['message']), ("message", "socket 0"))
+            websocket.send_text(json.dumps({'action': 'send', 'room_name': room_name, 'message': "socket 1", 'to_alias': FROM_ALIAS}))
+            frames = [websocket.receive_json() for _ in range(2)]
+            self.assertEqual(sorted(frame['type'] for frame in frames), ["message", "sent"])
+            websocket.send_text("not json")
+            self.assertEqual(websocket.receive_json()['type'], "error")
+
+    def test_stream_room(self):
+        room_name = self.generate_random_string(10)
+        self.client.post(f"/message/?room_name={room_name}&message=stream 0&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}")
+        sender = threading.Timer(0.2, self.client.post, args=(
+            f"/message/?room_name={room_name}&message=stream 1&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}",))
+
+        #   The test client buffers whole responses, so the open ended stream is read from its body iterator
+        async def read_events() -> list:
+            request = Request({'type': 'http', 'headers': []}, receive=asyncio.Event().wait)
+            response = await stream_room(request, room_name, TO_ALIAS, after_seq=0)
+            self.assertEqual(response.media_type, "text/event-stream")
+            events = list()
+            try:
+                async for frame in response.body_iterator:
+                    events.extend(json.loads(line[len("data: "):])['message']
+                                  for line in frame.splitlines() if line.startswith("data: "))
+                    if len(events) == 2:
+                        break
+            finally:
+                await response.body_iterator.aclose()
+            return events
+
+        sender.start()
+        events = asyncio.run(asyncio.wait_for(read_events(), 10))
+        sender.join()
+        self.assertEqual(events, ["stream 0", "stream 1"])
+
+    def test_metrics(self):
+        room_name = self.generate_random_string(10)
+        send_message_query_string = f"?room_name={room_name}&message={TEST_MESSAGE}&from_alias={FROM_ALIAS}&to_alias={TO_ALIAS}"
+        self.client.post("/message/" + send_message_query_string)
+        self.client.get(f"/rooms/{room_name}/search?q=test")
+        self.client.get("/no/such/route")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('x-db-commands', response.headers)
+        self.assertTrue(response.headers['content-type'].startswith("text/plain"))
+        lines = response.text.splitlines()
+        #   Routes are labelled by their template, not by the path that was requested
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/rooms/{room_name}/search",status="200",le="+Inf"}',
+                      " ".join(lines))
+        self.assertNotIn(room_name, response.text)
+        self.assertTrue(any(line.startswith('http_request_duration_seconds_count{method="GET",route="unmatched",status="404"}') for line in lines))
+        self.assertTrue(any(line.startswith('http_requests_in_flight{method="GET",route="/metrics"} 1') for line in lines))
+        self.assertTrue(any(line.startswith('http_request_db_commands_count{method="POST",route="/message/"}') for line in lines))
+
+    def test_logger_stats(self):
+        response = self.client.get("/stats/logger/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'queued', 'dropped'})
+
+    def test_db_stats(self):
+        response = self.client.get("/stats/db/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'commands', 'failures', 'duration_ms'})
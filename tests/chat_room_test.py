@@ -7,8 +7,12 @@ import unittest
 import time
 import string
 import random
+from unittest import mock
+from pymongo.errors import PyMongoError
+from bin import db
 from bin.logger import Logger
 from bin.constants import *
+from bin.write_behind import close_write_behind_buffers
 from src.chat_message import ChatMessage
 from src.chat_room import ChatRoom
 
@@ -110,6 +114,316 @@ class ChatRoomTests(unittest.TestCase):
         elapsed_time = time.perf_counter() - start_time
         log(f"[+] Completed restore ChatRoom user list test in {elapsed_time:.5f} seconds")
 
+class PersistTests(unittest.TestCase):
+    """Test cases for incremental persistence of ChatRoom messages"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def test_put_clears_dirty_flags(self):
+        """Test that a put saves the new message and leaves no dirty messages behind"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for message in ["persist message 1", "persist message 2", "persist message 3"]:
+            room.send_message(message, FROM_ALIAS, TO_ALIAS)
+        self.assertFalse(room.dirty)
+        for message in room:
+            self.assertFalse(message.dirty)
+
+    def test_persist_without_changes(self):
+        """Test that persisting a room with no changes does not write anything"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        room.send_message("persist message", FROM_ALIAS, TO_ALIAS)
+        message = room.find_message("persist message")
+        message.mess_props.mess_type = MESSAGE_RECEIVED
+        room.persist()
+        restored_room = ChatRoom(room_name=room.room_name)
+        self.assertEqual(restored_room.find_message("persist message").mess_props.mess_type, MESSAGE_SENT)
+
+    def test_failed_write_is_retried(self):
+        """Test that messages whose write failed are written by the next persist"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS, write_behind=False)
+        collection_type = type(db.get_database().get_collection(DB_CHAT_ROOM_COLLECTION))
+        with mock.patch.object(collection_type, 'bulk_write', side_effect=PyMongoError("write failed")):
+            with self.assertRaises(PyMongoError):
+                room.send_message("retried message", FROM_ALIAS, TO_ALIAS)
+        self.assertTrue(room.find_message("retried message").dirty)
+        room.persist()
+        restored_room = ChatRoom(room_name=room.room_name)
+        self.assertIsNotNone(restored_room.find_message("retried message"))
+
+class BatchSendTests(unittest.TestCase):
+    """Test cases for sending a batch of messages"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def test_send_messages(self):
+        """Test that a batch gets increasing sequence numbers and reaches storage"""
+        room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        sequence_nums = room.send_messages([(f"batch message {counter}", FROM_ALIAS, TO_ALIAS) for counter in range(5)])
+        self.assertEqual(len(sequence_nums), 5)
+        self.assertEqual(sequence_nums, sorted(set(sequence_nums)))
+        self.assertTrue(room.member_list.is_registered(FROM_ALIAS))
+        restored = ChatRoom(room_name=room_name)
+        self.assertEqual(restored.get_messages(TO_ALIAS), [f"batch message {counter}" for counter in range(5)])
+        self.assertEqual(room.send_messages([]), [])
+
+    def test_send_saves_modify_time(self):
+        """Test that sending a message saves the room's new modify time"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        collection = db.get_database().get_collection(DB_CHAT_ROOM_COLLECTION)
+        created = collection.find_one({'room_name': room.room_name})['modify_time']
+        room.member_list.register(FROM_ALIAS)
+        room.member_list.register(TO_ALIAS)
+        room.send_message("modified", FROM_ALIAS, TO_ALIAS)
+        self.assertNotEqual(collection.find_one({'room_name': room.room_name})['modify_time'], created)
+
+class MessageIdentityTests(unittest.TestCase):
+    """Test cases for message ids derived from the room name and sequence number"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def test_identical_text_is_stored_twice(self):
+        """Test that two messages with the same text are kept as two separate messages"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        room.send_message("ok", FROM_ALIAS, TO_ALIAS)
+        room.send_message("ok", TO_ALIAS, FROM_ALIAS)
+        restored_room = ChatRoom(room_name=room.room_name)
+        self.assertEqual(restored_room.length, 2)
+        self.assertNotEqual(restored_room[0].message_id, restored_room[1].message_id)
+
+    def test_find_message_by_id(self):
+        """Test that a message can be found by its id in the deque and in storage"""
+        room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        room.send_message("find by id", FROM_ALIAS, TO_ALIAS)
+        message_id = room.find_message("find by id").message_id
+        self.assertIs(room.find_message_by_id(message_id), room.find_message("find by id"))
+        restored_room = ChatRoom(room_name=room.room_name)
+        self.assertEqual(restored_room.find_message_by_id(message_id).message, "find by id")
+        self.assertIsNone(restored_room.find_message_by_id(f"{room.room_name}:-2"))
+
+class HistoryTests(unittest.TestCase):
+    """Test cases for tail only restore and paging through older history"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=self.room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(10):
+            room.send_message(f"history message {counter}", FROM_ALIAS, TO_ALIAS)
+        return super().setUp()
+
+    def test_restore_newest_only(self):
+        """Test that a restored room only holds its newest messages"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=3)
+        self.assertEqual(room.length, 3)
+        self.assertEqual(room.get_messages(TO_ALIAS), ["history message 7", "history message 8", "history message 9"])
+
+    def test_page_through_history(self):
+        """Test that older messages can be paged through with a before_seq cursor"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=3)
+        pages = list()
+        before_seq = room[0].mess_props.sequence_num + 1
+        while True:
+            page = room.get_messages(TO_ALIAS, num_messages=4, return_objects=True, before_seq=before_seq)
+            if len(page) == 0:
+                break
+            pages.append([message.message for message in page])
+            before_seq = page[0].mess_props.sequence_num
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual(pages[-1], ["history message 0", "history message 1"])
+        self.assertEqual(room.length, 3)
+
+    def test_sync_after_seq(self):
+        """Test that after_seq returns only newer messages, including history older than the restored tail"""
+        for columnar_history in [False, True]:
+            room = ChatRoom(room_name=self.room_name, restore_limit=3, columnar_history=columnar_history)
+            high_water_mark = room.high_water_mark
+            self.assertEqual(high_water_mark, room[0].mess_props.sequence_num)
+            self.assertEqual(room.get_messages(TO_ALIAS, after_seq=high_water_mark), [])
+            self.assertEqual(room.get_messages(TO_ALIAS, after_seq=high_water_mark - 1), ["history message 9"])
+            messages = room.get_messages(TO_ALIAS, num_messages=4, after_seq=0)
+            self.assertEqual(messages, [f"history message {counter}" for counter in range(4)])
+            self.assertEqual(len(room.get_messages(TO_ALIAS, after_seq=0)), 10)
+
+    def test_columnar_history(self):
+        """Test that a room with a columnar history pages through it without querying MongoDB"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=3, columnar_history=True)
+        self.assertEqual(room.length, 3)
+        self.assertEqual(room.history.length, 7)
+        before_seq = room[0].mess_props.sequence_num + 1
+        messages = room.get_messages(TO_ALIAS, num_messages=5, before_seq=before_seq)
+        self.assertEqual(messages, [f"history message {counter}" for counter in range(5, 10)])
+
+class ReadPathTests(unittest.TestCase):
+    """Test cases for the generator based message read path"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room = ChatRoom(room_name=self.generate_random_string(10), room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(5):
+            self.room.send_message(f"read path message {counter}", FROM_ALIAS, TO_ALIAS)
+        return super().setUp()
+
+    def test_messages_read_from_the_right(self):
+        """Test that messages are returned oldest first, and a limit selects the newest messages"""
+        all_messages = self.room.get_messages(TO_ALIAS)
+        self.assertEqual(all_messages, [f"read path message {counter}" for counter in range(5)])
+        self.assertEqual(self.room.get_messages(TO_ALIAS, num_messages=2), ["read path message 3", "read path message 4"])
+
+    def test_put_while_reading(self):
+        """Test that a message put while the room is streamed does not break the read"""
+        messages = self.room.iter_messages(TO_ALIAS)
+        first_messages = [next(messages).message, next(messages).message]
+        self.room.send_message("read path late message", FROM_ALIAS, TO_ALIAS)
+        remaining_messages = [message.message for message in messages]
+        self.assertEqual(first_messages + remaining_messages, [f"read path message {counter}" for counter in range(5)])
+
+class BlockedUserTests(unittest.TestCase):
+    """Test cases for filtering messages from blocked users"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=self.room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(6):
+            sender = BLOCKED_ALIAS if counter % 2 == 0 else FROM_ALIAS
+            room.send_message(f"blocked test message {counter}", sender, TO_ALIAS)
+        room.member_list.block_user(TO_ALIAS, BLOCKED_ALIAS)
+        return super().setUp()
+
+    def test_blocked_messages_are_filtered(self):
+        """Test that messages from a blocked user are not returned"""
+        room = ChatRoom(room_name=self.room_name)
+        messages = room.get_messages(TO_ALIAS, return_objects=True)
+        self.assertEqual(len(messages), 3)
+        for message in messages:
+            self.assertNotEqual(message.mess_props.from_user, BLOCKED_ALIAS)
+
+    def test_blocked_filter_in_history_query(self):
+        """Test that paging through stored history skips blocked users without short pages"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=1)
+        before_seq = room[0].mess_props.sequence_num + 1
+        messages = room.get_messages(TO_ALIAS, num_messages=3, before_seq=before_seq)
+        self.assertEqual(messages, ["blocked test message 1", "blocked test message 3", "blocked test message 5"])
+
+class InboxTests(unittest.TestCase):
+    """Test cases for reading a user's direct messages through the inbox index"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=self.room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(9):
+            to_alias = TO_ALIAS if counter % 3 == 0 else OWNER_ALIAS
+            room.send_message(f"inbox message {counter}", FROM_ALIAS, to_alias)
+        return super().setUp()
+
+    def test_direct_messages(self):
+        """Test that direct_only returns only the messages sent to the requesting user"""
+        room = ChatRoom(room_name=self.room_name)
+        self.assertEqual(room.get_messages(TO_ALIAS, direct_only=True), ["inbox message 0", "inbox message 3", "inbox message 6"])
+        self.assertEqual(room.get_messages(TO_ALIAS, num_messages=1, direct_only=True), ["inbox message 6"])
+        room.send_message("inbox message 9", FROM_ALIAS, TO_ALIAS)
+        self.assertEqual(room.get_messages(TO_ALIAS, num_messages=2, direct_only=True), ["inbox message 6", "inbox message 9"])
+
+    def test_direct_messages_beyond_restored_tail(self):
+        """Test that direct messages older than the restored tail are read from storage"""
+        for columnar_history in [False, True]:
+            room = ChatRoom(room_name=self.room_name, restore_limit=2, columnar_history=columnar_history)
+            before_seq = room[0].mess_props.sequence_num + 1
+            messages = room.get_messages(TO_ALIAS, num_messages=2, before_seq=before_seq, direct_only=True)
+            self.assertEqual(messages, ["inbox message 3", "inbox message 6"])
+
+class SearchTests(unittest.TestCase):
+    """Test cases for full text search over the room history"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=self.room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(6):
+            sender = BLOCKED_ALIAS if counter % 2 == 0 else FROM_ALIAS
+            room.send_message(f"search message {counter}", sender, TO_ALIAS)
+        room.member_list.block_user(TO_ALIAS, BLOCKED_ALIAS)
+        return super().setUp()
+
+    def test_search_history(self):
+        """Test that search finds messages older than the restored tail and keeps the index up to date"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=2)
+        self.assertEqual([message.message for message in room.search("search message")],
+                         [f"search message {counter}" for counter in range(5, -1, -1)])
+        self.assertEqual([message.message for message in room.search("message 1")], ["search message 1"])
+        room.send_message("search message late", FROM_ALIAS, TO_ALIAS)
+        self.assertEqual([message.message for message in room.search("lat*")], ["search message late"])
+
+    def test_search_skips_blocked_users(self):
+        """Test that search leaves out blocked users' messages without returning a short page"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=2)
+        messages = room.search("search", limit=2, alias=TO_ALIAS)
+        self.assertEqual([message.message for message in messages], ["search message 5", "search message 3"])
+        self.assertTrue(room.release_search_index(idle_seconds=0))
+        self.assertIsNone(room.search_index)
+
+class ReceiptTests(unittest.TestCase):
+    """Test cases for read receipts"""
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def setUp(self) -> None:
+        self.room_name = self.generate_random_string(10)
+        room = ChatRoom(room_name=self.room_name, room_type=PUBLIC_ROOM_TYPE, owner_alias=OWNER_ALIAS)
+        for counter in range(6):
+            sender = BLOCKED_ALIAS if counter % 2 == 0 else FROM_ALIAS
+            room.send_message(f"receipt message {counter}", sender, TO_ALIAS)
+        room.member_list.block_user(TO_ALIAS, BLOCKED_ALIAS)
+        return super().setUp()
+
+    def test_read_cursor(self):
+        """Test that a read moves the reader's cursor, and the cursor drives unread counts and delivery status"""
+        room = ChatRoom(room_name=self.room_name, restore_limit=2)
+        columnar_room = ChatRoom(room_name=self.room_name, restore_limit=2, columnar_history=True)
+        self.assertEqual(room.unread_count(TO_ALIAS), 3)
+        self.assertEqual(columnar_room.unread_count(TO_ALIAS), 3)
+        #   Generating messages is not a completed read, so only get_messages (or mark_read) moves the cursor
+        self.assertEqual(len(list(room.iter_messages(TO_ALIAS, num_messages=1))), 1)
+        self.assertEqual(room.read_cursor(TO_ALIAS), 0)
+        self.assertEqual(room.get_messages(TO_ALIAS, num_messages=1), ["receipt message 5"])
+        newest = room.find_message("receipt message 5")
+        self.assertEqual(room.read_cursor(TO_ALIAS), newest.mess_props.sequence_num)
+        self.assertEqual(room.unread_count(TO_ALIAS), 0)
+        self.assertEqual(room.delivery_status(newest), MESSAGE_RECEIVED)
+        self.assertEqual(newest.mess_props.mess_type, MESSAGE_SENT)
+        self.assertFalse(newest.dirty)
+
+        close_write_behind_buffers()
+        restored_room = ChatRoom(room_name=self.room_name, restore_limit=2)
+        self.assertEqual(restored_room.read_cursor(TO_ALIAS), newest.mess_props.sequence_num)
+        self.assertEqual(restored_room.delivery_status(restored_room.find_message("receipt message 5")), MESSAGE_RECEIVED)
+        self.assertEqual(restored_room.read_cursor(FROM_ALIAS), 0)
+
 class MessageTests(unittest.TestCase):
     """Test cases for sending and recieving messages through the chat room"""
 
@@ -0,0 +1,64 @@
+"""Test suite for unit testing the MongoDB command monitor"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import asyncio
+from types import SimpleNamespace
+from bin.constants import *
+from bin.command_monitor import CommandMonitor, begin_request, end_request
+from bin.executor import KeyedExecutor
+
+
+
+def run_command(monitor: CommandMonitor, request_id: int, command: dict, reply: dict, duration_micros: int = 2000) -> None:
+    """Report one command to the monitor the way pymongo does, from the thread that sends it"""
+    command_name = next(iter(command))
+    started = SimpleNamespace(command_name=command_name, command=command, connection_id=("localhost", 27017), request_id=request_id)
+    monitor.started(started)
+    monitor.succeeded(SimpleNamespace(
+        command_name=command_name, reply=reply, connection_id=("localhost", 27017), request_id=request_id, duration_micros=duration_micros))
+
+
+class CommandMonitorTests(unittest.TestCase):
+    """Test cases for the CommandMonitor class object"""
+
+    def setUp(self) -> None:
+        self.monitor = CommandMonitor()
+        return super().setUp()
+
+    def test_commands_are_attributed_through_the_executor(self):
+        """Assert that commands sent from executor threads are counted against the request that ran them"""
+        executor = KeyedExecutor(max_workers=2)
+
+        def restore_room() -> None:
+            run_command(self.monitor, 1, {'find': DB_CHAT_ROOM_COLLECTION}, {'cursor': {'firstBatch': [{}, {}, {}]}})
+            run_command(self.monitor, 2, {'update': DB_CHAT_ROOM_COLLECTION}, {'n': 1})
+
+        async def request():
+            token = begin_request()
+            await executor.run("room:command_monitor", restore_room)
+            return end_request(token)
+
+        stats = asyncio.run(request())
+        executor.shutdown()
+        self.assertEqual((stats.commands, stats.documents, stats.failures), (2, 4, 0))
+        self.assertAlmostEqual(stats.duration_ms, 4.0)
+        self.assertEqual(stats.by_command, {('find', DB_CHAT_ROOM_COLLECTION): 1, ('update', DB_CHAT_ROOM_COLLECTION): 1})
+
+    def test_commands_outside_a_request_and_budget(self):
+        """Assert that commands outside a request only count in the totals, and that budgets are checked"""
+        run_command(self.monitor, 1, {'insert': DB_RECEIPT_COLLECTION}, {'n': 5})
+        self.assertEqual(self.monitor.stats()['commands'], 1)
+
+        token = begin_request()
+        for request_id in range(2, 8):
+            run_command(self.monitor, request_id, {'findAndModify': DB_SEQUENCE_COLLECTION}, {'value': {}}, duration_micros=1000)
+        stats = end_request(token)
+        self.assertEqual(self.monitor.stats()['commands'], 7)
+        self.assertEqual(stats.commands, 6)
+        self.assertTrue(stats.over_budget(max_commands=5, max_ms=0))
+        self.assertFalse(stats.over_budget(max_commands=0, max_ms=10))
+        self.assertTrue(stats.over_budget(max_commands=0, max_ms=5))
+        self.assertEqual(stats.summary(), f"findAndModify {DB_SEQUENCE_COLLECTION}: 6")
@@ -0,0 +1,105 @@
+"""Test suite for unit testing the RabbitMQ room consumer against the in-process broker"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import time
+from bin.constants import *
+from tests.local_broker import LocalBroker
+from src.chat_room import ChatRoom
+from src.consumer import RoomConsumer, dead_letter_queue, encode_send_request
+from src.room_registry import RoomRegistry
+
+ROOM_NAME = "zfoteff_consumer_tests"
+FROM_ALIAS = "Alice"
+TO_ALIAS = "Bob"
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class RoomConsumerTests(unittest.TestCase):
+    """Test cases for the RoomConsumer class object"""
+
+    def setUp(self) -> None:
+        self.broker = LocalBroker()
+        self.broker.declare_queue(ROOM_NAME)
+        self.registry = RoomRegistry()
+        return super().setUp()
+
+    def test_consume_persists_batches(self):
+        """Assert that queued requests are persisted in batches, in order, and acknowledged afterwards"""
+        for counter in range(250):
+            self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, ROOM_NAME, encode_send_request(f"queued {counter}", FROM_ALIAS, TO_ALIAS))
+        self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, ROOM_NAME, b"not a send request")
+        self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, ROOM_NAME, b'{"message": "bad alias", "from_alias": 7, "to_alias": "Bob"}')
+        self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, ROOM_NAME, encode_send_request("after the bad ones", FROM_ALIAS, TO_ALIAS))
+        consumer = RoomConsumer([ROOM_NAME], self.broker.connect, self.registry, prefetch_count=100, batch_size=50, max_wait_ms=10)
+        consumer.start()
+        try:
+            self.assertTrue(wait_for(lambda: consumer.stats()['persisted'] + consumer.stats()['rejected'] == 253))
+        finally:
+            consumer.stop()
+        stats = consumer.stats()
+        self.assertEqual((stats['persisted'], stats['rejected'], stats['failed_batches']), (251, 2, 0))
+        self.assertLessEqual(stats['batches'], 10)
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 0)
+        self.assertEqual(self.broker.get(dead_letter_queue(ROOM_NAME)), b"not a send request")
+        self.assertEqual(self.broker.queue_depth(dead_letter_queue(ROOM_NAME)), 1)
+
+        #   A room restored from storage sees every message, so they were durable when acknowledged
+        room = ChatRoom(room_name=ROOM_NAME, restore_limit=GET_ALL_MESSAGES)
+        messages = room.get_messages(TO_ALIAS, return_objects=True)
+        self.assertEqual(len(messages), 251)
+        self.assertEqual([message.message for message in messages[:3]], ["queued 0", "queued 1", "queued 2"])
+        sequence_nums = [message.mess_props.sequence_num for message in messages]
+        self.assertEqual(sequence_nums, sorted(sequence_nums))
+
+    def test_rejected_requests_are_dead_lettered(self):
+        """Assert that requests the private room rejects are moved to the dead letter queue, not dropped"""
+        self.broker.declare_queue(RMQ_PRIVATE_QUEUE)
+        room = self.registry.get(RMQ_PRIVATE_QUEUE, room_type=CHAT_ROOM_TYPE_PRIVATE, owner_alias=FROM_ALIAS)
+        room.member_list.register(FROM_ALIAS)
+        room.member_list.register(TO_ALIAS)
+        requests = [
+            encode_send_request("member message", FROM_ALIAS, TO_ALIAS),
+            encode_send_request("stranger message", "Mallory", TO_ALIAS)]
+        for body in requests:
+            self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, RMQ_PRIVATE_QUEUE, body)
+        consumer = RoomConsumer([RMQ_PRIVATE_QUEUE], self.broker.connect, self.registry, batch_size=10, max_wait_ms=10)
+        consumer.start()
+        try:
+            self.assertTrue(wait_for(lambda: consumer.stats()['persisted'] + consumer.stats()['rejected'] == 2))
+        finally:
+            consumer.stop()
+        self.assertEqual((consumer.stats()['persisted'], consumer.stats()['rejected']), (1, 1))
+        self.assertEqual(self.broker.queue_depth(RMQ_PRIVATE_QUEUE), 0)
+        self.assertEqual(self.broker.get(dead_letter_queue(RMQ_PRIVATE_QUEUE)), requests[1])
+
+    def test_prefetch_bounds_unacknowledged(self):
+        """Assert that the broker holds back deliveries beyond the prefetch window until a batch is acked"""
+        connection = self.broker.connect()
+        channel = connection.channel()
+        received = list()
+        channel.basic_qos(prefetch_count=10)
+        channel.basic_consume(ROOM_NAME, lambda ch, method, properties, body: received.append(method.delivery_tag))
+        for counter in range(25):
+            self.broker.route(RMQ_DEFAULT_PUBLIC_EXCHANGE, ROOM_NAME, encode_send_request(f"held {counter}", FROM_ALIAS, TO_ALIAS))
+        connection.ioloop.call_later(0.05, connection.ioloop.stop)
+        connection.ioloop.start()
+        self.assertEqual((len(received), channel.unacked, self.broker.queue_depth(ROOM_NAME)), (10, 10, 15))
+
+        channel.basic_ack(received[-1], multiple=True)
+        connection.ioloop.call_later(0.05, connection.ioloop.stop)
+        connection.ioloop.start()
+        self.assertEqual((len(received), channel.unacked), (20, 10))
+
+        connection.close()
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 15)
@@ -0,0 +1,78 @@
+"""Test suite for unit testing the shared MongoDB connection manager"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import mongomock
+from datetime import datetime
+from bin.constants import *
+from bin import db
+from src.chat_room import ChatRoom
+
+ROOM_NAME = "zfoteff_db_tests"
+
+
+class SharedClientTests(unittest.TestCase):
+    """Test cases for the process wide MongoClient"""
+
+    def setUp(self) -> None:
+        self.client = mongomock.MongoClient()
+        #   Keep the client other suites were using open, and put it back once the test is done
+        self.addCleanup(db.set_client, db.set_client(self.client, close_previous=False))
+        return super().setUp()
+
+    def test_get_client_is_shared(self):
+        """Assert that repeated calls hand out the same injected client"""
+        self.assertIs(db.get_client(), self.client)
+        self.assertIs(db.get_client(), db.get_client())
+
+    def test_models_use_shared_client(self):
+        """Assert that a ChatRoom and its UserList write through the injected client"""
+        room = ChatRoom(room_name=ROOM_NAME)
+        room.register_group_member("zfoteff")
+        self.assertIsNotNone(self.client[db.DB_NAME].rooms.find_one({'room_name': ROOM_NAME}))
+        self.assertIsNotNone(self.client[db.DB_NAME].users.find_one({'alias': "zfoteff"}))
+
+    def test_set_client_returns_previous(self):
+        """Assert that replacing the client hands back the one it replaced, left open on request"""
+        other_client = mongomock.MongoClient()
+        self.assertIs(db.set_client(other_client, close_previous=False), self.client)
+        self.assertIs(db.set_client(self.client), other_client)
+        self.assertIs(db.get_client(), self.client)
+
+    def test_close_client_resets(self):
+        """Assert that closing the client drops the shared instance"""
+        db.close_client()
+        self.assertIsNone(db._client)
+        db.set_client(self.client)
+        self.assertIs(db.get_client(), self.client)
+
+
+class LegacyDocumentTests(unittest.TestCase):
+    """Test cases for message documents written before sequence numbers were allocated per room"""
+
+    def setUp(self) -> None:
+        self.client = mongomock.MongoClient()
+        #   Keep the client other suites were using open, and put it back once the test is done
+        self.addCleanup(db.set_client, db.set_client(self.client, close_previous=False))
+        return super().setUp()
+
+    def test_legacy_documents_are_migrated(self):
+        """Assert that baseline message documents are rewritten to allocated sequence numbers and kept"""
+        collection = self.client[db.DB_NAME][DB_CHAT_ROOM_COLLECTION]
+        collection.insert_one({'room_name': ROOM_NAME, 'room_type': CHAT_ROOM_TYPE_PUBLIC, 'owner_alias': "zfoteff",
+                               'create_time': datetime.now(), 'modify_time': datetime.now()})
+        for counter, sequence_num in enumerate(({ROOM_NAME: 2}, -1, -1)):
+            collection.insert_one({'message': f"legacy message {counter}", 'mess_props': {
+                'mess_type': MESSAGE_SENT, 'room_name': ROOM_NAME, 'to_user': "Bob", 'from_user': "Alice",
+                'sequence_num': sequence_num, 'sent_time': datetime(2020, 1, 1, 0, 0, counter), 'rec_time': None}})
+        db.ensure_indexes()
+        self.assertEqual(db.migrate_legacy_messages(), 0)
+        self.assertEqual(sorted(document['_id'] for document in collection.find(db.MESSAGE_DOCUMENT_FILTER)),
+                         [f"{ROOM_NAME}:2", f"{ROOM_NAME}:3", f"{ROOM_NAME}:4"])
+        room = ChatRoom(room_name=ROOM_NAME, write_behind=False)
+        self.assertEqual(room.length, 3)
+        room.send_message("new message", "Alice", "Bob")
+        self.assertGreater(room.high_water_mark, 4)
+        self.assertEqual(ChatRoom(room_name=ROOM_NAME).get_messages("Bob"), ["legacy message 0", "legacy message 1", "legacy message 2", "new message"])
@@ -0,0 +1,96 @@
+"""Test suite for unit testing the keyed blocking call executor"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import asyncio
+import threading
+import time
+from bin.executor import KeyedExecutor
+
+CALL_SECONDS = 0.05
+
+
+class KeyedExecutorTests(unittest.TestCase):
+    """Test cases for the KeyedExecutor class object"""
+
+    def setUp(self) -> None:
+        self.executor = KeyedExecutor(max_workers=8)
+        self.active = dict()
+        self.overlaps = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        self.executor.shutdown()
+        return super().tearDown()
+
+    def blocking_call(self, key: str) -> str:
+        with self.lock:
+            self.active[key] = self.active.get(key, 0) + 1
+            if self.active[key] > 1:
+                self.overlaps += 1
+            self.peak = max(self.peak, sum(self.active.values()))
+        time.sleep(CALL_SECONDS)
+        with self.lock:
+            self.active[key] -= 1
+        return key
+
+    async def run_calls(self, keys: list) -> list:
+        return await asyncio.gather(*(self.executor.run(key, self.blocking_call, key) for key in keys))
+
+    def test_different_keys_run_in_parallel(self):
+        """Assert that calls for different keys overlap and the event loop is not blocked"""
+        start_time = time.perf_counter()
+        results = asyncio.run(self.run_calls([f"room:{counter}" for counter in range(8)]))
+        elapsed_time = time.perf_counter() - start_time
+        self.assertEqual(results, [f"room:{counter}" for counter in range(8)])
+        self.assertLess(elapsed_time, CALL_SECONDS * 4)
+
+    def test_workers_are_capped_by_the_connection_pool(self):
+        """Assert that no more calls run at once than the MongoDB connection pool can serve"""
+        start_time = time.perf_counter()
+        self.executor.shutdown()
+        self.executor = KeyedExecutor(max_workers=16, max_connections=4)
+        self.assertEqual(self.executor.max_workers, 4)
+        results = asyncio.run(self.run_calls([f"room:{counter}" for counter in range(8)]))
+        elapsed_time = time.perf_counter() - start_time
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.peak, 4)
+        self.assertGreaterEqual(elapsed_time, CALL_SECONDS * 2)
+
+    def test_same_key_is_serialised(self):
+        """Assert that calls for the same key never overlap"""
+        start_time = time.perf_counter()
+        results = asyncio.run(self.run_calls(["room:a"] * 4 + ["room:b"] * 4))
+        elapsed_time = time.perf_counter() - start_time
+        self.assertEqual(len(results), 8)
+        self.assertEqual(self.overlaps, 0)
+        self.assertGreaterEqual(elapsed_time, CALL_SECONDS * 4)
+        self.assertEqual(self.executor.stats()['completed'], 8)
+
+    def test_exceptions_reach_the_caller(self):
+        """Assert that an exception raised in the pool is raised to the awaiting caller"""
+
+        def failing_call():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(self.executor.run("room:a", failing_call))
+        self.assertEqual(self.executor.in_flight, 0)
+
+    def test_submit_is_serialised_with_run(self):
+        """Assert that a call queued with submit never overlaps calls run for the same key"""
+
+        async def run_and_submit():
+            calls = [self.executor.run("room:a", self.blocking_call, "room:a") for _ in range(2)]
+            running = asyncio.gather(*calls)
+            await asyncio.sleep(CALL_SECONDS / 2)
+            submitted = self.executor.submit("room:a", self.blocking_call, "room:a")
+            await running
+            return submitted.result(timeout=CALL_SECONDS * 10)
+
+        self.assertEqual(asyncio.run(run_and_submit()), "room:a")
+        self.assertEqual(self.overlaps, 0)
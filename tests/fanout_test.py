@@ -0,0 +1,98 @@
+"""Test suite for unit testing the WebSocket fan-out"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import asyncio
+import json
+from bin.constants import *
+from bin.fanout import RoomFanOut, Subscriber
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+
+ROOM_NAME = "zfoteff_fanout_tests"
+TO_ALIAS = "zfoteff_to"
+FROM_ALIAS = "zfoteff_from"
+BLOCKED_ALIAS = "zfoteff_blocked"
+
+
+def build_message(sequence_num: int, from_alias: str = FROM_ALIAS) -> ChatMessage:
+    return ChatMessage(f"fanout {sequence_num}", MessageProperties(MESSAGE_SENT, ROOM_NAME, TO_ALIAS, from_alias, sequence_num))
+
+
+class RoomFanOutTests(unittest.TestCase):
+    """Test cases for the RoomFanOut and Subscriber class objects"""
+
+    def setUp(self) -> None:
+        self.fanout = RoomFanOut()
+        return super().setUp()
+
+    def test_publish_encodes_each_message_once(self):
+        """Assert that every subscriber receives the same encoded frame, and blocked senders are skipped"""
+
+        async def publish():
+            subscribers = [Subscriber(f"user_{counter}") for counter in range(100)]
+            for subscriber in subscribers:
+                self.fanout.subscribe(subscriber, ROOM_NAME)
+            blocking = Subscriber(TO_ALIAS)
+            self.fanout.subscribe(blocking, ROOM_NAME, {BLOCKED_ALIAS})
+            #   Publish from a pool thread, the way ChatRoom does on the executor
+            await asyncio.to_thread(self.fanout.publish, ROOM_NAME, [build_message(1), build_message(2, BLOCKED_ALIAS)])
+            frames = [[await subscriber.next_frame() for _ in range(2)] for subscriber in subscribers]
+            return frames, await blocking.next_frame(), blocking.queued
+
+        frames, blocking_frame, blocking_queued = asyncio.run(publish())
+        self.assertTrue(all(frame[0] is frames[0][0] for frame in frames))
+        self.assertEqual([json.loads(frame)['message']['message'] for frame in frames[0]], ["fanout 1", "fanout 2"])
+        self.assertEqual(json.loads(blocking_frame)['message']['message'], "fanout 1")
+        self.assertEqual(blocking_queued, 0)
+        self.assertEqual(self.fanout.stats()['frames_encoded'], 2)
+
+    def test_slow_consumer_policies(self):
+        """Assert that a full queue drops frames and reports the gap, or closes the subscriber"""
+
+        async def overflow():
+            dropping = Subscriber(TO_ALIAS, max_frames=2, policy=WS_SLOW_CONSUMER_DROP)
+            disconnecting = Subscriber(TO_ALIAS, max_frames=2, policy=WS_SLOW_CONSUMER_DISCONNECT)
+            for subscriber in (dropping, disconnecting):
+                for counter in range(5):
+                    subscriber.offer(f"frame {counter}")
+            frames = [await dropping.next_frame() for _ in range(3)]
+            return frames, dropping.dropped, disconnecting.close_code, await disconnecting.next_frame()
+
+        frames, dropped, close_code, closed_frame = asyncio.run(overflow())
+        self.assertEqual(dropped, 3)
+        self.assertEqual(json.loads(frames[0]), {'type': 'lagged', 'dropped': 3})
+        self.assertEqual(frames[1:], ["frame 0", "frame 1"])
+        self.assertEqual(close_code, WS_CLOSE_SLOW_CONSUMER)
+        self.assertIsNone(closed_frame)
+
+    def test_unread_replies_close_the_subscriber(self):
+        """Assert that replies are queued past the message bound, up to max_replies, then the subscriber is closed"""
+
+        async def flood():
+            subscriber = Subscriber(TO_ALIAS, max_frames=2, max_replies=2)
+            queued = [subscriber.reply(f"reply {counter}") for counter in range(5)]
+            return queued, subscriber.close_code
+
+        queued, close_code = asyncio.run(flood())
+        self.assertEqual(queued, [True, True, True, True, False])
+        self.assertEqual(close_code, WS_CLOSE_POLICY_VIOLATION)
+
+    def test_unsubscribe(self):
+        """Assert that unsubscribing from every room removes the subscriber from the registry"""
+
+        async def subscribe():
+            subscriber = Subscriber(TO_ALIAS)
+            self.fanout.subscribe(subscriber, ROOM_NAME)
+            self.fanout.subscribe(subscriber, ROOM_NAME + "_other")
+            self.fanout.unsubscribe(subscriber, ROOM_NAME)
+            self.assertEqual(self.fanout.subscriber_count(ROOM_NAME), 0)
+            self.assertEqual(self.fanout.subscriber_count(ROOM_NAME + "_other"), 1)
+            self.fanout.unsubscribe(subscriber)
+
+        asyncio.run(subscribe())
+        self.assertEqual(self.fanout.stats()['subscribers'], 0)
+        self.assertEqual(self.fanout.publish(ROOM_NAME, [build_message(1)]), 0)
+
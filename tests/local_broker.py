@@ -0,0 +1,370 @@
+"""
+In-process stand-in for a RabbitMQ broker, for tests, benchmarks and local development without a broker.
+Connections speak the subset of pika's SelectConnection API the publisher and the consumer use, and run
+their callbacks on their own IOLoop, the way pika does
+"""
+
+__author__ = "Zac Foteff"
+__version__ = "1.0.0."
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from pika import spec
+from pika.exceptions import AMQPConnectionError, ConnectionClosedByClient
+from pika.frame import Method
+from bin.constants import *
+from bin.logger import Logger
+
+log = Logger("localBroker")
+
+
+class LocalIOLoop:
+    """Callback and timer loop with pika's IOLoop interface. start runs callbacks on the calling thread
+    until stop is called; add_callback_threadsafe and call_later may be called from any thread
+    """
+
+    def __init__(self) -> None:
+        self.__condition = threading.Condition()
+        self.__callbacks = deque()
+        self.__timers = list()
+        self.__counter = itertools.count()
+        self.__stopping = False
+
+    def add_callback_threadsafe(self, callback) -> None:
+        with self.__condition:
+            self.__callbacks.append(callback)
+            self.__condition.notify()
+
+    def call_later(self, delay: float, callback) -> None:
+        with self.__condition:
+            heapq.heappush(self.__timers, (time.monotonic() + delay, next(self.__counter), callback))
+            self.__condition.notify()
+
+    def stop(self) -> None:
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify()
+
+    def start(self) -> None:
+        while True:
+            with self.__condition:
+                while True:
+                    if self.__stopping:
+                        self.__stopping = False
+                        return
+                    now = time.monotonic()
+                    while len(self.__timers) > 0 and self.__timers[0][0] <= now:
+                        self.__callbacks.append(heapq.heappop(self.__timers)[2])
+                    if len(self.__callbacks) > 0:
+                        break
+                    self.__condition.wait(self.__timers[0][0] - now if len(self.__timers) > 0 else None)
+                ready, self.__callbacks = self.__callbacks, deque()
+            for callback in ready:
+                callback()
+
+
+class LocalChannel:
+    """Channel of a LocalConnection. Publisher confirms are sent confirm_latency_ms after the first
+    unconfirmed publish, as one Basic.Ack with multiple set that covers everything published until then,
+    which is how a broker acknowledges a stream of publishes
+    """
+
+    def __init__(self, connection, channel_number: int) -> None:
+        self.__connection = connection
+        self.__channel_number = channel_number
+        self.__ack_nack_callback = None
+        self.__delivery_tag = 0
+        self.__ack_scheduled = False
+        self.__is_open = True
+        self.__prefetch_count = 0
+        self.__consumers = dict()
+        self.__deliveries = 0
+        self.__unacked = dict()
+        self.__dispatch_scheduled = False
+
+    @property
+    def channel_number(self) -> int:
+        return self.__channel_number
+
+    @property
+    def is_open(self) -> bool:
+        return self.__is_open and self.__connection.is_open
+
+    def __reply(self, callback, method) -> None:
+        if callback is not None:
+            self.__connection.ioloop.add_callback_threadsafe(lambda: callback(Method(self.__channel_number, method)))
+
+    def confirm_delivery(self, ack_nack_callback, callback=None) -> None:
+        self.__ack_nack_callback = ack_nack_callback
+        self.__reply(callback, spec.Confirm.SelectOk())
+
+    def exchange_declare(self, exchange: str, exchange_type: str = "direct", durable: bool = False, callback=None, **kwargs) -> None:
+        self.__connection.broker.declare_exchange(exchange, exchange_type)
+        self.__reply(callback, spec.Exchange.DeclareOk())
+
+    def queue_declare(self, queue: str, durable: bool = False, callback=None, **kwargs) -> None:
+        self.__connection.broker.declare_queue(queue)
+        self.__reply(callback, spec.Queue.DeclareOk(queue=queue))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str = None, callback=None, **kwargs) -> None:
+        self.__connection.broker.bind(queue, exchange, routing_key or queue)
+        self.__reply(callback, spec.Queue.BindOk())
+
+    def basic_qos(self, prefetch_count: int = 0, callback=None, **kwargs) -> None:
+        self.__prefetch_count = prefetch_count
+        self.__reply(callback, spec.Basic.QosOk())
+
+    def basic_consume(self, queue: str, on_message_callback, auto_ack: bool = False, callback=None, **kwargs) -> str:
+        consumer_tag = f"ctag{self.__channel_number}.{len(self.__consumers) + 1}"
+        self.__consumers[consumer_tag] = (queue, on_message_callback, auto_ack)
+        self.__connection.broker.add_consumer(queue, self)
+        self.__reply(callback, spec.Basic.ConsumeOk(consumer_tag=consumer_tag))
+        self.schedule_dispatch()
+        return consumer_tag
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        self.__settle(delivery_tag, multiple)
+        self.schedule_dispatch()
+
+    def basic_nack(self, delivery_tag: int = 0, multiple: bool = False, requeue: bool = True) -> None:
+        settled = self.__settle(delivery_tag, multiple)
+        if requeue:
+            for queue, message in reversed(settled):
+                self.__connection.broker.requeue(queue, message)
+        self.schedule_dispatch()
+
+    def __settle(self, delivery_tag: int, multiple: bool) -> list:
+        if not multiple and delivery_tag not in self.__unacked:
+            raise ValueError(f"Unknown delivery tag {delivery_tag}")
+        tags = [tag for tag in self.__unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        return [self.__unacked.pop(tag) for tag in tags]
+
+    @property
+    def unacked(self) -> int:
+        return len(self.__unacked)
+
+    def schedule_dispatch(self) -> None:
+        """Ask the channel's IOLoop to deliver waiting messages to its consumers. Safe from any thread"""
+        if not self.__dispatch_scheduled and self.is_open:
+            self.__dispatch_scheduled = True
+            self.__connection.ioloop.add_callback_threadsafe(self.__dispatch)
+
+    def __dispatch(self) -> None:
+        """Deliver messages up to the prefetch limit. Runs on the IOLoop"""
+        self.__dispatch_scheduled = False
+        broker = self.__connection.broker
+        for consumer_tag, (queue, on_message_callback, auto_ack) in list(self.__consumers.items()):
+            while self.is_open and (self.__prefetch_count == 0 or len(self.__unacked) < self.__prefetch_count):
+                message = broker.take(queue)
+                if message is None:
+                    break
+                exchange, routing_key, body, properties, redelivered = message
+                self.__deliveries += 1
+                if not auto_ack:
+                    self.__unacked[self.__deliveries] = (queue, message)
+                method = spec.Basic.Deliver(consumer_tag, self.__deliveries, redelivered, exchange, routing_key)
+                on_message_callback(self, method, properties or spec.BasicProperties(), body)
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, properties=None, mandatory: bool = False) -> None:
+        if not self.is_open:
+            raise RuntimeError(f"Channel {self.__channel_number} is closed")
+        if not self.__connection.broker.nacking:
+            self.__connection.broker.route(exchange, routing_key, body, properties)
+        if self.__ack_nack_callback is None:
+            return
+        self.__delivery_tag += 1
+        if not self.__ack_scheduled:
+            self.__ack_scheduled = True
+            self.__connection.ioloop.call_later(self.__connection.broker.confirm_latency, self.__acknowledge)
+
+    def __acknowledge(self) -> None:
+        self.__ack_scheduled = False
+        self.__connection.broker.count_ack()
+        if self.__is_open:
+            confirm = spec.Basic.Nack if self.__connection.broker.nacking else spec.Basic.Ack
+            self.__ack_nack_callback(Method(self.__channel_number, confirm(delivery_tag=self.__delivery_tag, multiple=True)))
+
+    def close(self) -> None:
+        self.__is_open = False
+        #   Unacknowledged deliveries go back to their queues, as they do when a channel to RabbitMQ closes
+        for queue, message in reversed(list(self.__unacked.values())):
+            self.__connection.broker.requeue(queue, message)
+        self.__unacked = dict()
+
+
+class LocalConnection:
+    """Connection to a LocalBroker with the callbacks and IOLoop of a pika SelectConnection"""
+
+    def __init__(
+            self,
+            broker,
+            on_open_callback=None,
+            on_open_error_callback=None,
+            on_close_callback=None,
+            refused: bool = False) -> None:
+        self.__broker = broker
+        self.__on_close_callback = on_close_callback
+        self.__channels = list()
+        self.__is_open = not refused
+        self.ioloop = LocalIOLoop()
+        if refused:
+            if on_open_error_callback is not None:
+                error = AMQPConnectionError("Connection refused")
+                self.ioloop.add_callback_threadsafe(lambda: on_open_error_callback(self, error))
+        elif on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(self))
+
+    @property
+    def broker(self):
+        return self.__broker
+
+    @property
+    def is_open(self) -> bool:
+        return self.__is_open
+
+    @property
+    def is_closed(self) -> bool:
+        return not self.__is_open
+
+    def channel(self, channel_number: int = None, on_open_callback=None) -> LocalChannel:
+        channel = LocalChannel(self, channel_number or len(self.__channels) + 1)
+        self.__channels.append(channel)
+        if on_open_callback is not None:
+            self.ioloop.add_callback_threadsafe(lambda: on_open_callback(channel))
+        return channel
+
+    def close(self, reply_code: int = 200, reply_text: str = "Normal shutdown") -> None:
+        if not self.__is_open:
+            return
+        self.__is_open = False
+        for channel in self.__channels:
+            channel.close()
+        if self.__on_close_callback is not None:
+            reason = ConnectionClosedByClient(reply_code, reply_text)
+            self.ioloop.add_callback_threadsafe(lambda: self.__on_close_callback(self, reason))
+
+
+class LocalBroker:
+    """Exchanges and queues held in memory. Supports the default exchange (routes to the queue named by
+    the routing key), fanout exchanges and direct exchanges. Messages routed to no queue are dropped, as
+    RabbitMQ drops them
+    """
+
+    def __init__(self, confirm_latency_ms: float = 0.0) -> None:
+        """Instantiate an empty LocalBroker
+
+        Args:
+            confirm_latency_ms (float, optional): Simulated round trip before a publish is confirmed. Defaults to 0
+        """
+        self.__lock = threading.Lock()
+        self.__confirm_latency = confirm_latency_ms / 1000
+        self.__exchanges = {RMQ_DEFAULT_PUBLIC_EXCHANGE: ("direct", dict())}
+        self.__queues = dict()
+        self.__consumers = dict()
+        self.__published = 0
+        self.__acks = 0
+        self.__declares = 0
+        self.__connections = 0
+        self.available = True
+        self.nacking = False
+
+    @property
+    def confirm_latency(self) -> float:
+        return self.__confirm_latency
+
+    def connect(self, on_open_callback=None, on_open_error_callback=None, on_close_callback=None) -> LocalConnection:
+        """Open a connection. Has the signature of the connection factories RoomPublisher takes. While
+        available is False the connection is refused, through on_open_error_callback. While nacking is True
+        publishes are not routed and are confirmed with a Basic.Nack
+
+        Returns:
+            LocalConnection: New connection
+        """
+        with self.__lock:
+            self.__connections += 1
+        return LocalConnection(self, on_open_callback, on_open_error_callback, on_close_callback, refused=not self.available)
+
+    def declare_exchange(self, exchange: str, exchange_type: str) -> None:
+        with self.__lock:
+            self.__declares += 1
+            self.__exchanges.setdefault(exchange, (str(exchange_type), dict()))
+
+    def declare_queue(self, queue: str) -> None:
+        with self.__lock:
+            self.__queues.setdefault(queue, deque())
+
+    def bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        with self.__lock:
+            self.__exchanges[exchange][1].setdefault(routing_key, set()).add(queue)
+
+    def route(self, exchange: str, routing_key: str, body: bytes, properties=None) -> int:
+        """Deliver a published message to the queues its exchange routes it to
+
+        Returns:
+            int: Number of queues the message was delivered to
+        Raises:
+            ValueError: If the exchange has not been declared
+        """
+        with self.__lock:
+            if exchange not in self.__exchanges:
+                raise ValueError(f"No exchange named {exchange}")
+            self.__published += 1
+            exchange_type, bindings = self.__exchanges[exchange]
+            if exchange == RMQ_DEFAULT_PUBLIC_EXCHANGE:
+                queues = {routing_key} if routing_key in self.__queues else set()
+            elif exchange_type == "fanout":
+                queues = set().union(*bindings.values())
+            else:
+                queues = bindings.get(routing_key, set())
+            for queue in queues:
+                self.__queues[queue].append((exchange, routing_key, body, properties, False))
+            consumers = [channel for queue in queues for channel in self.__consumers.get(queue, ())]
+        for channel in consumers:
+            channel.schedule_dispatch()
+        return len(queues)
+
+    def add_consumer(self, queue: str, channel: LocalChannel) -> None:
+        with self.__lock:
+            self.__consumers.setdefault(queue, list()).append(channel)
+
+    def take(self, queue: str) -> tuple | None:
+        """Remove the oldest message of a queue for delivery, or return None if the queue is empty"""
+        with self.__lock:
+            messages = self.__queues.get(queue)
+            return messages.popleft() if messages else None
+
+    def requeue(self, queue: str, message: tuple) -> None:
+        """Put an unacknowledged message back at the head of its queue, marked as redelivered"""
+        with self.__lock:
+            self.__queues[queue].appendleft(message[:4] + (True,))
+            consumers = [channel for channel in self.__consumers.get(queue, ()) if channel.is_open]
+        for channel in consumers:
+            channel.schedule_dispatch()
+
+    def count_ack(self) -> None:
+        with self.__lock:
+            self.__acks += 1
+
+    def queue_depth(self, queue: str) -> int:
+        with self.__lock:
+            return len(self.__queues.get(queue, ()))
+
+    def get(self, queue: str) -> bytes | None:
+        """Take the oldest message body from a queue, or None if it is empty"""
+        with self.__lock:
+            messages = self.__queues.get(queue)
+            return messages.popleft()[2] if messages else None
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                'exchanges': len(self.__exchanges),
+                'queues': len(self.__queues),
+                'published': self.__published,
+                'acks': self.__acks,
+                'declares': self.__declares,
+                'connections': self.__connections
+            }
@@ -0,0 +1,72 @@
+"""Test suite for unit testing the queued Logger"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import os
+import time
+from bin.constants import *
+from bin.logger import Logger, log_stats
+
+LOG_KEY = "zfoteff_logger_tests"
+
+
+class CountingValue:
+    """Counts how often it is formatted"""
+
+    def __init__(self) -> None:
+        self.formatted = 0
+
+    def __str__(self) -> str:
+        self.formatted += 1
+        return "counted value"
+
+
+def wait_for_listener(timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while log_stats()['queued'] > 0:
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    #   The listener has taken the last record off the queue, give it time to write it
+    time.sleep(0.05)
+    return True
+
+
+class LoggerTests(unittest.TestCase):
+    """Test cases for the Logger class object"""
+
+    def setUp(self) -> None:
+        self.log = Logger(LOG_KEY)
+        return super().setUp()
+
+    def test_records_are_written_by_listener(self):
+        """Assert that logged records reach the logger's file in the log directory"""
+        start_time = time.perf_counter()
+        self.log("[+] Written by the listener %s", 'i', 42)
+        self.assertTrue(wait_for_listener())
+        with open(os.path.join(LOG_DIR, f"{LOG_KEY}.log")) as log_file:
+            self.assertIn("[+] Written by the listener 42", log_file.read())
+        elapsed_time = time.perf_counter() - start_time
+        self.log(f"[+] Completed records are written by listener test in {elapsed_time:.5f}")
+
+    def test_filtered_arguments_are_not_formatted(self):
+        """Assert that arguments of messages below the level are never formatted"""
+        start_time = time.perf_counter()
+        value = CountingValue()
+        self.log.log_obj.setLevel("INFO")
+        #   The test runner's capture handler on the root logger would format the record as well
+        self.log.log_obj.propagate = False
+        self.addCleanup(setattr, self.log.log_obj, 'propagate', True)
+        self.assertFalse(self.log.enabled('d'))
+        self.log("[*] Suppressed %s", 'd', value)
+        self.assertTrue(wait_for_listener())
+        self.assertEqual(value.formatted, 0)
+        self.log("[*] Logged %s", 'i', value)
+        #   Formatted once, on the calling thread, before the record is queued
+        self.assertEqual(value.formatted, 1)
+        self.assertTrue(wait_for_listener())
+        self.assertEqual(value.formatted, 1)
+        elapsed_time = time.perf_counter() - start_time
+        self.log(f"[+] Completed filtered arguments are not formatted test in {elapsed_time:.5f}")
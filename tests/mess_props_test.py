@@ -5,6 +5,7 @@ __author__ = "Zac Foteff"
 
 import unittest
 import time
+from datetime import datetime
 from bin.logger import Logger
 from bin.constants import *
 from src.message_props import MessageProperties
@@ -47,3 +48,26 @@ class MessagePropertiesTests(unittest.TestCase):
         log(mess_prop_2, 'd')
         elapsed_time = time.perf_counter() - start_time
         log(f"[+] Completed identical instances test in {elapsed_time:.5f}")
+
+    def test_times_round_trip(self):
+        """Assert that times given as datetimes or stored strings come back as the same datetime"""
+        sent_time = datetime(2022, 4, 1, 12, 30, 15, 250)
+        mess_prop = MessageProperties(MESSAGE_SENT, self.TEST_ROOM, "u1", "u2", 1, sent_time)
+        self.assertEqual(mess_prop.sent_time, sent_time)
+        self.assertEqual(mess_prop.sent_timestamp, sent_time.timestamp())
+        self.assertIsNone(mess_prop.rec_time)
+        self.assertIsNone(mess_prop.rec_timestamp)
+        stored = mess_prop.to_dict()
+        restored = MessageProperties(MESSAGE_SENT, self.TEST_ROOM, "u1", "u2", 1, stored['sent_time'], stored['rec_time'])
+        self.assertEqual(restored.sent_time, sent_time)
+        self.assertIsNone(restored.rec_time)
+        restored.rec_time = sent_time
+        self.assertEqual(restored.rec_time, sent_time)
+
+    def test_compact_instances(self):
+        """Assert that instances carry no __dict__ and share interned alias and room name strings"""
+        mess_prop_1 = MessageProperties(MESSAGE_SENT, "".join(["zfoteff", "_test"]), "u1", "".join(["u", "2"]))
+        mess_prop_2 = MessageProperties(MESSAGE_SENT, "".join(["zfoteff", "_test"]), "u1", "".join(["u", "2"]))
+        self.assertFalse(hasattr(mess_prop_1, '__dict__'))
+        self.assertIs(mess_prop_1.room_name, mess_prop_2.room_name)
+        self.assertIs(mess_prop_1.from_user, mess_prop_2.from_user)
@@ -0,0 +1,80 @@
+"""Test suite for unit testing the ColumnarMessageStore class"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import time
+from bin.constants import *
+from src.chat_message import ChatMessage
+from src.message_props import MessageProperties
+from src.message_store import ColumnarMessageStore, StoredMessage
+
+ROOM_NAME = "zfoteff_message_store_tests"
+FROM_ALIAS = "Alice"
+TO_ALIAS = "Bob"
+BLOCKED_ALIAS = "Eve"
+START_TIME = 1_650_000_000.0
+
+
+class ColumnarMessageStoreTests(unittest.TestCase):
+    """Test cases for ColumnarMessageStore class object"""
+
+    def setUp(self) -> None:
+        self.store = ColumnarMessageStore(ROOM_NAME)
+        for sequence_num in range(10):
+            sender = BLOCKED_ALIAS if sequence_num % 2 == 0 else FROM_ALIAS
+            mess_props = MessageProperties(MESSAGE_SENT, ROOM_NAME, TO_ALIAS, sender, sequence_num, START_TIME + sequence_num)
+            self.store.append(ChatMessage(f"store message {sequence_num} ✓", mess_props))
+        return super().setUp()
+
+    def test_message_round_trip(self):
+        """Test that a stored message is rebuilt with the same fields"""
+        message = self.store.message_at(3)
+        self.assertEqual(self.store.length, 10)
+        self.assertEqual(message.message, "store message 3 ✓")
+        self.assertEqual(message.mess_props.from_user, FROM_ALIAS)
+        self.assertEqual(message.mess_props.to_user, TO_ALIAS)
+        self.assertEqual(message.mess_props.sequence_num, 3)
+        self.assertEqual(message.mess_props.sent_timestamp, START_TIME + 3)
+        self.assertIsNone(message.mess_props.rec_time)
+        self.assertFalse(message.dirty)
+        self.assertTrue(self.store.set_received(3, START_TIME + 20))
+        self.assertEqual(self.store.message_at(3).mess_props.rec_timestamp, START_TIME + 20)
+        self.assertFalse(self.store.set_received(42, START_TIME + 20))
+
+    def test_missing_sent_time(self):
+        """Test that a message stored without a sent time is rebuilt without one"""
+        mess_props = MessageProperties(MESSAGE_SENT, ROOM_NAME, TO_ALIAS, FROM_ALIAS, 10, default_sent_time=False)
+        self.store.append(ChatMessage("no sent time", mess_props))
+        self.assertIsNone(self.store.message_at(10).mess_props.sent_timestamp)
+        self.assertIsNone(self.store.view_at(10).mess_props.sent_time)
+
+    def test_select(self):
+        """Test that select pages newest first and skips excluded senders"""
+        messages = self.store.select(before_seq=8, limit=3)
+        self.assertEqual([message.mess_props.sequence_num for message in messages], [7, 6, 5])
+        messages = self.store.select(limit=3, exclude_senders=frozenset([BLOCKED_ALIAS]))
+        self.assertEqual([message.mess_props.sequence_num for message in messages], [9, 7, 5])
+        self.assertEqual(len(self.store.select()), 10)
+        self.assertEqual(len(self.store.select(to_user=TO_ALIAS, exclude_senders=frozenset([BLOCKED_ALIAS]))), 5)
+        self.assertEqual(self.store.select(to_user="nobody"), [])
+        self.assertIsInstance(messages[0], StoredMessage)
+        self.assertEqual(messages[0].to_message().to_dict(), self.store.message_at(9).to_dict())
+
+    def test_time_range_and_count(self):
+        """Test that time range slicing and counting match the stored sent times"""
+        start_time = time.perf_counter()
+        messages = list(self.store.time_range(START_TIME + 2, START_TIME + 5))
+        self.assertEqual([message.mess_props.sequence_num for message in messages], [2, 3, 4])
+        self.assertEqual(self.store.count(), 10)
+        self.assertEqual(self.store.count(from_user=FROM_ALIAS), 5)
+        self.assertEqual(self.store.count(start_time=START_TIME + 5), 5)
+        self.assertEqual(self.store.count(from_user=BLOCKED_ALIAS, end_time=START_TIME + 5), 3)
+        self.assertEqual(self.store.count(from_user="nobody"), 0)
+
+    def test_out_of_order_append(self):
+        """Test that appending an older message is rejected"""
+        mess_props = MessageProperties(MESSAGE_SENT, ROOM_NAME, TO_ALIAS, FROM_ALIAS, 4)
+        with self.assertRaises(ValueError):
+            self.store.append(ChatMessage("late message", mess_props))
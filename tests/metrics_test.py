@@ -0,0 +1,39 @@
+"""Test suite for unit testing the request metrics"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+from bin.constants import *
+from bin.metrics import RequestMetrics
+
+ROUTE = "/rooms/{room_name}/search"
+
+
+class RequestMetricsTests(unittest.TestCase):
+    """Test cases for the RequestMetrics class object"""
+
+    def setUp(self) -> None:
+        self.metrics = RequestMetrics(buckets=(0.01, 0.1, 1))
+        return super().setUp()
+
+    def test_histogram_buckets_are_cumulative(self):
+        """Assert that observations land in the first bucket that holds them, and render cumulatively"""
+        for duration in (0.005, 0.01, 0.05, 0.5, 5):
+            self.metrics.start("GET", ROUTE)
+            self.metrics.finish("GET", ROUTE, 200, duration)
+        counts, total, count = self.metrics.snapshot()['histograms'][("GET", ROUTE, 200)]
+        self.assertEqual(counts, [2, 3, 4, 5])
+        self.assertAlmostEqual(total, 5.565)
+        self.assertEqual(count, 5)
+        rendered = self.metrics.render()
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/rooms/{room_name}/search",status="200",le="0.1"} 3', rendered)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/rooms/{room_name}/search",status="200",le="+Inf"} 5', rendered)
+
+    def test_in_flight_gauge(self):
+        """Assert that the in-flight gauge counts started requests until they finish"""
+        self.metrics.start("POST", "/message/")
+        self.metrics.start("POST", "/message/")
+        self.metrics.finish("POST", "/message/", 201, 0.002)
+        self.assertEqual(self.metrics.snapshot()['in_flight'][("POST", "/message/")], 1)
+        self.assertIn('http_requests_in_flight{method="POST",route="/message/"} 1', self.metrics.render())
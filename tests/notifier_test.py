@@ -0,0 +1,66 @@
+"""Test suite for unit testing the room notifier"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import asyncio
+import threading
+import time
+from bin.notifier import RoomNotifier
+
+ROOM_NAME = "zfoteff_notifier_tests"
+
+
+class RoomNotifierTests(unittest.TestCase):
+    """Test cases for the RoomNotifier class object"""
+
+    def setUp(self) -> None:
+        self.notifier = RoomNotifier()
+        return super().setUp()
+
+    def test_notify_wakes_every_waiter(self):
+        """Assert that one notification from another thread wakes every waiter on the room"""
+        start_time = time.perf_counter()
+
+        async def wait_for_message():
+            waiters = [self.notifier.wait(ROOM_NAME, 0, 5) for _ in range(10)]
+            threading.Timer(0.05, self.notifier.notify, args=(ROOM_NAME, 3)).start()
+            return await asyncio.gather(*waiters)
+
+        self.assertEqual(asyncio.run(wait_for_message()), [3] * 10)
+        self.assertEqual(self.notifier.stats()['waiters'], 0)
+        elapsed_time = time.perf_counter() - start_time
+        self.assertLess(elapsed_time, 5)
+
+    def test_wait_returns_at_once_when_behind(self):
+        """Assert that a waiter whose cursor is behind the high-water mark does not wait"""
+        start_time = time.perf_counter()
+        self.notifier.notify(ROOM_NAME, 7)
+        self.notifier.notify(ROOM_NAME, 5)
+        self.assertEqual(self.notifier.high_water_mark(ROOM_NAME), 7)
+        self.assertEqual(asyncio.run(self.notifier.wait(ROOM_NAME, 6, 5)), 7)
+        elapsed_time = time.perf_counter() - start_time
+        self.assertLess(elapsed_time, 1)
+
+    def test_wait_times_out(self):
+        """Assert that a wait with no notification returns the unchanged high-water mark after the timeout"""
+        self.assertEqual(asyncio.run(self.notifier.wait(ROOM_NAME, 0, 0.05)), 0)
+        self.assertEqual(self.notifier.stats()['waiters'], 0)
+
+    def test_forget_drops_idle_rooms(self):
+        """Assert that forgetting a room drops its high-water mark unless coroutines are waiting on it"""
+        self.notifier.notify(ROOM_NAME, 4)
+        self.assertTrue(self.notifier.forget(ROOM_NAME))
+        self.assertEqual(self.notifier.stats()['rooms'], 0)
+        self.assertEqual(self.notifier.high_water_mark(ROOM_NAME), 0)
+
+        async def forget_while_waiting():
+            self.notifier.notify(ROOM_NAME, 4)
+            waiter = asyncio.ensure_future(self.notifier.wait(ROOM_NAME, 4, 5))
+            await asyncio.sleep(0.01)
+            forgotten = self.notifier.forget(ROOM_NAME)
+            self.notifier.notify(ROOM_NAME, 5)
+            return forgotten, await waiter
+
+        self.assertEqual(asyncio.run(forget_while_waiting()), (False, 5))
@@ -0,0 +1,104 @@
+"""Test suite for unit testing the RabbitMQ room publisher against the in-process broker"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import json
+import time
+from bin.constants import *
+from tests.local_broker import LocalBroker
+from bin.publisher import RoomPublisher, room_exchange, set_room_publisher
+from src.chat_room import ChatRoom
+
+ROOM_NAME = "zfoteff_publisher_tests"
+FROM_ALIAS = "Alice"
+TO_ALIAS = "Bob"
+
+
+class RoomPublisherTests(unittest.TestCase):
+    """Test cases for the RoomPublisher class object"""
+
+    def setUp(self) -> None:
+        self.broker = LocalBroker(confirm_latency_ms=5)
+        self.broker.declare_queue(ROOM_NAME)
+        self.broker.declare_exchange(room_exchange(ROOM_NAME), RMQ_DEFAULT_EXCHANGE_TYPE)
+        self.broker.bind(ROOM_NAME, room_exchange(ROOM_NAME), "")
+        return super().setUp()
+
+    def test_publish_batches_confirms(self):
+        """Assert that every message reaches the room's queue, with far fewer acks than messages"""
+        publisher = RoomPublisher(self.broker.connect, num_channels=2, confirm_batch=50)
+        for counter in range(500):
+            publisher.publish(ROOM_NAME, f"message {counter}".encode())
+        self.assertTrue(publisher.flush(5))
+        publisher.close()
+        stats = publisher.stats()
+        self.assertEqual((stats['published'], stats['confirmed'], stats['unconfirmed']), (500, 500, 0))
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 500)
+        self.assertLess(self.broker.stats()['acks'], 50)
+
+    def test_chat_room_publishes_accepted_messages(self):
+        """Assert that a ChatRoom publishes each accepted message to its exchange"""
+        publisher = RoomPublisher(self.broker.connect)
+        set_room_publisher(publisher)
+        try:
+            room = ChatRoom(room_name=ROOM_NAME, room_type=CHAT_ROOM_TYPE_PUBLIC, owner_alias=FROM_ALIAS)
+            room.send_message("published message", FROM_ALIAS, TO_ALIAS)
+            room.send_messages([("batch message 1", FROM_ALIAS, TO_ALIAS), ("batch message 2", FROM_ALIAS, TO_ALIAS)])
+            self.assertTrue(publisher.flush(5))
+        finally:
+            set_room_publisher(None)
+            publisher.close()
+        bodies = [json.loads(self.broker.get(ROOM_NAME)) for _ in range(3)]
+        self.assertEqual([body['message'] for body in bodies], ["published message", "batch message 1", "batch message 2"])
+        self.assertIsNone(self.broker.get(ROOM_NAME))
+
+    def test_reconnect_backs_off_while_broker_is_down(self):
+        """Assert that publishes made while the broker is down share one reconnect loop that backs off, and are
+        all delivered once it is back"""
+        self.broker.available = False
+        publisher = RoomPublisher(self.broker.connect, min_reconnect_delay=0.05, max_reconnect_delay=0.2)
+        for counter in range(10):
+            publisher.publish(ROOM_NAME, f"message {counter}".encode())
+        time.sleep(0.3)
+        #   Attempts at 0, 0.05, 0.15 and 0.35 seconds: one loop, not a connection per publish
+        self.assertLessEqual(self.broker.stats()['connections'], 4)
+        self.broker.available = True
+        self.assertTrue(publisher.flush(5))
+        publisher.close()
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 10)
+
+    def test_nacked_publishes_are_dropped_after_max_nacks(self):
+        """Assert that a message the broker keeps nacking is retried max_nacks times, then dropped"""
+        self.broker.nacking = True
+        publisher = RoomPublisher(self.broker.connect, max_nacks=3)
+        publisher.publish(ROOM_NAME, b"nacked message")
+        self.assertTrue(publisher.flush(5))
+        publisher.close()
+        stats = publisher.stats()
+        self.assertEqual((stats['nacked'], stats['dropped'], stats['unconfirmed']), (3, 1, 0))
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 0)
+
+    def test_declared_exchanges_are_bounded(self):
+        """Assert that each channel remembers at most max_exchanges declared exchanges, and declares an
+        exchange it has forgotten again"""
+        publisher = RoomPublisher(self.broker.connect, num_channels=1, max_exchanges=2)
+        declares = self.broker.stats()['declares']
+        for room_name in (ROOM_NAME, f"{ROOM_NAME}_1", ROOM_NAME, f"{ROOM_NAME}_2", f"{ROOM_NAME}_3", ROOM_NAME):
+            publisher.publish(room_name, b"message")
+            self.assertTrue(publisher.flush(5))
+        publisher.close()
+        self.assertEqual(self.broker.stats()['declares'] - declares, 5)
+        self.assertEqual(self.broker.queue_depth(ROOM_NAME), 3)
+
+    def test_close_before_connecting(self):
+        """Assert that closing a publisher while its I/O thread waits to reconnect stops the thread"""
+        self.broker.available = False
+        publisher = RoomPublisher(self.broker.connect, min_reconnect_delay=0.05, max_reconnect_delay=0.05)
+        publisher.publish(ROOM_NAME, b"message")
+        publisher.close(timeout=0.1)
+        connections = self.broker.stats()['connections']
+        time.sleep(0.2)
+        self.assertEqual(self.broker.stats()['connections'], connections)
+        self.assertEqual(publisher.stats()['unconfirmed'], 1)
@@ -0,0 +1,43 @@
+"""Test suite for unit testing the read receipts"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import mongomock
+from bin.write_behind import get_write_behind_buffer
+from src.read_receipts import ReadReceipts
+
+ROOM_NAME = "zfoteff_receipt_tests"
+TO_ALIAS = "Bob"
+
+
+class ReadReceiptsTests(unittest.TestCase):
+    """Test cases for the ReadReceipts class object"""
+
+    def setUp(self) -> None:
+        self.collection = mongomock.MongoClient().cpsc313.receipts
+        return super().setUp()
+
+    def test_reads_coalesce_into_one_write(self):
+        """Assert that many reads between flushes become a single upsert of the highest cursor"""
+        receipts = ReadReceipts(ROOM_NAME, self.collection)
+        for sequence_num in range(1, 101):
+            receipts.advance(TO_ALIAS, sequence_num)
+        self.assertFalse(receipts.advance(TO_ALIAS, 50))
+        buffer = get_write_behind_buffer(self.collection)
+        self.assertEqual(buffer.queue_depth, 1)
+        buffer.flush()
+        self.assertEqual(self.collection.count_documents({}), 1)
+        self.assertEqual(self.collection.find_one({'alias': TO_ALIAS})['sequence_num'], 100)
+        self.assertEqual(ReadReceipts(ROOM_NAME, self.collection).cursor(TO_ALIAS), 100)
+
+    def test_stored_cursor_never_moves_back(self):
+        """Assert that a stale receipt from another instance can not lower the stored cursor"""
+        ReadReceipts(ROOM_NAME, self.collection, write_behind=False).advance(TO_ALIAS, 10)
+        stale = ReadReceipts(ROOM_NAME, self.collection, write_behind=False)
+        self.assertTrue(stale.is_read(TO_ALIAS, 10))
+        self.assertFalse(stale.is_read(TO_ALIAS, 11))
+        self.collection.update_one({'alias': TO_ALIAS}, {'$set': {'sequence_num': 20}})
+        stale.advance(TO_ALIAS, 15)
+        self.assertEqual(self.collection.find_one({'alias': TO_ALIAS})['sequence_num'], 20)
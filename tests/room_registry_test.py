@@ -0,0 +1,99 @@
+"""Test suite for unit testing the RoomRegistry class"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import time
+import mongomock
+from bin import db
+from bin.constants import *
+from bin.notifier import get_room_notifier
+from bin.write_behind import close_write_behind_buffers
+from src.room_registry import RoomRegistry
+
+FROM_ALIAS = "Alice"
+TO_ALIAS = "Bob"
+
+
+class RoomRegistryTests(unittest.TestCase):
+    """Test cases for the RoomRegistry class object"""
+
+    def setUp(self) -> None:
+        self.client = mongomock.MongoClient()
+        self.addCleanup(db.set_client, db.set_client(self.client, close_previous=False))
+        return super().setUp()
+
+    def test_hit_returns_resident_room(self):
+        """Assert that a second lookup returns the same resident ChatRoom"""
+        registry = RoomRegistry()
+        room = registry.get("zfoteff_registry")
+        self.assertIs(registry.get("zfoteff_registry"), room)
+        stats = registry.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_evicts_least_recently_used(self):
+        """Assert that the least recently used room is evicted when the room bound is exceeded"""
+        registry = RoomRegistry(max_rooms=2)
+        registry.get("room_a")
+        registry.get("room_b").send_message("message", FROM_ALIAS, TO_ALIAS)
+        self.assertGreater(get_room_notifier().high_water_mark("room_b"), 0)
+        registry.get("room_a")
+        registry.get("room_c")
+        self.assertIn("room_a", registry)
+        self.assertNotIn("room_b", registry)
+        self.assertEqual(registry.stats()['evictions'], 1)
+        self.assertEqual(get_room_notifier().high_water_mark("room_b"), 0)
+
+    def test_evicts_on_memory_bound(self):
+        """Assert that rooms are evicted once their approximate memory exceeds the byte bound"""
+        registry = RoomRegistry(max_bytes=1)
+        registry.get("room_a")
+        registry.get("room_b")
+        self.assertEqual(registry.length, 1)
+        self.assertIn("room_b", registry)
+
+    def test_eviction_flushes_dirty_state(self):
+        """Assert that a room's unsaved messages are written when it is evicted"""
+        registry = RoomRegistry(max_rooms=1)
+        room = registry.get("room_a", write_behind=False)
+        room.send_message("evicted message", FROM_ALIAS, TO_ALIAS)
+        room.get_messages(TO_ALIAS)
+        registry.get("room_b")
+        self.assertNotIn("room_a", registry)
+        stored = self.client[db.DB_NAME].rooms.find_one({'message': "evicted message"})
+        #   Reads are recorded in the read receipts, not by rewriting the message
+        self.assertEqual(stored['mess_props']['mess_type'], MESSAGE_SENT)
+        close_write_behind_buffers()
+        receipt = self.client[db.DB_NAME].receipts.find_one({'room_name': "room_a", 'alias': TO_ALIAS})
+        self.assertEqual(receipt['sequence_num'], stored['mess_props']['sequence_num'])
+
+    def test_refresh_reads_messages_saved_elsewhere(self):
+        """Assert that a resident room picks up messages another process saved to the room"""
+        registry = RoomRegistry(refresh_seconds=0)
+        room = registry.get("room_a", write_behind=False)
+        room.send_message("resident message", FROM_ALIAS, TO_ALIAS)
+        other_worker = RoomRegistry()
+        other_worker.get("room_a", write_behind=False).send_message("saved elsewhere", TO_ALIAS, FROM_ALIAS)
+        self.assertIs(registry.get("room_a"), room)
+        self.assertEqual(room.get_messages(FROM_ALIAS), ["resident message", "saved elsewhere"])
+        self.assertEqual(len(room.refresh()), 0)
+
+    def test_evicted_rooms_go_to_on_evict(self):
+        """Assert that evicted rooms are handed to on_evict instead of being persisted under the registry lock"""
+        evicted = list()
+        registry = RoomRegistry(max_rooms=1, on_evict=evicted.append)
+        room = registry.get("room_a", write_behind=False)
+        registry.get("room_b")
+        self.assertEqual(evicted, [room])
+        self.assertEqual(registry.stats()['evictions'], 1)
+
+    def test_expired_rooms_go_to_on_evict(self):
+        """Assert that a room past its TTL is handed to on_evict and rebuilt, not persisted under the lock"""
+        expired = list()
+        registry = RoomRegistry(ttl_seconds=0.01, on_evict=expired.append)
+        room = registry.get("room_a")
+        time.sleep(0.02)
+        self.assertIsNot(registry.get("room_a"), room)
+        self.assertEqual(expired, [room])
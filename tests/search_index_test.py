@@ -0,0 +1,49 @@
+"""Test suite for unit testing the SearchIndex class"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+from bin.constants import *
+from src.search_index import SearchIndex, tokenize
+
+ROOM_NAME = "zfoteff_search_index_tests"
+MESSAGES = ["Lunch at noon?", "lunch moved to one", "Dinner at six", "launch party at noon"]
+
+
+class SearchIndexTests(unittest.TestCase):
+    """Test cases for SearchIndex class object"""
+
+    def setUp(self) -> None:
+        self.index = SearchIndex(ROOM_NAME)
+        for sequence_num, message in enumerate(MESSAGES):
+            self.index.add(sequence_num, message)
+        return super().setUp()
+
+    def test_tokenize(self):
+        """Test that text is split into lower case word tokens"""
+        self.assertEqual(tokenize("Lunch at noon?"), ["lunch", "at", "noon"])
+
+    def test_and_query(self):
+        """Test that every term of a query must match, newest first"""
+        self.assertEqual(self.index.search("at noon"), [3, 0])
+        self.assertEqual(self.index.search("LUNCH noon"), [0])
+        self.assertEqual(self.index.search("lunch dinner"), [])
+        self.assertEqual(self.index.search("?"), [])
+        self.assertEqual(self.index.search("at", limit=2), [3, 2])
+
+    def test_prefix_query(self):
+        """Test that a term ending in '*' matches tokens with that prefix"""
+        self.assertEqual(self.index.search("l*"), [3, 1, 0])
+        self.assertEqual(self.index.search("lu* noon"), [0])
+
+    def test_rebuild_matches_incremental(self):
+        """Test that a bulk rebuild produces the same results as adding messages one at a time"""
+        rebuilt = SearchIndex(ROOM_NAME)
+        rebuilt.rebuild({'message': message, 'mess_props': {'sequence_num': sequence_num}}
+                        for sequence_num, message in reversed(list(enumerate(MESSAGES))))
+        self.assertEqual(rebuilt.num_postings, self.index.num_postings)
+        for query in ["at noon", "l*", "six", "moved to"]:
+            self.assertEqual(rebuilt.search(query), self.index.search(query))
+        self.index.add(1, MESSAGES[1])
+        self.assertEqual(rebuilt.num_postings, self.index.num_postings)
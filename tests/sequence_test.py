@@ -0,0 +1,91 @@
+"""Test suite for unit testing the hi/lo sequence number allocator"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import time
+from concurrent.futures import ThreadPoolExecutor
+import mongomock
+from bin.constants import *
+from bin.sequence import SequenceAllocator, SequenceOwnershipError
+
+ROOM_NAME = "zfoteff_sequence_tests"
+RESERVE_SECONDS = 0.05
+
+
+class SlowCollection:
+    """Collection whose block reservations take RESERVE_SECONDS, like a round trip to a remote MongoDB"""
+
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    def find_one_and_update(self, *args, **kwargs):
+        time.sleep(RESERVE_SECONDS)
+        return self.collection.find_one_and_update(*args, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self.collection, name)
+
+
+class SequenceAllocatorTests(unittest.TestCase):
+    """Test cases for the SequenceAllocator class object"""
+
+    def setUp(self) -> None:
+        self.collection = mongomock.MongoClient().cpsc313.sequence
+        return super().setUp()
+
+    def test_numbers_increase_within_room(self):
+        """Assert that numbers handed out for a room keep increasing across block boundaries"""
+        allocator = SequenceAllocator(self.collection, block_size=10)
+        sequence_nums = [allocator.allocate(ROOM_NAME) for _ in range(25)]
+        self.assertEqual(sequence_nums, list(range(1, 26)))
+        self.assertEqual(self.collection.find_one({'_id': ROOM_NAME})['next'], 30)
+
+    def test_room_has_a_single_writer(self):
+        """Assert that a second allocator, like a second API worker, can not write to a room another one holds
+        until that one releases it, and then continues above every number handed out before"""
+        first_worker = SequenceAllocator(self.collection, block_size=10)
+        second_worker = SequenceAllocator(self.collection, block_size=10)
+        sequence_nums = [first_worker.allocate(ROOM_NAME) for _ in range(15)]
+        with self.assertRaises(SequenceOwnershipError):
+            second_worker.allocate(ROOM_NAME)
+        self.assertEqual(second_worker.allocate(f"{ROOM_NAME}_other"), 1)
+        first_worker.release()
+        self.assertGreater(second_worker.allocate(ROOM_NAME), max(sequence_nums))
+        with self.assertRaises(SequenceOwnershipError):
+            first_worker.allocate(ROOM_NAME)
+
+    def test_lease_expires(self):
+        """Assert that a room passes to another allocator once its writer's lease runs out, and that the old
+        writer stops serving its block before then"""
+        first_worker = SequenceAllocator(self.collection, block_size=10, lease_seconds=0.05)
+        second_worker = SequenceAllocator(self.collection, block_size=10, lease_seconds=0.05)
+        self.assertEqual(first_worker.allocate(ROOM_NAME), 1)
+        time.sleep(0.06)
+        self.assertEqual(second_worker.allocate(ROOM_NAME), 11)
+        with self.assertRaises(SequenceOwnershipError):
+            first_worker.allocate(ROOM_NAME)
+
+    def test_allocate_many(self):
+        """Assert that a batch larger than the block is served with the rest of the block plus one reservation"""
+        allocator = SequenceAllocator(self.collection, block_size=10)
+        allocator.allocate(ROOM_NAME)
+        sequence_nums = allocator.allocate_many(ROOM_NAME, 30)
+        self.assertEqual(sequence_nums, list(range(2, 32)))
+        self.assertEqual(allocator.allocate(ROOM_NAME), 32)
+
+    def test_seeded_from_legacy_counter(self):
+        """Assert that a room with a counter in the legacy shared document continues after it"""
+        self.collection.insert_one({'_id': SEQUENCE_LEGACY_ID, ROOM_NAME: 41})
+        allocator = SequenceAllocator(self.collection, block_size=10)
+        self.assertEqual(allocator.allocate(ROOM_NAME), 42)
+
+    def test_rooms_reserve_in_parallel(self):
+        """Assert that a block reservation for one room does not wait for the reservations of other rooms"""
+        allocator = SequenceAllocator(SlowCollection(self.collection), block_size=10)
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            sequence_nums = list(executor.map(allocator.allocate, [f"{ROOM_NAME}_{counter}" for counter in range(10)]))
+        self.assertEqual(sequence_nums, [1] * 10)
+        self.assertLess(time.perf_counter() - start_time, RESERVE_SECONDS * 5)
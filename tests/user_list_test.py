@@ -5,6 +5,9 @@ __author__ = "Zac Foteff"
 
 import unittest
 import time
+import string
+import random
+from datetime import timedelta
 from bin.logger import Logger
 from src.chat_user import ChatUser
 from src.user_list import UserList
@@ -67,3 +70,50 @@ class UserListWithChatUserTest(unittest.TestCase):
         self.assertIsInstance(user, ChatUser)
         elapsed_time = time.perf_counter() - start_time
         log(f"[+] Completed get user test in {elapsed_time:.5f}")
+
+
+class UserListLookupTests(unittest.TestCase):
+    """Test cases for alias lookups on the UserList class object"""
+
+    TEST_USER_LIST_NAME = "zfoteff_test_users"
+
+    def setUp(self) -> None:
+        return super().setUp()
+
+    def generate_random_string(self, length):
+        letters = string.ascii_lowercase
+        return ''.join(random.choice(letters) for _ in range(length))
+
+    def test_alias_view_is_cached(self):
+        """Assert that the alias view is reused until the list changes, and keeps registration order"""
+        user_list = UserList(self.TEST_USER_LIST_NAME)
+        first_alias = self.generate_random_string(12)
+        second_alias = self.generate_random_string(12)
+        user_list.register(first_alias)
+        alias_view = user_list.get_all_users()
+        self.assertIs(user_list.get_all_users(), alias_view)
+        user_list.register(second_alias)
+        self.assertIsNot(user_list.get_all_users(), alias_view)
+        self.assertEqual(user_list.get_all_users()[-2:], (first_alias, second_alias))
+
+    def test_deregister_removes_alias(self):
+        """Assert that a deregistered alias can no longer be found"""
+        user_list = UserList(self.TEST_USER_LIST_NAME)
+        alias = self.generate_random_string(12)
+        user_list.register(alias)
+        self.assertTrue(user_list.is_registered(alias))
+        self.assertIn(alias, user_list)
+        self.assertTrue(user_list.deregister(alias))
+        self.assertFalse(user_list.is_registered(alias))
+        self.assertIsNone(user_list.get(alias))
+        self.assertNotIn(alias, user_list.get_all_users())
+        self.assertFalse(UserList(self.TEST_USER_LIST_NAME).is_registered(alias))
+
+    def test_register_saves_metadata(self):
+        """Assert that registering a user saves the list's new modify time"""
+        user_list = UserList(self.TEST_USER_LIST_NAME)
+        user_list.register(self.generate_random_string(12))
+        self.assertFalse(user_list.dirty)
+        #   MongoDB keeps times to the millisecond
+        self.assertAlmostEqual(UserList(self.TEST_USER_LIST_NAME).metadata()['modify_time'],
+                               user_list.metadata()['modify_time'], delta=timedelta(milliseconds=1))
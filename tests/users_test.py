@@ -28,9 +28,20 @@ class ChatUserTests(unittest.TestCase):
         self.assertIsNotNone(chat_user)
         self.assertIsInstance(chat_user, ChatUser)
         self.assertEqual(chat_user.alias, self.TEST_ALIAS)
-        self.assertEqual(chat_user.blocked_users, [])
+        self.assertEqual(chat_user.blocked_users, set())
         self.assertFalse(chat_user.removed)
         elapsed_time = time.perf_counter() - start_time
         log(str(chat_user), 'd')
         log(str(chat_user.to_dict()), 'd')
         log(f"[+] Completed create single instance test in {elapsed_time:.5f}")
+
+    def test_block_user(self):
+        """Block a user and assert the block is found and saved as an array
+        """
+        chat_user = ChatUser(self.TEST_ALIAS)
+        chat_user.block_user("Eve")
+        chat_user.block_user("Eve")
+        self.assertTrue(chat_user.is_blocked("Eve"))
+        self.assertFalse(chat_user.is_blocked(self.TEST_ALIAS))
+        self.assertEqual(chat_user.blocked_users, {"Eve"})
+        self.assertEqual(chat_user.metadata()['blacklist'], ["Eve"])
@@ -0,0 +1,84 @@
+"""Test suite for unit testing the write-behind buffer"""
+
+__version__ = "1.0.0"
+__author__ = "Zac Foteff"
+
+import unittest
+import time
+import mongomock
+from pymongo import UpdateOne
+from bin import db
+from bin.write_behind import WriteBehindBuffer, get_write_behind_buffer, close_write_behind_buffers
+from src.chat_room import ChatRoom
+
+FROM_ALIAS = "Alice"
+TO_ALIAS = "Bob"
+
+
+class WriteBehindBufferTests(unittest.TestCase):
+    """Test cases for the WriteBehindBuffer class object"""
+
+    def setUp(self) -> None:
+        self.collection = mongomock.MongoClient().cpsc313.write_behind
+        return super().setUp()
+
+    def upsert(self, key: str, value: int) -> UpdateOne:
+        return UpdateOne({'_id': key}, {'$set': {'value': value}}, upsert=True)
+
+    def test_flush_on_batch_size(self):
+        """Assert that a full batch is flushed well before the latency limit"""
+        buffer = WriteBehindBuffer(self.collection, max_batch=10, max_latency_ms=60000)
+        for counter in range(10):
+            buffer.submit(counter, self.upsert(f"doc{counter}", counter))
+        deadline = time.monotonic() + 5
+        while self.collection.count_documents({}) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.collection.count_documents({}), 10)
+        self.assertEqual(buffer.stats()['queue_depth'], 0)
+        buffer.close()
+
+    def test_flush_on_latency(self):
+        """Assert that a partial batch is flushed once the latency limit passes"""
+        buffer = WriteBehindBuffer(self.collection, max_batch=500, max_latency_ms=20)
+        buffer.submit("doc", self.upsert("doc", 1))
+        time.sleep(0.5)
+        self.assertEqual(self.collection.count_documents({}), 1)
+        self.assertEqual(buffer.stats()['flushes'], 1)
+        buffer.close()
+
+    def test_close_flushes_and_coalesces(self):
+        """Assert that closing writes pending operations, keeping only the latest per key"""
+        buffer = WriteBehindBuffer(self.collection, max_batch=500, max_latency_ms=60000)
+        buffer.submit("doc", self.upsert("doc", 1))
+        buffer.submit("doc", self.upsert("doc", 2))
+        self.assertEqual(buffer.queue_depth, 1)
+        buffer.close()
+        self.assertEqual(self.collection.find_one({'_id': "doc"})['value'], 2)
+        self.assertEqual(buffer.stats()['flushed_ops'], 1)
+
+
+class WriteBehindChatRoomTests(unittest.TestCase):
+    """Test cases for ChatRoom objects in write-behind mode"""
+
+    def setUp(self) -> None:
+        self.client = mongomock.MongoClient()
+        self.addCleanup(db.set_client, db.set_client(self.client, close_previous=False))
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        close_write_behind_buffers()
+        return super().tearDown()
+
+    def test_put_is_committed_on_close(self):
+        """Assert that messages put in write-behind mode are in the deque immediately and stored once flushed"""
+        room = ChatRoom(room_name="zfoteff_write_behind", write_behind=True)
+        room.send_message("write behind message", FROM_ALIAS, TO_ALIAS)
+        self.assertIsNotNone(room.find_message("write behind message"))
+        close_write_behind_buffers()
+        stored = self.client[db.DB_NAME].rooms.find_one({'message': "write behind message"})
+        self.assertIsNotNone(stored)
+
+    def test_rooms_share_buffer(self):
+        """Assert that rooms stored in the same collection share one buffer"""
+        collection = self.client[db.DB_NAME].rooms
+        self.assertIs(get_write_behind_buffer(collection), get_write_behind_buffer(collection))